@@ -0,0 +1,170 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Throughput and latency of every route of the API, provisioning instances
+against the local stand-ins of benchmarks.standins: a docker API on port
+4243 serving the hosts 127.0.0.1 and 127.0.0.2, redis servers and sentinels,
+Zabbix and the ACL API. Each instance goes through its whole life: it is
+added, checked, bound to an app and to units, listed, unbound and removed.
+
+Usage: MONGODB_URI=mongodb://localhost:27017/redisapi_bench python -m benchmarks.api
+
+Settings: BENCH_INSTANCES (default 50), BENCH_CONCURRENCY (8), BENCH_PLANS
+(basic,plus), BENCH_LATENCY_MS (5) for every stand-in or
+BENCH_DOCKER_LATENCY_MS, BENCH_REDIS_LATENCY_MS, BENCH_ZABBIX_LATENCY_MS and
+BENCH_ACL_LATENCY_MS for each one, and BENCH_PORT_RANGE_START (42000). With
+BENCH_MONGOMOCK=1 mongomock replaces MongoDB.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from benchmarks import standins
+
+
+def latency(name):
+    default = os.environ.get("BENCH_LATENCY_MS", "5")
+    return float(os.environ.get("BENCH_{}_LATENCY_MS".format(name), default)) / 1000
+
+
+def use_mongomock():
+    import mongomock
+    import pymongo
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+
+
+def plain_http_revokes():
+    # the ACL client always revokes over HTTPS, the stand-in only speaks
+    # HTTP.
+    from aclapiclient import aclapiclient
+
+    def remove_tcp_permit_access(self, desc, source, dest, l4_opts):
+        body = {"kind": "object#acl", "rules": [{
+            "protocol": "tcp", "source": source, "destination": dest,
+            "action": "permit", "l4-options": l4_opts.to_dict()}]}
+        url = "{}/api/ipv4/acl/{}".format(self.base_url, source)
+        resp = self.session.request("PURGE", url, data=json.dumps(body))
+        self._raises_on_error(resp, body)
+        self.jobs.append(resp.headers["location"])
+        return resp
+
+    aclapiclient.Client.remove_tcp_permit_access = remove_tcp_permit_access
+
+
+def start_standins():
+    standins.docker_server(4243, latency("DOCKER"), latency("REDIS"))
+    sentinels = [standins.redis_server(latency=latency("REDIS")) for _ in range(3)]
+    zabbix = standins.zabbix_server(latency("ZABBIX"))
+    acl = standins.acl_server(latency("ACL"))
+    os.environ.update({
+        "REDIS_IMAGE": "redisapi/redis",
+        "DOCKER_HOSTS": json.dumps(["http://127.0.0.1:4243", "http://127.0.0.2:4243"]),
+        "SENTINEL_HOSTS": json.dumps([standins.address(s) for s in sentinels]),
+        "PORT_RANGE_START": os.environ.get("BENCH_PORT_RANGE_START", "42000"),
+        "REDIS_API_PLANS": json.dumps(["basic", "plus"]),
+        "HEALTH_CHECKER": "zabbix",
+        "ZABBIX_URL": standins.address(zabbix),
+        "ZABBIX_USER": "redisapi",
+        "ZABBIX_PASSWORD": "redisapi",
+        "ZABBIX_HOST": "1",
+        "ZABBIX_INTERFACE": "1",
+        "REDISAPI_ACCESS_MANAGER": "globo-acl-api",
+        "ACL_API_ENDPOINT": standins.address(acl),
+        "ACL_API_USERNAME": "redisapi",
+        "ACL_API_PASSWORD": "redisapi",
+        "ADMIN_TOKEN": "redisapi",
+    })
+    plain_http_revokes()
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def request(self, client, method, route, path, expected, **kwargs):
+        start = time.time()
+        response = client.open(path, method=method, **kwargs)
+        elapsed = time.time() - start
+        with self.lock:
+            self.timings[(method, route)].append(elapsed)
+            if response.status_code not in expected:
+                self.errors[(method, route)] += 1
+        return response
+
+
+def lifecycle(recorder, app, index, plan):
+    client = app.test_client()
+    name = "bench-{}".format(index)
+    units = ["10.{}.{}.{}".format(index / 250 % 250, index % 250, unit) for unit in range(1, 4)]
+    form = {"headers": {"Content-Type": "application/x-www-form-urlencoded"}}
+    resource = "/resources/" + name
+
+    def request(method, route, path, expected, **kwargs):
+        return recorder.request(client, method, route, path, expected, **kwargs)
+
+    request("POST", "/resources", "/resources", (201,), data={"name": name, "plan": plan})
+    request("GET", "/resources/<name>/status", resource + "/status", (204,))
+    request("POST", "/resources/<name>/bind-app", resource + "/bind-app", (201,))
+    request("POST", "/resources/<name>/bind", resource + "/bind", (201,),
+            data={"unit-host": units[0]})
+    request("POST", "/resources/<name>/bind-units", resource + "/bind-units", (201,),
+            data={"unit-host": units[1:]})
+    request("GET", "/resources/plans", "/resources/plans", (200,))
+    request("GET", "/resources", "/resources?plan={}&limit=100".format(plan), (200,),
+            headers={"Authorization": "Bearer redisapi"})
+    request("DELETE", "/resources/<name>/bind-units", resource + "/bind-units", (200,),
+            data={"unit-host": units[1:]}, **form)
+    request("DELETE", "/resources/<name>/bind", resource + "/bind", (200,),
+            data={"unit-host": units[0]}, **form)
+    request("DELETE", "/resources/<name>/bind-app", resource + "/bind-app", (200,))
+    request("DELETE", "/resources/<name>", resource, (200,))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+
+def report(recorder, elapsed):
+    total = sum(len(timings) for timings in recorder.timings.values())
+    print("{} requests in {:.2f}s, {:.1f} requests/s".format(total, elapsed, total / elapsed))
+    print("{:<8} {:<32} {:>7} {:>7} {:>9} {:>9}".format(
+        "method", "route", "count", "errors", "p50 ms", "p99 ms"))
+    for (method, route), timings in sorted(recorder.timings.items()):
+        print("{:<8} {:<32} {:>7} {:>7} {:>9.1f} {:>9.1f}".format(
+            method, route, len(timings), recorder.errors[(method, route)],
+            percentile(timings, 50) * 1000, percentile(timings, 99) * 1000))
+
+
+def main():
+    if os.environ.get("BENCH_MONGOMOCK") == "1":
+        use_mongomock()
+    start_standins()
+    from redisapi import api, mongodb_database
+    from redisapi.storage import ensure_indexes
+    mongodb_database().client.drop_database(mongodb_database().name)
+    ensure_indexes()
+
+    instances = int(os.environ.get("BENCH_INSTANCES", "50"))
+    concurrency = int(os.environ.get("BENCH_CONCURRENCY", "8"))
+    plans = os.environ.get("BENCH_PLANS", "basic,plus").split(",")
+    recorder = Recorder()
+    pool = ThreadPool(concurrency)
+    start = time.time()
+    pool.map(lambda i: lifecycle(recorder, api.app, i, plans[i % len(plans)]),
+             range(instances))
+    report(recorder, time.time() - start)
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
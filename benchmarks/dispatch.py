@@ -0,0 +1,44 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Cost of getting the manager of a request: building a new manager (the
+old behaviour) against the per-process registry.
+
+Usage: python -m benchmarks.dispatch
+"""
+
+import os
+import sys
+import timeit
+
+ENVIRON = {
+    "REDIS_SERVER_HOST": "localhost",
+    "REDIS_IMAGE": "redisapi",
+    "DOCKER_HOSTS": '["http://10.0.0.1:4243", "http://10.0.0.2:4243"]',
+    "SENTINEL_HOSTS": '["http://10.0.0.1:26379", "http://10.0.0.2:26379"]',
+}
+
+
+def main():
+    for key, value in ENVIRON.items():
+        os.environ.setdefault(key, value)
+    from redisapi import managers
+    number = int(os.environ.get("BENCH_REQUESTS", "100000"))
+    for plan in sorted(managers.plan_managers):
+        def build():
+            manager = managers.plan_managers[plan]()
+            getattr(manager, "access_manager", None)
+
+        def cached():
+            manager = managers.manager_by_plan_name(plan)
+            getattr(manager, "access_manager", None)
+
+        for label, func in (("new manager", build), ("registry", cached)):
+            elapsed = timeit.timeit(func, number=number)
+            sys.stdout.write("{:<12} {:<12} {:.2f}us/request\n".format(
+                plan, label, elapsed / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
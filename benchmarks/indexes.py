@@ -0,0 +1,76 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Query plans and latency of the instances and zabbix lookups before and
+after ensure_indexes, on a scratch database filled with fake instances.
+
+Usage: MONGODB_URI=mongodb://localhost:27017/ python -m benchmarks.indexes
+"""
+
+import os
+import sys
+import time
+
+import redisapi
+
+from redisapi.storage import ensure_indexes
+
+
+QUERIES = [
+    ("instances", "find_instance_by_name", {"name": "instance-4242"}),
+    ("instances", "find_instances_by_host", {"endpoints.host": "10.0.0.42"}),
+    ("zabbix", "zabbix remove", {"host": "10.0.0.42", "port": 49200}),
+]
+
+
+def populate(db, total):
+    instances, items = [], []
+    for i in xrange(total):
+        host = "10.0.0.{}".format(i % 250)
+        port = 49153 + i / 250
+        instances.append({"name": "instance-{}".format(i), "plan": "basic",
+                          "endpoints": [{"host": host, "port": port,
+                                         "container_id": str(i)}]})
+        items.append({"host": host, "port": port, "item": i, "trigger": i})
+    db.instances.insert_many(instances)
+    db.zabbix.insert_many(items)
+
+
+def winning_stage(plan):
+    stage = plan.get("stage")
+    if "inputStage" in plan:
+        return "{} <- {}".format(stage, winning_stage(plan["inputStage"]))
+    return stage
+
+
+def run(db, label, rounds):
+    for collection, name, query in QUERIES:
+        explain = db[collection].find(query).explain()
+        stats = explain.get("executionStats", {})
+        start = time.time()
+        for _ in xrange(rounds):
+            list(db[collection].find(query))
+        elapsed = (time.time() - start) / rounds * 1000
+        sys.stdout.write("{:<8} {:<24} plan={} examined={} avg={:.3f}ms\n".format(
+            label, name, winning_stage(explain["queryPlanner"]["winningPlan"]),
+            stats.get("totalDocsExamined"), elapsed))
+
+
+def main():
+    total = int(os.environ.get("BENCH_INSTANCES", "100000"))
+    rounds = int(os.environ.get("BENCH_ROUNDS", "50"))
+    client = redisapi.mongodb_database().client
+    db = client[os.environ.get("BENCH_DATABASE", "redisapi_benchmark")]
+    client.drop_database(db.name)
+    try:
+        populate(db, total)
+        run(db, "before", rounds)
+        ensure_indexes(db)
+        run(db, "after", rounds)
+    finally:
+        client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    main()
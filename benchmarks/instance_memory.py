@@ -0,0 +1,78 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Memory taken by 100k instances decoded from their documents, with the old
+dict-backed model and with the slotted Instance and Endpoint classes. Needs
+no external service.
+
+Usage: python -m benchmarks.instance_memory
+"""
+
+import os
+import sys
+import time
+
+from redisapi.storage import Instance
+
+
+class DictInstance(object):
+
+    def __init__(self, name, plan, endpoints):
+        self.name = name
+        self.plan = plan
+        self.endpoints = endpoints
+
+
+def documents(total):
+    for i in xrange(total):
+        yield {"name": "instance-{}".format(i), "plan": "plus",
+               "endpoints": [{"host": "10.0.{}.{}".format(j, i % 250),
+                              "port": 49153 + i / 250,
+                              "container_id": "{:064x}".format(i * 3 + j)}
+                             for j in xrange(3)]}
+
+
+def deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(obj.__dict__, seen)
+    if hasattr(type(obj), "__slots__"):
+        size += sum(deep_size(getattr(obj, slot), seen) for slot in type(obj).__slots__
+                    if hasattr(obj, slot))
+    return size
+
+
+def measure(name, decode, total):
+    start = time.time()
+    instances = [decode(document) for document in documents(total)]
+    elapsed = time.time() - start
+    # the strings are shared by both models, only the containers are counted.
+    seen = set()
+    for instance in instances:
+        for value in (instance.name, instance.plan):
+            seen.add(id(value))
+        for endpoint in instance.endpoints:
+            for key in ("host", "port", "container_id"):
+                seen.add(id(endpoint[key]))
+    size = deep_size(instances, seen)
+    print("{:<8} {:>8.1f} MB {:>8.0f} bytes/instance {:>8.2f}s to decode".format(
+        name, size / 1024.0 / 1024, float(size) / total, elapsed))
+
+
+def main():
+    total = int(os.environ.get("BENCH_INSTANCES", "100000"))
+    print("{} instances with 3 endpoints each".format(total))
+    measure("dict", lambda doc: DictInstance(doc["name"], doc["plan"], doc["endpoints"]), total)
+    measure("slotted", Instance.from_document, total)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Per-request latency of MongoStorage lookups with a fresh client per call
+(the old behaviour) and with the shared per-process client.
+
+Usage: MONGODB_URI=mongodb://localhost:27017/ python -m benchmarks.mongo_client
+"""
+
+import os
+import sys
+import time
+
+import redisapi
+
+from redisapi.storage import Instance, MongoStorage
+
+
+def fresh_client_db():
+    mongodb_uri = os.environ.get("MONGODB_URI", "mongodb://localhost:27017/")
+    database_name = os.environ.get("DATABASE_NAME", "redisapi")
+    # a client of its own on every call, as each storage call built before.
+    from pymongo import MongoClient
+    return MongoClient(mongodb_uri)[database_name]
+
+
+def measure(db_factory, name, requests):
+    storage = MongoStorage()
+    storage.db = db_factory
+    timings = []
+    for _ in xrange(requests):
+        start = time.time()
+        storage.find_instance_by_name(name)
+        timings.append(time.time() - start)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p50 = timings[len(timings) / 2] * 1000
+    p99 = timings[int(len(timings) * 0.99)] * 1000
+    sys.stdout.write("{:<16} requests={} p50={:.3f}ms p99={:.3f}ms\n".format(
+        label, len(timings), p50, p99))
+
+
+def main():
+    requests = int(os.environ.get("BENCH_REQUESTS", "1000"))
+    name = "bench-mongo-client"
+    storage = MongoStorage()
+    instance = Instance(name, "basic", [{"host": "10.0.0.1", "port": 49153,
+                                         "container_id": "bench"}])
+    storage.add_instance(instance)
+    try:
+        report("client per call", measure(fresh_client_db, name, requests))
+        report("shared client", measure(redisapi.mongodb_database, name, requests))
+    finally:
+        storage.remove_instance(instance)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+"""Local stand-ins for the services the API talks to: the docker API, redis
+servers and sentinels, Zabbix and the ACL API. Every stand-in waits
+``latency`` seconds before answering, so the benchmarks can reproduce slow
+backends.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import itertools
+import json
+import threading
+import time
+import uuid
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # clients going away, mostly when the benchmark exits.
+        pass
+
+
+class ThreadingTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class RedisHandler(SocketServer.StreamRequestHandler):
+    """Speaks enough of the redis protocol for PING, INFO, SLAVEOF and the
+    SENTINEL commands, every other command is answered with OK. After
+    SLAVEOF, INFO reports a replica whose link to the master is up.
+    """
+
+    def handle(self):
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            time.sleep(self.server.latency)
+            name = command[0].upper()
+            if name == "PING":
+                self.wfile.write("+PONG\r\n")
+            elif name == "INFO":
+                info = "# Replication\r\nrole:master\r\nconnected_slaves:0\r\n"
+                if self.server.master:
+                    info = "# Replication\r\nrole:slave\r\nmaster_host:{}\r\n" \
+                           "master_port:{}\r\nmaster_link_status:up\r\n".format(
+                               *self.server.master)
+                self.wfile.write("${}\r\n{}\r\n".format(len(info), info))
+            elif name == "SLAVEOF":
+                self.server.master = None if command[1].upper() == "NO" else command[1:3]
+                self.wfile.write("+OK\r\n")
+            else:
+                self.wfile.write("+OK\r\n")
+            self.wfile.flush()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith("*"):
+            return line.split()
+        command = []
+        for _ in xrange(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(length + 2)[:-2])
+        return command
+
+
+def redis_server(host="127.0.0.1", port=0, latency=0):
+    server = ThreadingTCPServer((host, port), RedisHandler)
+    server.latency = latency
+    server.master = None
+    return serve(server)
+
+
+class JSONHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else ""
+        return json.loads(data) if data else {}
+
+    def reply(self, status, body=None, headers=None):
+        time.sleep(self.server.latency)
+        data = json.dumps(body) if body is not None else ""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class DockerHandler(JSONHandler):
+    """Creates, starts, stops and removes containers. Starting a container
+    starts a redis stand-in on the host port bound by the container, on the
+    address the request was sent to, so each docker host of the benchmark
+    (127.0.0.1, 127.0.0.2...) gets its own redis servers.
+    """
+
+    def do_POST(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        body = self.body()
+        if parts[1:] == ["containers", "create"]:
+            return self.reply(201, {"Id": uuid.uuid4().hex, "Warnings": []})
+        container = parts[2]
+        if parts[3] == "start":
+            host = self.headers.get("Host", "127.0.0.1").split(":")[0]
+            servers = []
+            for bindings in (body.get("PortBindings") or {}).values():
+                for binding in bindings:
+                    servers.append(redis_server(host, int(binding["HostPort"]),
+                                                self.server.redis_latency))
+            self.server.containers[container] = servers
+        elif parts[3] == "stop":
+            for server in self.server.containers.pop(container, []):
+                server.shutdown()
+                server.server_close()
+        self.reply(204)
+
+    def do_DELETE(self):
+        self.reply(204)
+
+
+def docker_server(port=4243, latency=0, redis_latency=0):
+    server = ThreadingHTTPServer(("0.0.0.0", port), DockerHandler)
+    server.latency = latency
+    server.redis_latency = redis_latency
+    server.containers = {}
+    return serve(server)
+
+
+class ZabbixHandler(JSONHandler):
+
+    def do_POST(self):
+        request = self.body()
+        method, params = request["method"], request["params"]
+        ids = self.server.ids
+        if method == "user.login":
+            result = "token"
+        elif method == "item.create":
+            result = {"itemids": [str(next(ids)) for _ in params]}
+        elif method == "trigger.create":
+            result = {"triggerids": [str(next(ids)) for _ in params]}
+        else:
+            result = {}
+        self.reply(200, {"jsonrpc": "2.0", "result": result, "id": request["id"]})
+
+
+def zabbix_server(latency=0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ZabbixHandler)
+    server.latency = latency
+    server.ids = itertools.count(1)
+    return serve(server)
+
+
+class ACLHandler(JSONHandler):
+    """Accepts rules and answers with a job, which is run by a GET on the
+    job path followed by /run.
+    """
+
+    def do_PUT(self):
+        self.body()
+        job = "/api/jobs/{}".format(next(self.server.ids))
+        self.reply(200, {"jobs": [job]}, {"Location": job})
+
+    do_PURGE = do_PUT
+
+    def do_GET(self):
+        self.reply(200, {})
+
+
+def acl_server(latency=0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ACLHandler)
+    server.latency = latency
+    server.ids = itertools.count(1)
+    return serve(server)
+
+
+def address(server):
+    host, port = server.server_address[:2]
+    return "http://{}:{}".format(host if host != "0.0.0.0" else "127.0.0.1", port)
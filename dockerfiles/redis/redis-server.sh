@@ -1,2 +1,9 @@
 #!/bin/bash
-/usr/bin/redis-server --loglevel warning --maxmemory 1073741824 --port $REDIS_PORT
+# the settings come from the profile of the plan, see redisapi/plans.py. An
+# empty REDIS_SAVE disables the RDB snapshots.
+exec /usr/bin/redis-server --loglevel warning --port $REDIS_PORT \
+    --maxmemory ${REDIS_MAXMEMORY:-1073741824} \
+    --maxmemory-policy ${REDIS_MAXMEMORY_POLICY:-volatile-lru} \
+    --save "${REDIS_SAVE-900 1 300 10 60 10000}" \
+    --appendonly ${REDIS_APPENDONLY:-no} \
+    --appendfsync ${REDIS_APPENDFSYNC:-everysec}
@@ -0,0 +1,25 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import logging
+import os
+import tempfile
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"))
+
+# metrics of every worker are written to files in this directory and summed
+# up by /metrics, it must be set before the workers import prometheus_client.
+if not os.environ.get("prometheus_multiproc_dir"):
+    os.environ["prometheus_multiproc_dir"] = tempfile.mkdtemp(prefix="redisapi-metrics-")
+
+# with SERVING_MODE=async each worker serves requests from gevent greenlets,
+# so requests waiting on docker, redis or MongoDB do not hold a whole worker.
+if os.environ.get("SERVING_MODE") == "async":
+    worker_class = "gevent"
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "1000"))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,14 +1,39 @@
+import logging
 import os
 
+from redisapi.utils import per_process
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def mongodb_client_options():
+    return {
+        "connect": False,
+        "maxPoolSize": int(os.environ.get("MONGODB_MAX_POOL_SIZE", "100")),
+        "connectTimeoutMS": int(os.environ.get("MONGODB_CONNECT_TIMEOUT_MS", "20000")),
+        "serverSelectionTimeoutMS": int(
+            os.environ.get("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "30000")),
+    }
+
 
 def mongodb_database():
     mongodb_uri = os.environ.get(
         "MONGODB_URI", os.environ.get("DBAAS_MONGODB_ENDPOINT", "mongodb://localhost:27017/"))
     database_name = os.environ.get("DATABASE_NAME", "redisapi")
 
+    # the client is shared by everything running in this process.
+    return _connect(mongodb_uri, database_name)
+
+
+def reset_mongodb():
+    _connect.reset()
+
+
+@per_process
+def _connect(mongodb_uri, database_name):
     from pymongo import MongoClient
     from pymongo.errors import ConfigurationError
-    client = MongoClient(mongodb_uri)
+    client = MongoClient(mongodb_uri, **mongodb_client_options())
     try:
         database = client.get_default_database()
         database_name = database.name
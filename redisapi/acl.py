@@ -2,71 +2,261 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import atexit
+import logging
 import os
-import sys
-import traceback
+import socket
+import threading
+from collections import OrderedDict, defaultdict
 
 from aclapiclient import aclapiclient, l4_options
+from pymongo import ReturnDocument
+
+from redisapi import mongodb_database
+from redisapi.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+def subnet(unit_host):
+    return unit_host[:unit_host.rindex(".")+1] + "0/24"
+
+
+def valid_unit_host(unit_host):
+    try:
+        socket.inet_pton(socket.AF_INET, unit_host)
+    except (socket.error, TypeError, ValueError):
+        return False
+    return True
+
+
+class AccessState(object):
+    """Units bound to each instance, stored in the ``acl_units`` collection
+    with one document per instance and subnet. ``add`` tells whether the unit
+    is the first of its subnet and ``remove`` whether it was the last one, so
+    the ACL rules of a subnet are only changed when that subnet starts or
+    stops having units, whichever API process handles the bind.
+    """
+
+    def collection(self):
+        return mongodb_database()["acl_units"]
+
+    def key(self, instance_name, unit_host):
+        return "{}:{}".format(instance_name, subnet(unit_host))
+
+    def add(self, instance_name, unit_host):
+        doc = self.collection().find_one_and_update(
+            {"_id": self.key(instance_name, unit_host)},
+            {"$addToSet": {"units": unit_host},
+             "$setOnInsert": {"instance": instance_name, "subnet": subnet(unit_host)}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        return not doc or not doc.get("units")
+
+    def remove(self, instance_name, unit_host):
+        key = self.key(instance_name, unit_host)
+        doc = self.collection().find_one_and_update(
+            {"_id": key, "units": unit_host},
+            {"$pull": {"units": unit_host}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            # units bound before their subnet was tracked are revoked as
+            # they always were, unless the subnet has units known to be bound.
+            return self.collection().find_one({"_id": key}, {"_id": 1}) is None
+        if doc["units"]:
+            return False
+        self.collection().delete_one({"_id": key, "units": {"$size": 0}})
+        return True
+
+    def reset(self, instance_name, source):
+        self.collection().delete_one({"_id": "{}:{}".format(instance_name, source)})
+
+    def units(self, instance_name=None):
+        query = {}
+        if instance_name is not None:
+            query["instance"] = instance_name
+        units = defaultdict(list)
+        for doc in self.collection().find(query).sort("_id"):
+            units[doc["instance"]].extend(doc["units"])
+        return units
 
 
 class GloboACLAPIManager(object):
+    """Every unit of a /24 maps to the same rule, so rules are keyed by
+    (source, dest, port) and only sent when the first unit of a subnet is
+    bound or the last one is unbound. Changes are committed together, right
+    away or, when ``ACL_COMMIT_WINDOW`` is set, by a timer that collects the
+    changes made during that many seconds. Changes whose commit fails are
+    kept for the next window, and the last ones are committed when the
+    process exits.
+    """
 
     def __init__(self):
         endpoint = os.environ.get("ACL_API_ENDPOINT")
         username = os.environ.get("ACL_API_USERNAME")
         password = os.environ.get("ACL_API_PASSWORD")
         self.client = aclapiclient.Client(username, password, endpoint)
+        self.commit_window = float(os.environ.get("ACL_COMMIT_WINDOW", "0"))
+        self.state = AccessState()
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.timer = None
+        if self.commit_window > 0:
+            atexit.register(self.flush_pending)
 
-    def grant_access(self, instance, unit_host):
-        source = unit_host[:unit_host.rindex(".")+1] + "0/24"
+    def rules(self, instance, unit_host):
+        source = subnet(unit_host)
         for endpoint in instance.endpoints:
             desc = 'redis-api instance "{}" access from {} to {}/32'.format(instance.name, source,
                                                                             endpoint["host"])
-            dest = endpoint["host"] + "/32"
-            l4_opts = l4_options.L4Opts(operator="eq", port=str(endpoint["port"]), target="dest")
-            try:
-                self.client.add_tcp_permit_access(desc=desc, source=source,
-                                                  dest=dest, l4_opts=l4_opts)
-            except ValueError:
-                sys.stderr.write("Failed to add permit access:\n")
-                traceback.print_exc()
-                sys.stderr.flush()
-        self.client.commit()
+            yield (source, endpoint["host"] + "/32", str(endpoint["port"])), desc
+
+    def grant_access(self, instance, unit_host):
+        self.grant_access_many(instance, [unit_host])
 
     def revoke_access(self, instance, unit_host):
-        source = unit_host[:unit_host.rindex(".")+1] + "0/24"
-        for endpoint in instance.endpoints:
-            desc = 'redis-api instance "{}" access from {} to {}/32'.format(instance.name, source,
-                                                                            endpoint["host"])
-            dest = endpoint["host"] + "/32"
-            l4_opts = l4_options.L4Opts(operator="eq", port=str(endpoint["port"]), target="dest")
+        self.revoke_access_many(instance, [unit_host])
+
+    def grant_access_many(self, instance, unit_hosts):
+        """Returns the outcome of each unit: "ok", "queued" until the commit
+        window ends, or the error that kept its rules from being sent.
+        """
+        changed = [unit_host for unit_host in unit_hosts
+                   if self.state.add(instance.name, unit_host)]
+        return self.outcomes(instance, unit_hosts, self.enqueue("add", instance, changed))
+
+    def revoke_access_many(self, instance, unit_hosts):
+        changed = [unit_host for unit_host in unit_hosts
+                   if self.state.remove(instance.name, unit_host)]
+        return self.outcomes(instance, unit_hosts, self.enqueue("remove", instance, changed))
+
+    def outcomes(self, instance, unit_hosts, failures):
+        default = "queued" if self.commit_window > 0 else "ok"
+        return dict((unit_host, failures.get((instance.name, unit_host), default))
+                    for unit_host in unit_hosts)
+
+    def enqueue(self, action, instance, unit_hosts):
+        if not unit_hosts:
+            return {}
+        with self.lock:
+            for unit_host in unit_hosts:
+                for key, desc in self.rules(instance, unit_host):
+                    previous = self.pending.pop(key, None)
+                    if previous and previous[0] != action:
+                        # nothing was sent for the previous change, the rule
+                        # is still as it was committed.
+                        continue
+                    self.pending[key] = (action, desc, instance.name, unit_host)
+            if self.commit_window > 0:
+                self.schedule()
+                return {}
+        return self.flush()
+
+    def schedule(self):
+        if self.timer is None:
+            self.timer = threading.Timer(self.commit_window, self.flush_pending)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_pending(self):
+        # runs from the timer and at exit, where nobody else sees the error.
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to commit ACL changes")
+
+    def flush(self):
+        """Sends and commits the pending changes, returns the errors of the
+        rules that could not be sent by instance name and unit host.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            pending, self.pending = self.pending, OrderedDict()
+            sent = OrderedDict()
+            failures = {}
+            for key, change in pending.items():
+                action, desc, instance_name, unit_host = change
+                try:
+                    self.send(action, key, desc)
+                except Exception as e:
+                    logger.exception("Failed to %s permit access from %s to %s",
+                                     action, key[0], key[1])
+                    failures[instance_name, unit_host] = str(e)
+                    self.rollback([change])
+                else:
+                    sent[key] = change
+            if not sent:
+                return failures
             try:
-                self.client.remove_tcp_permit_access(desc=desc, source=source,
-                                                     dest=dest, l4_opts=l4_opts)
-            except ValueError:
-                sys.stderr.write("Failed to remove permit access:\n")
-                traceback.print_exc()
-                sys.stderr.flush()
-        self.client.commit()
+                with timed("acl_commit"):
+                    self.client.commit()
+            except Exception:
+                if self.commit_window > 0:
+                    # the binds were answered already, the changes are
+                    # sent again with the next window.
+                    self.pending = sent
+                    self.schedule()
+                else:
+                    self.rollback(sent.values())
+                raise
+            finally:
+                # the client keeps every job it has seen and commit runs all
+                # of them, so they are dropped whether or not they were
+                # committed.
+                self.client.jobs = []
+            return failures
+
+    def rollback(self, changes):
+        """Makes the state match the rules of changes that did not make it
+        to the ACL API, so the next bind or unbind of their units tries
+        again.
+        """
+        for action, _, instance_name, unit_host in changes:
+            if action == "add":
+                # forgetting the subnet makes the next bind send its rules.
+                self.state.reset(instance_name, subnet(unit_host))
+            else:
+                # the rules are still there, and so is the unit.
+                self.state.add(instance_name, unit_host)
+
+    def send(self, action, key, desc):
+        source, dest, port = key
+        l4_opts = l4_options.L4Opts(operator="eq", port=port, target="dest")
+        if action == "add":
+            method = self.client.add_tcp_permit_access
+        else:
+            method = self.client.remove_tcp_permit_access
+        method(desc=desc, source=source, dest=dest, l4_opts=l4_opts)
 
 
 class DumbAccessManager(object):
 
     def __init__(self):
-        self.permits = {}
+        self.state = AccessState()
+
+    @property
+    def permits(self):
+        return self.state.units()
 
     def grant_access(self, instance, unit_host):
-        permits = self.permits.get(instance.name)
-        if not permits:
-            permits = []
-        permits.append(unit_host)
-        self.permits[instance.name] = permits
+        self.state.add(instance.name, unit_host)
 
     def revoke_access(self, instance, unit_host):
-        permits = self.permits.get(instance.name)
-        if permits:
-            permits.remove(unit_host)
-            self.permits[instance.name] = permits
+        self.state.remove(instance.name, unit_host)
+
+    def grant_access_many(self, instance, unit_hosts):
+        for unit_host in unit_hosts:
+            self.grant_access(instance, unit_host)
+        return dict.fromkeys(unit_hosts, "ok")
+
+    def revoke_access_many(self, instance, unit_hosts):
+        for unit_host in unit_hosts:
+            self.revoke_access(instance, unit_host)
+        return dict.fromkeys(unit_hosts, "ok")
 
 access_managers = {"globo-acl-api": GloboACLAPIManager,
                    "default": DumbAccessManager}
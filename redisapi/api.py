@@ -2,43 +2,73 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import hmac
 import json
 import os
+import time
 
 import flask
 
 from flask import request
-from managers import SharedManager, DockerManager, DockerHaManager, FakeManager
+from acl import valid_unit_host
+from jobs import JobConflict, JobQueue, async_provisioning
+from managers import FakeManager, manager_by_instance, manager_by_plan_name, plan_managers
+from metrics import exposition, request_latency
 from plans import active as active_plans
-from storage import MongoStorage
+from prober import check, status_cache
+from storage import Instance, MongoStorage, ensure_indexes
 
 
 app = flask.Flask(__name__)
 app.debug = os.environ.get('DEBUG', '0') in ('true', 'True', '1')
 
 
-def manager_by_instance(instance):
-    plans = {
-        'development': SharedManager,
-        'basic': DockerManager,
-        'plus': DockerHaManager,
-    }
-    return plans[instance.plan]()
+@app.before_first_request
+def setup_database():
+    ensure_indexes()
 
 
-def manager_by_plan_name(plan_name):
-    plans = {
-        'development': SharedManager,
-        'basic': DockerManager,
-        'plus': DockerHaManager,
-    }
-    return plans[plan_name]()
+@app.before_request
+def start_timer():
+    flask.g.started_at = time.time()
+
+
+@app.after_request
+def keep_status(response):
+    flask.g.status_code = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_latency(exc):
+    # after_request is skipped when the view raises, the request is then
+    # answered with a 500.
+    started_at = getattr(flask.g, "started_at", None)
+    if started_at is not None:
+        route = request.url_rule.rule if request.url_rule else "unknown"
+        status_code = 500 if exc is not None else getattr(flask.g, "status_code", 500)
+        request_latency.labels(request.method, route, status_code).observe(
+            time.time() - started_at)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    data, content_type = exposition()
+    return flask.Response(data, content_type=content_type)
+
+
+def not_ready(instance):
+    # instances still being added or removed by a job have no endpoints to
+    # bind, tsuru retries later.
+    return "instance is {}".format(instance.status), 412
 
 
 @app.route("/resources/<name>/bind-app", methods=["POST"])
 def bind_app(name):
     storage = MongoStorage()
     instance = storage.find_instance_by_name(name)
+    if instance.status:
+        return not_ready(instance)
     result = manager_by_instance(instance).bind(instance)
     return json.dumps(result), 201
 
@@ -56,6 +86,8 @@ def bind_unit(name):
         return "unit-host is required", 400
     storage = MongoStorage()
     instance = storage.find_instance_by_name(name)
+    if instance.status:
+        return not_ready(instance)
     manager = manager_by_instance(instance)
     try:
         manager.grant(instance, unit_host)
@@ -71,6 +103,8 @@ def unbind_unit(name):
         return "unit-host is required", 400
     storage = MongoStorage()
     instance = storage.find_instance_by_name(name)
+    if instance.status:
+        return not_ready(instance)
     manager = manager_by_instance(instance)
     try:
         manager.revoke(instance, unit_host)
@@ -79,15 +113,111 @@ def unbind_unit(name):
     return "", 200
 
 
+def change_units(instance, unit_hosts, method_name):
+    results = {}
+    valid = []
+    for unit_host in unit_hosts:
+        if not valid_unit_host(unit_host):
+            results[unit_host] = "invalid unit host"
+        elif unit_host not in results:
+            results[unit_host] = "ok"
+            valid.append(unit_host)
+    manager = manager_by_instance(instance)
+    method = getattr(manager, method_name, None)
+    if method and valid:
+        try:
+            results.update(method(instance, valid))
+        except Exception as e:
+            for unit_host in valid:
+                results[unit_host] = str(e)
+    return results
+
+
+@app.route("/resources/<name>/bind-units", methods=["POST"])
+def bind_units(name):
+    unit_hosts = request.form.getlist('unit-host')
+    if not unit_hosts:
+        return "unit-host is required", 400
+    instance = MongoStorage().find_instance_by_name(name)
+    if instance.status:
+        return not_ready(instance)
+    return json.dumps(change_units(instance, unit_hosts, "grant_many")), 201
+
+
+@app.route("/resources/<name>/bind-units", methods=["DELETE"])
+def unbind_units(name):
+    unit_hosts = request.form.getlist('unit-host')
+    if not unit_hosts:
+        return "unit-host is required", 400
+    instance = MongoStorage().find_instance_by_name(name)
+    if instance.status:
+        return not_ready(instance)
+    return json.dumps(change_units(instance, unit_hosts, "revoke_many")), 200
+
+
+def to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+@app.route("/resources", methods=["GET"])
+def list_instances():
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        return "listing instances requires ADMIN_TOKEN to be set", 403
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(to_bytes(authorization), to_bytes("Bearer " + token)):
+        return "admin token is required", 401
+    try:
+        limit = int(request.args.get("limit", "0"))
+    except ValueError:
+        return "limit must be a number", 400
+    storage = MongoStorage()
+    instances = storage.list_instances(
+        plan=request.args.get("plan"),
+        host=request.args.get("host"),
+        after=request.args.get("after"),
+        limit=max(limit, 0),
+        fields=("name", "plan", "endpoints"),
+    )
+
+    def lines():
+        for instance in instances:
+            yield json.dumps(instance.to_json()) + "\n"
+
+    return flask.Response(lines(), mimetype="application/x-ndjson")
+
+
 @app.route("/resources", methods=["POST"])
 def add_instance():
     plan = request.form.get('plan')
     if not plan:
         return "plan is required", 400
-    instance = manager_by_plan_name(plan).add_instance(
-        request.form['name'])
+    if plan not in plan_managers:
+        return "invalid plan {}".format(plan), 400
     from storage import MongoStorage
+    if async_provisioning():
+        name = request.form['name']
+        storage = MongoStorage()
+        existing = storage.find_instance_by_name(name, fields=("name", "status"))
+        if existing and existing.status != "failed":
+            return "instance {} already exists".format(name), 409
+        # the instance is recorded right away, so status and bind find it
+        # while the worker provisions it.
+        storage.save_instance(Instance(name=name, plan=plan, endpoints=[], status="pending"))
+        try:
+            JobQueue().enqueue("add", name, plan=plan)
+        except JobConflict as e:
+            return str(e), 409
+        return "", 201
+    name = request.form['name']
     storage = MongoStorage()
+    # checked before provisioning, the unique index would only refuse the
+    # instance once its containers are created.
+    if storage.find_instance_by_name(name, fields=("name",)):
+        return "instance {} already exists".format(name), 409
+    instance = manager_by_plan_name(plan).add_instance(name)
     storage.add_instance(instance)
     return "", 201
 
@@ -95,19 +225,39 @@ def add_instance():
 @app.route("/resources/<name>", methods=["DELETE"])
 def remove_instance(name):
     from storage import MongoStorage
+    if async_provisioning():
+        try:
+            JobQueue().enqueue("remove", name)
+        except JobConflict as e:
+            return str(e), 409
+        MongoStorage().set_status(name, "removing")
+        return "", 200
     storage = MongoStorage()
     instance = storage.find_instance_by_name(name)
     manager_by_instance(instance).remove_instance(instance)
     storage.remove_instance(instance)
+    status_cache().remove(name)
     return "", 200
 
 
 @app.route("/resources/<name>/status", methods=["GET"])
 def status(name):
     from storage import MongoStorage
-    storage = MongoStorage()
-    instance = storage.find_instance_by_name(name)
-    ok, msg = manager_by_instance(instance).is_ok()
+    if async_provisioning():
+        instance = MongoStorage().find_instance_by_name(name, fields=("name", "status"))
+        if instance and instance.status:
+            job = JobQueue().last_job(name)
+            if instance.status == "failed":
+                return (job and job["error"]) or "instance failed", 500
+            if job:
+                return "{} is {}".format(job["action"], job["status"]), 202
+            return "instance is {}".format(instance.status), 202
+    result = status_cache().get(name)
+    if result is None:
+        storage = MongoStorage()
+        instance = storage.find_instance_by_name(name)
+        result = check(instance)
+    ok, msg = result
     if ok:
         return msg, 204
     return msg, 500
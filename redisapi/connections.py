@@ -0,0 +1,57 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import collections
+import os
+import threading
+
+import redis
+
+from redisapi.utils import per_process
+
+
+@per_process
+def _pools():
+    # a lock taken by another thread when the process forked would never be
+    # released in the child.
+    return collections.OrderedDict(), threading.Lock()
+
+
+def max_pools():
+    return int(os.environ.get("REDIS_MAX_POOLS", "512"))
+
+
+def redis_connection(host, port, password=None, timeout=None):
+    """StrictRedis client backed by a connection pool shared by the clients
+    of the same address. Only the ``REDIS_MAX_POOLS`` most recently used
+    pools are kept, the connections of a dropped pool are closed once its
+    last client is gone. redis-py discards the connections of a pool
+    inherited from a parent process by itself.
+    """
+    key = (str(host), int(port), password, timeout)
+    pools, lock = _pools()
+    with lock:
+        pool = pools.pop(key, None)
+        if pool is None:
+            pool = redis.ConnectionPool(host=str(host), port=int(port),
+                                        password=password,
+                                        socket_timeout=timeout,
+                                        socket_connect_timeout=timeout)
+        pools[key] = pool
+        while len(pools) > max_pools():
+            pools.popitem(last=False)
+    return redis.StrictRedis(connection_pool=pool)
+
+
+def disconnect(host=None, port=None):
+    """Closes the connections to host and port, or to every address when
+    host is None, and drops their pools.
+    """
+    pools, lock = _pools()
+    with lock:
+        keys = [key for key in pools
+                if host is None or key[:2] == (str(host), int(port))]
+        dropped = [pools.pop(key) for key in keys]
+    for pool in dropped:
+        pool.disconnect()
@@ -0,0 +1,80 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import logging
+import os
+import time
+
+import docker
+import requests
+
+from redisapi.utils import per_process
+
+logger = logging.getLogger(__name__)
+
+
+class HostUnavailable(Exception):
+    pass
+
+
+class TrackedClient(docker.Client):
+    """docker.Client that reports connection failures and successes to the
+    pool that created it. The client is a requests session, so the HTTP
+    connections to its host are kept alive between calls.
+    """
+
+    def __init__(self, pool, base_url, timeout):
+        super(TrackedClient, self).__init__(base_url=base_url, timeout=timeout)
+        self.pool = pool
+
+    def request(self, *args, **kwargs):
+        try:
+            response = super(TrackedClient, self).request(*args, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.pool.mark_down(self.base_url)
+            raise
+        self.pool.mark_up(self.base_url)
+        return response
+
+
+class DockerClientPool(object):
+
+    def __init__(self, timeout=60, retry_interval=30):
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.clients = {}
+        self.down = {}
+
+    def get(self, url):
+        down_since = self.down.get(url)
+        if down_since and time.time() - down_since < self.retry_interval:
+            raise HostUnavailable("docker host {} is unavailable".format(url))
+        client = self.clients.get(url)
+        if client is None:
+            client = self.clients[url] = TrackedClient(self, url, self.timeout)
+        return client
+
+    def is_healthy(self, url):
+        down_since = self.down.get(url)
+        return not down_since or time.time() - down_since >= self.retry_interval
+
+    def healthy_hosts(self, urls):
+        return [url for url in urls if self.is_healthy(url)]
+
+    def mark_down(self, url):
+        if url not in self.down:
+            logger.warning("docker host %s is unavailable", url)
+        self.down[url] = time.time()
+
+    def mark_up(self, url):
+        if self.down.pop(url, None):
+            logger.info("docker host %s is available again", url)
+
+
+@per_process
+def client_pool():
+    return DockerClientPool(
+        timeout=int(os.environ.get("DOCKER_TIMEOUT", "60")),
+        retry_interval=int(os.environ.get("DOCKER_RETRY_INTERVAL", "30")),
+    )
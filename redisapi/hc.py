@@ -4,7 +4,8 @@
 
 import os
 
-from utils import get_value
+from metrics import timed
+from utils import get_value, per_process
 from redisapi import mongodb_database
 
 
@@ -18,53 +19,102 @@ class FakeHealthCheck(object):
     def remove(self, host, port):
         self.removed = True
 
+    def add_many(self, addresses):
+        self.added = True
+
+    def remove_many(self, addresses):
+        self.removed = True
+
+
+@per_process
+def zabbix_api(url, user, password):
+    # one authenticated session per process, shared by every health checker.
+    from pyzabbix import ZabbixAPI
+    zapi = ZabbixAPI(url)
+    zapi.login(user, password)
+    return zapi
+
+
+def session_expired(error):
+    message = str(error.args[0]) if error.args else ""
+    return "re-login" in message or "Not authori" in message
+
 
 class ZabbixHealthCheck(object):
     def __init__(self):
         url = get_value("ZABBIX_URL")
-        user = get_value("ZABBIX_USER")
-        password = get_value("ZABBIX_PASSWORD")
+        self.user = get_value("ZABBIX_USER")
+        self.password = get_value("ZABBIX_PASSWORD")
         self.host_id = get_value("ZABBIX_HOST")
         self.host_name = os.environ.get("ZABBIX_HOST_NAME", "Zabbix Server")
         self.interface_id = get_value("ZABBIX_INTERFACE")
-        from pyzabbix import ZabbixAPI
-        self.zapi = ZabbixAPI(url)
-        self.zapi.login(user, password)
+        self.zapi = zabbix_api(url, self.user, self.password)
 
         self.items = self.mongo()['zabbix']
 
     def mongo(self):
         return mongodb_database()
 
+    def call(self, method, *args):
+        from pyzabbix import ZabbixAPIException
+        try:
+            return method(*args)
+        except ZabbixAPIException as e:
+            if not session_expired(e):
+                raise
+            self.zapi.login(self.user, self.password)
+            return method(*args)
+
+    def item_key(self, host, port):
+        return "net.tcp.service[tcp,{},{}]".format(host, port)
+
     def add(self, host, port):
-        item_key = "net.tcp.service[tcp,{},{}]".format(host, port)
-        item_result = self.zapi.item.create(
-            name="redis healthcheck for {}:{}".format(host, port),
-            key_=item_key,
-            delay=60,
-            hostid=self.host_id,
-            interfaceid=self.interface_id,
-            type=3,
-            value_type=3,
-        )
-        trigger_result = self.zapi.trigger.create(
-            description="trigger hc for redis {}:{}".format(host, port),
-            expression="{{{}:{}.last()}}=0".format(self.host_name, item_key),
-            priority=5,
-        )
-        item = {
-            'host': host,
-            'port': port,
-            'item': item_result['itemids'][0],
-            'trigger': trigger_result['triggerids'][0],
-        }
-        self.items.insert(item)
+        self.add_many([(host, port)])
+
+    @timed("healthcheck_add")
+    def add_many(self, addresses):
+        if not addresses:
+            return
+        item_result = self.call(self.zapi.item.create, *[{
+            "name": "redis healthcheck for {}:{}".format(host, port),
+            "key_": self.item_key(host, port),
+            "delay": 60,
+            "hostid": self.host_id,
+            "interfaceid": self.interface_id,
+            "type": 3,
+            "value_type": 3,
+        } for host, port in addresses])
+        trigger_result = self.call(self.zapi.trigger.create, *[{
+            "description": "trigger hc for redis {}:{}".format(host, port),
+            "expression": "{{{}:{}.last()}}=0".format(self.host_name,
+                                                      self.item_key(host, port)),
+            "priority": 5,
+        } for host, port in addresses])
+        items = []
+        for (host, port), item_id, trigger_id in zip(addresses, item_result['itemids'],
+                                                     trigger_result['triggerids']):
+            items.append({
+                'host': host,
+                'port': port,
+                'item': item_id,
+                'trigger': trigger_id,
+            })
+        self.items.insert_many(items)
 
     def remove(self, host, port):
-        item = self.items.find_one({"host": host, "port": port})
-        self.zapi.trigger.delete(item["trigger"])
-        self.zapi.item.delete(item["item"])
-        self.items.remove({"host": host, "port": port})
+        self.remove_many([(host, port)])
+
+    @timed("healthcheck_remove")
+    def remove_many(self, addresses):
+        if not addresses:
+            return
+        query = {"$or": [{"host": host, "port": port} for host, port in addresses]}
+        items = list(self.items.find(query))
+        if not items:
+            return
+        self.call(self.zapi.trigger.delete, *[item["trigger"] for item in items])
+        self.call(self.zapi.item.delete, *[item["item"] for item in items])
+        self.items.remove(query)
 
 
 health_checkers = {
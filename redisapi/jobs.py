@@ -0,0 +1,94 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import os
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from redisapi import mongodb_database
+
+
+def async_provisioning():
+    return os.environ.get("PROVISIONING_MODE", "sync") == "async"
+
+
+class JobConflict(Exception):
+    pass
+
+
+class JobQueue(object):
+    """Provisioning jobs stored in the ``jobs`` collection. A job is
+    ``pending`` until a worker claims it, ``running`` while the worker
+    executes it and ends as ``done`` or ``failed``. Each name has at most one
+    pending or running job, which holds the name's document in the
+    ``job_locks`` collection until it ends. The worker of a running job
+    refreshes its ``updated_at`` while it works; jobs not refreshed for
+    JOBS_TIMEOUT seconds are considered abandoned by a dead worker and can
+    be claimed again.
+    """
+
+    def __init__(self):
+        self.timeout = int(os.environ.get("JOBS_TIMEOUT", "600"))
+
+    def collection(self):
+        return mongodb_database()["jobs"]
+
+    def locks(self):
+        return mongodb_database()["job_locks"]
+
+    def enqueue(self, action, name, plan=None):
+        """Records a job, raising JobConflict when name already has a
+        pending or running one.
+        """
+        job = {
+            "_id": ObjectId(),
+            "action": action,
+            "name": name,
+            "plan": plan,
+            "status": "pending",
+            "error": None,
+            "created_at": datetime.datetime.utcnow(),
+        }
+        try:
+            self.locks().insert_one({"_id": name, "job": job["_id"]})
+        except DuplicateKeyError:
+            active = self.last_job(name)
+            raise JobConflict("{} of {} is {}".format(
+                active["action"], name, active["status"]) if active else
+                "{} already has a job".format(name))
+        self.collection().insert_one(job)
+        return job
+
+    def claim(self):
+        now = datetime.datetime.utcnow()
+        abandoned = now - datetime.timedelta(seconds=self.timeout)
+        return self.collection().find_one_and_update(
+            {"$or": [{"status": "pending"},
+                     {"status": "running", "updated_at": {"$lt": abandoned}}]},
+            {"$set": {"status": "running", "started_at": now, "updated_at": now}},
+            sort=[("created_at", ASCENDING), ("_id", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, job):
+        self.collection().update_one(
+            {"_id": job["_id"], "status": "running"},
+            {"$set": {"updated_at": datetime.datetime.utcnow()}})
+
+    def finish(self, job, error=None):
+        status = "failed" if error else "done"
+        self.collection().update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": status,
+                      "error": str(error) if error else None,
+                      "finished_at": datetime.datetime.utcnow()}},
+        )
+        self.locks().delete_one({"_id": job["name"], "job": job["_id"]})
+
+    def last_job(self, name):
+        return self.collection().find_one(
+            {"name": name}, sort=[("created_at", DESCENDING), ("_id", DESCENDING)])
@@ -2,22 +2,39 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import logging
 import os
 import json
 import redis
-import docker
-import random
+import sys
 import time
 
 from urlparse import urlparse
 
+import sentinels
+
 from acl import access_managers
+from connections import disconnect, redis_connection
+from docker_pool import HostUnavailable, client_pool
 from hc import health_checkers
-from utils import get_value
-from storage import Instance, MongoStorage
+from metrics import timed
+from plans import profile, redis_settings
+from ports import PortAllocator
+from saga import Saga
+from scheduler import scheduler_from_env
+from utils import WaitTimeout, get_value, parallel_map, per_process, wait_for
+from warm_pool import WarmPool, pool_size
+from storage import Instance
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaNotReady(Exception):
+    pass
 
 
 class DockerBase(object):
+    plan = None
 
     def __init__(self):
         self.image_name = get_value("REDIS_IMAGE")
@@ -25,41 +42,108 @@ class DockerBase(object):
         sentinel_hosts = get_value("SENTINEL_HOSTS")
         self.sentinel_hosts = json.loads(sentinel_hosts)
         self.docker_hosts = json.loads(docker_hosts)
-        self.port_range_start = 49153
+        self.port_range_start = int(os.environ.get("PORT_RANGE_START", "49153"))
+        self.port_range_end = int(os.environ.get("PORT_RANGE_END", "65535"))
+        self.port_allocator = PortAllocator(self.port_range_start,
+                                            self.port_range_end)
+        self.scheduler = scheduler_from_env(self.plan)
+        self.warm_pool = WarmPool(pool_size())
+        self.profile = profile(self.plan)
 
     def get_port_by_host(self, host):
-        storage = MongoStorage()
-        instances = storage.find_instances_by_host(host)
-        if instances:
-            ports = []
-            for instance in instances:
-                for endpoint in instance.endpoints:
-                    ports.append(int(endpoint["port"]))
-            return max(ports) + 1
-        return self.port_range_start
+        return self.port_allocator.allocate(host)
 
-    def config_sentinels(self, master_name, master):
-        for sentinel in self.sentinel_hosts:
-            host, port = sentinel.replace("http://", "").split(":")
-            r = redis.StrictRedis(host=str(host), port=str(port))
-            commands = [
-                ["monitor", master_name, master["host"], master["port"], '1'],
-                ["set", master_name, "down-after-milliseconds", "5000"],
-                ["set", master_name, "failover-timeout", "60000"],
-                ["set", master_name, "parallel-syncs", "1"],
-            ]
-            for command in commands:
-                r.sentinel(*command)
+    def release_port(self, endpoint):
+        self.port_allocator.release(endpoint["host"], endpoint["port"])
+
+    def create_redis_container(self, host):
+        client = self.client(host)
+        host = self.extract_hostname(client.base_url)
+        port = self.get_port_by_host(host)
+        environment = {"REDIS_PORT": port}
+        for setting in redis_settings:
+            if setting in self.profile:
+                environment["REDIS_" + setting.upper()] = self.profile[setting]
+        output = None
+        try:
+            with timed("create_container"):
+                output = client.create_container(
+                    self.image_name,
+                    command="",
+                    ports=[port],
+                    environment=environment,
+                    mem_limit=self.profile.get("mem_limit", 0),
+                    cpu_shares=self.profile.get("cpu_shares"),
+                )
+            with timed("start"):
+                client.start(output["Id"], port_bindings={port: ('0.0.0.0', port)})
+        except Exception:
+            exc_info = sys.exc_info()
+            self.port_allocator.release(host, port)
+            if output is not None:
+                try:
+                    client.remove_container(output["Id"])
+                except Exception:
+                    logger.exception("failed to remove container %s", output["Id"])
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return {"host": host, "port": port, "container_id": output["Id"]}
+
+    def claim_container(self, host):
+        # containers started ahead of time by the warm pool are used when
+        # there is one left on the host.
+        if self.warm_pool.size > 0:
+            endpoint = self.warm_pool.claim(self.extract_hostname(host), self.plan)
+            if endpoint:
+                return endpoint
+        return self.create_redis_container(host)
+
+    def remove_container(self, endpoint):
+        url = self.docker_url_from_hostname(endpoint["host"])
+        client = self.client(url)
+        with timed("stop"):
+            client.stop(endpoint["container_id"])
+        with timed("remove_container"):
+            client.remove_container(endpoint["container_id"])
+        disconnect(endpoint["host"], endpoint["port"])
+        self.release_port(endpoint)
 
+    def remove_containers(self, endpoints):
+        for endpoint in endpoints:
+            self.remove_container(endpoint)
+
+    @timed("config_sentinels")
+    def config_sentinels(self, master_name, master):
+        commands = [
+            ["monitor", master_name, master["host"], master["port"], '1'],
+            ["set", master_name, "down-after-milliseconds", "5000"],
+            ["set", master_name, "failover-timeout", "60000"],
+            ["set", master_name, "parallel-syncs", "1"],
+        ]
+        sentinels.execute(self.sentinel_hosts, commands)
+
+    @timed("remove_from_sentinel")
     def remove_from_sentinel(self, master_name):
-        for sentinel in self.sentinel_hosts:
-            host, port = sentinel.replace("http://", "").split(":")
-            r = redis.StrictRedis(host=str(host), port=str(port))
-            r.sentinel('remove', master_name)
+        sentinels.execute(self.sentinel_hosts, [['remove', master_name]])
+
+    def monitor(self, master_name, master):
+        # the sentinels that accepted the master before the others failed
+        # would keep monitoring it after its container is removed, the step
+        # is not recorded so its undo does not run.
+        try:
+            self.config_sentinels(master_name, master)
+        except Exception:
+            exc_info = sys.exc_info()
+            try:
+                self.remove_from_sentinel(master_name)
+            except Exception:
+                logger.exception("failed to remove %s from the sentinels", master_name)
+            raise exc_info[0], exc_info[1], exc_info[2]
 
     def health_checker(self):
-        hc_name = os.environ.get("HEALTH_CHECKER", "fake")
-        return health_checkers[hc_name]()
+        if not hasattr(self, "_health_checker"):
+            hc_name = os.environ.get("HEALTH_CHECKER", "fake")
+            self._health_checker = health_checkers[hc_name]()
+        return self._health_checker
 
     def extract_hostname(self, url):
         return urlparse(url).hostname
@@ -68,7 +152,10 @@ class DockerBase(object):
         return "http://{}:4243".format(hostname)
 
     def client(self, host):
-        return docker.Client(base_url=host)
+        return client_pool().get(host)
+
+    def available_hosts(self):
+        return client_pool().healthy_hosts(self.docker_hosts)
 
     def bind(self, instance):
         redis_hosts = []
@@ -92,6 +179,12 @@ class DockerBase(object):
     def revoke(self, instance, host):
         self.access_manager.revoke_access(instance, host)
 
+    def grant_many(self, instance, hosts):
+        return self.access_manager.grant_access_many(instance, hosts)
+
+    def revoke_many(self, instance, hosts):
+        return self.access_manager.revoke_access_many(instance, hosts)
+
     @property
     def access_manager(self):
         if not hasattr(self, "_manager"):
@@ -101,55 +194,103 @@ class DockerBase(object):
             self._manager = access_managers.get(manager_name)()
         return self._manager
 
-    def is_ok(self):
-        pass
+    def redis_connection(self, endpoint):
+        timeout = float(os.environ.get("STATUS_TIMEOUT", "2"))
+        return redis_connection(endpoint["host"], endpoint["port"], timeout=timeout)
+
+    def is_ok(self, instance):
+        for endpoint in instance.endpoints:
+            try:
+                self.redis_connection(endpoint).ping()
+            except redis.RedisError as e:
+                return False, "{}:{}: {}".format(endpoint["host"], endpoint["port"], e)
+        return True, ""
 
 
 class DockerHaManager(DockerBase):
+    plan = "plus"
 
-    def start_redis_container(self, name, host, slave_of=None):
-        client = self.client(host)
-        host = self.extract_hostname(client.base_url)
-        port = self.get_port_by_host(host)
-        output = client.create_container(
-            self.image_name,
-            command="",
-            ports=[port],
-            environment={"REDIS_PORT": port},
-        )
-        client.start(output["Id"], port_bindings={port: ('0.0.0.0', port)})
-        self.health_checker().add(host, port)
-        endpoint = {"host": host, "port": port, "container_id": output["Id"]}
-        if slave_of:
-            self.slave_of(slave_of, endpoint)
-        else:
-            self.config_sentinels(name, endpoint)
-        return endpoint
+    def __init__(self):
+        super(DockerHaManager, self).__init__()
+        self.replicas = int(os.environ.get("REDIS_REPLICAS", "1"))
+        self.replication_timeout = float(os.environ.get("REPLICATION_TIMEOUT", "30"))
 
+    @timed("slave_of")
     def slave_of(self, master, slave):
-        r = redis.StrictRedis(host=str(slave["host"]), port=str(slave["port"]))
-        max_try = 3
-        while max_try > 0:
+        # the containers were just started: SLAVEOF is retried until the
+        # replica accepts connections, then the replica is polled until its
+        # link to the master is up.
+        start = time.time()
+        conn = self.redis_connection(slave)
+        configured = []
+
+        def replicating():
+            if not configured:
+                conn.slaveof(master["host"], master["port"])
+                configured.append(True)
+            info = conn.info("replication")
+            if info.get("role") != "slave" or info.get("master_link_status") != "up":
+                raise ReplicaNotReady("replication link is {}".format(
+                    info.get("master_link_status", "not configured")))
+            return True
+
+        address = "{}:{}".format(slave["host"], slave["port"])
+        try:
+            wait_for(replicating, self.replication_timeout,
+                     errors=(redis.ConnectionError, redis.TimeoutError, ReplicaNotReady))
+        except WaitTimeout as e:
+            raise ReplicaNotReady("replica {} of {}:{} {}".format(
+                address, master["host"], master["port"], e))
+        logger.info("replica %s ready in %.1fms", address, (time.time() - start) * 1000)
+
+    def create_containers(self):
+        if len(self.docker_hosts) < self.replicas + 1:
+            raise Exception(
+                "plus instances need {} docker hosts, only {} available".format(
+                    self.replicas + 1, len(self.docker_hosts)))
+        hosts = self.available_hosts()
+        if len(hosts) < self.replicas + 1:
+            raise HostUnavailable(
+                "plus instances need {} docker hosts, only {} are reachable".format(
+                    self.replicas + 1, len(hosts)))
+        hosts = self.scheduler.choose(hosts, self.replicas + 1)
+
+        # the master and its replicas live on distinct hosts, so their
+        # containers are created at the same time and wired up afterwards.
+        def claim(host):
             try:
-                r.slaveof(master["host"], master["port"])
-                break
-            except redis.ConnectionError:
-                time.sleep(1)
-                max_try -= 1
+                return self.claim_container(host), None
+            except Exception as e:
+                return None, e
+
+        results = parallel_map(claim, hosts)
+        endpoints = [endpoint for endpoint, _ in results if endpoint]
+        errors = [error for _, error in results if error]
+        if errors:
+            self.remove_containers(endpoints)
+            raise errors[0]
+        return endpoints
 
     def add_instance(self, instance_name):
-        hosts = self.docker_hosts[:]
-        random.shuffle(hosts)
-        endpoints = []
-
-        host = hosts.pop()
-        endpoint = self.start_redis_container(instance_name, host)
-        endpoints.append(endpoint)
-
-        host = hosts.pop()
-        endpoint = self.start_redis_container(
-            instance_name, host, slave_of=endpoint)
-        endpoints.append(endpoint)
+        # every step is recorded, a failed or interrupted add resumes where
+        # it stopped and a failing step undoes the previous ones.
+        with Saga("add", instance_name) as saga:
+            endpoints = saga.step("containers", self.create_containers,
+                                  undo=self.remove_containers)
+            addresses = [(e["host"], e["port"]) for e in endpoints]
+            master = endpoints[0]
+
+            def add_health_checks():
+                self.health_checker().add_many(addresses)
+
+            def replicate():
+                parallel_map(lambda slave: self.slave_of(master, slave), endpoints[1:])
+
+            saga.step("healthcheck", add_health_checks,
+                      undo=lambda _: self.health_checker().remove_many(addresses))
+            saga.step("replication", replicate)
+            saga.step("sentinels", lambda: self.monitor(instance_name, master),
+                      undo=lambda _: self.remove_from_sentinel(instance_name))
 
         return Instance(
             name=instance_name,
@@ -157,44 +298,78 @@ class DockerHaManager(DockerBase):
             endpoints=endpoints,
         )
 
+    def is_ok(self, instance):
+        # the instance works while a master answers, even after a failover
+        # moved it, broken replicas are only reported.
+        def replication(endpoint):
+            try:
+                return self.redis_connection(endpoint).info("replication"), None
+            except redis.RedisError as e:
+                return None, e
+
+        masters = 0
+        problems = []
+        results = parallel_map(replication, instance.endpoints)
+        for endpoint, (info, error) in zip(instance.endpoints, results):
+            address = "{}:{}".format(endpoint["host"], endpoint["port"])
+            if error:
+                problems.append("{}: {}".format(address, error))
+            elif info.get("role") == "master":
+                masters += 1
+            elif info.get("master_link_status") != "up":
+                problems.append("{}: replication link is {}".format(
+                    address, info.get("master_link_status")))
+        if not masters:
+            problems.insert(0, "no master available")
+        return masters > 0, "; ".join(problems)
+
     def remove_instance(self, instance):
-        for endpoint in instance.endpoints:
-            self.health_checker().remove(endpoint["host"], endpoint["port"])
-            url = self.docker_url_from_hostname(endpoint["host"])
-            client = self.client(url)
-            client.stop(endpoint["container_id"])
-            client.remove_container(endpoint["container_id"])
+        def remove_health_checks():
+            self.health_checker().remove_many(
+                [(e["host"], e["port"]) for e in instance.endpoints])
 
-        self.remove_from_sentinel(instance.name)
+        def remove_from_sentinel():
+            self.remove_from_sentinel(instance.name)
+
+        # removed containers can not be removed again, so a retry skips the
+        # steps that already succeeded.
+        with Saga("remove", instance.name) as saga:
+            saga.step("healthcheck", remove_health_checks)
+            for i, endpoint in enumerate(instance.endpoints):
+                saga.step("container:{}".format(i),
+                          lambda endpoint=endpoint: self.remove_container(endpoint))
+            saga.step("sentinels", remove_from_sentinel)
 
 
 class DockerManager(DockerBase):
+    plan = "basic"
 
     def client(self, host=None):
         if not host:
-            host = random.choice(self.docker_hosts)
+            # hosts that recently refused connections are only used when no
+            # other host is left.
+            host = self.scheduler.choose(self.available_hosts() or self.docker_hosts)[0]
         return super(DockerManager, self).client(host)
 
     def add_instance(self, instance_name):
-        client = self.client()
-        host = self.extract_hostname(client.base_url)
-        port = self.get_port_by_host(host)
-        output = client.create_container(
-            self.image_name,
-            command="",
-            ports=[port],
-            environment={"REDIS_PORT": port},
-        )
-        client.start(output["Id"], port_bindings={port: ('0.0.0.0', port)})
-        endpoint = {"host": host, "port": port, "container_id": output["Id"]}
-        instance = Instance(
+        with Saga("add", instance_name) as saga:
+            endpoint = saga.step("container",
+                                 lambda: self.claim_container(self.client().base_url),
+                                 undo=self.remove_container)
+
+            def add_health_check():
+                self.health_checker().add(endpoint["host"], endpoint["port"])
+
+            saga.step("healthcheck", add_health_check,
+                      undo=lambda _: self.health_checker().remove(endpoint["host"],
+                                                                  endpoint["port"]))
+            saga.step("sentinels", lambda: self.monitor(instance_name, endpoint),
+                      undo=lambda _: self.remove_from_sentinel(instance_name))
+        return Instance(
             name=instance_name,
             plan='basic',
             endpoints=[endpoint],
         )
-        self.health_checker().add(host, port)
-        self.config_sentinels(instance_name, endpoint)
-        return instance
 
     def bind(self, instance):
         envs = super(DockerManager, self).bind(instance)
@@ -206,12 +381,17 @@ class DockerManager(DockerBase):
 
     def remove_instance(self, instance):
         endpoint = instance.endpoints[0]
-        self.health_checker().remove(endpoint["host"], endpoint["port"])
-        url = self.docker_url_from_hostname(endpoint["host"])
-        client = self.client(url)
-        client.stop(endpoint["container_id"])
-        client.remove_container(endpoint["container_id"])
-        self.remove_from_sentinel(instance.name)
+
+        def remove_health_check():
+            self.health_checker().remove(endpoint["host"], endpoint["port"])
+
+        def remove_from_sentinel():
+            self.remove_from_sentinel(instance.name)
+
+        with Saga("remove", instance.name) as saga:
+            saga.step("healthcheck", remove_health_check)
+            saga.step("container", lambda: self.remove_container(endpoint))
+            saga.step("sentinels", remove_from_sentinel)
 
 
 class FakeManager(object):
@@ -234,7 +414,7 @@ class FakeManager(object):
     def remove_instance(self, instance):
         self.removed = True
 
-    def is_ok(self):
+    def is_ok(self, instance=None):
         return self.ok, self.msg
 
 
@@ -264,14 +444,12 @@ class SharedManager(object):
     def remove_instance(self, instance):
         pass
 
-    def is_ok(self):
+    def is_ok(self, instance=None):
         passwd = os.environ.get("REDIS_SERVER_PASSWORD")
-        kw = {"host": self.server}
-        if passwd:
-            kw["password"] = passwd
+        port = os.environ.get("REDIS_SERVER_PORT", "6379")
+        timeout = float(os.environ.get("STATUS_TIMEOUT", "2"))
         try:
-            conn = redis.Connection(**kw)
-            conn.connect()
+            redis_connection(self.server, port, password=passwd, timeout=timeout).ping()
         except Exception as e:
             return False, str(e)
         return True, ""
@@ -282,3 +460,24 @@ managers = {
     'fake': FakeManager,
     'docker': DockerManager,
 }
+
+plan_managers = {
+    'development': SharedManager,
+    'basic': DockerManager,
+    'plus': DockerHaManager,
+}
+
+
+@per_process
+def manager_by_plan_name(plan_name):
+    # managers parse their configuration and keep their clients, so each
+    # process builds one per plan and reuses it for every request.
+    return plan_managers[plan_name]()
+
+
+def manager_by_instance(instance):
+    return manager_by_plan_name(instance.plan)
+
+
+def reload_managers():
+    manager_by_plan_name.reset()
@@ -0,0 +1,89 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import functools
+import inspect
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram,
+                               REGISTRY, generate_latest)
+from prometheus_client import multiprocess
+
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+request_latency = Histogram(
+    "redisapi_request_duration_seconds", "Time spent answering each route.",
+    ["method", "route", "status"], buckets=BUCKETS)
+step_latency = Histogram(
+    "redisapi_step_duration_seconds", "Time spent in each step of the API calls.",
+    ["step"], buckets=BUCKETS)
+step_failures = Counter(
+    "redisapi_step_failures_total", "Steps that raised an exception.", ["step"])
+
+
+class timed(object):
+    """Records how long a step takes, used either as a context manager or as
+    a decorator:
+
+        with timed("create_container"):
+            ...
+
+    Generators are timed until they are exhausted or closed.
+    """
+
+    def __init__(self, step):
+        self.step = step
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        step_latency.labels(self.step).observe(time.time() - self.start)
+        if exc_type is not None and exc_type is not GeneratorExit:
+            step_failures.labels(self.step).inc()
+
+    def __call__(self, func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                with timed(self.step):
+                    for item in func(*args, **kwargs):
+                        yield item
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.step):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+collectors = []
+
+
+def register_collector(collector):
+    """Registers a collector that reads its values when /metrics is
+    scraped, instead of keeping them in this process.
+    """
+    collectors.append(collector)
+    REGISTRY.register(collector)
+
+
+def multiprocess_dir():
+    return os.environ.get("prometheus_multiproc_dir")
+
+
+def exposition():
+    """Returns the metrics of every process sharing the multiprocess
+    directory when there is one, otherwise the metrics of this process.
+    """
+    registry = REGISTRY
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in collectors:
+            registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -5,22 +5,60 @@
 import json
 import os
 
+GB = 1024 ** 3
+
+# settings of the containers of a plan: the redis ones are passed to
+# redis-server, mem_limit and cpu_shares to docker. The memory limit leaves
+# room above maxmemory for the fork of the RDB snapshots.
+default_profile = {
+    "maxmemory": GB,
+    "maxmemory_policy": "volatile-lru",
+    "save": "900 1 300 10 60 10000",
+    "appendonly": "no",
+    "appendfsync": "everysec",
+    "mem_limit": GB * 3 / 2,
+    "cpu_shares": 1024,
+}
+
+redis_settings = ("maxmemory", "maxmemory_policy", "save", "appendonly", "appendfsync")
 
 plans = [
     {"name": "development", "description": "Is a shared instance."},
     {"name": "basic",
-     "description": "1 dedicated instance. With 1GB of memory."},
+     "description": "1 dedicated instance. With 1GB of memory.",
+     "profile": default_profile},
     {"name": "plus",
      "description": ("2 dedicated instances. With 1GB of memory, "
-                     "HA and failover support via redis-sentinel.")},
+                     "HA and failover support via redis-sentinel."),
+     "profile": default_profile},
 ]
 
 
+def profile(plan_name):
+    """Settings of the containers of plan_name, with the ones given for the
+    plan in the PLAN_PROFILES environment variable, for example
+    ``{"basic": {"maxmemory": 536870912, "mem_limit": 805306368}}``.
+    """
+    result = {}
+    for plan in plans:
+        if plan["name"] == plan_name:
+            result.update(plan.get("profile", {}))
+    overrides = json.loads(os.environ.get("PLAN_PROFILES", "{}")).get(plan_name, {})
+    unknown = set(overrides) - set(default_profile)
+    if unknown:
+        raise Exception("unknown settings in the profile of {}: {}".format(
+            plan_name, ", ".join(sorted(unknown))))
+    result.update(overrides)
+    return result
+
+
 def active():
     plans_environ = os.environ.get("REDIS_API_PLANS", "[]")
     active_plans_name = json.loads(plans_environ)
     active_plans = []
     for plan in plans:
         if plan["name"] in active_plans_name:
+            if "profile" in plan:
+                plan = dict(plan, profile=profile(plan["name"]))
             active_plans.append(plan)
     return active_plans
@@ -0,0 +1,85 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from redisapi import mongodb_database
+
+
+class NoPortAvailable(Exception):
+    pass
+
+
+class PortAllocator(object):
+    """Hands out ports per docker host. The ``ports`` collection keeps one
+    document per host whose ``next`` field is the next never-used port, and
+    ``free_ports`` keeps one document per port released by a removed
+    instance. Every operation is a single atomic find-and-modify, so
+    concurrent workers never get the same port.
+    """
+
+    def __init__(self, range_start=49153, range_end=65535):
+        self.range_start = range_start
+        self.range_end = range_end
+
+    def collection(self):
+        return mongodb_database()["ports"]
+
+    def free_ports(self):
+        return mongodb_database()["free_ports"]
+
+    def allocate(self, host):
+        doc = self.free_ports().find_one_and_delete({"host": host})
+        if doc:
+            return doc["port"]
+        port = self._next_port(host)
+        if port is None and self._seed(host):
+            port = self._next_port(host)
+        if port is None:
+            raise NoPortAvailable(
+                "all ports between {} and {} are in use on {}".format(
+                    self.range_start, self.range_end, host))
+        return port
+
+    def release(self, host, port):
+        port = int(port)
+        # a port this allocator never handed out, such as one outside a
+        # range that was changed since, would be handed out again.
+        doc = self.collection().find_one({"_id": host})
+        if not doc or not self.range_start <= port < doc["next"]:
+            return
+        try:
+            self.free_ports().insert_one(
+                {"_id": "{}:{}".format(host, port), "host": host, "port": port})
+        except DuplicateKeyError:
+            pass
+
+    def _next_port(self, host):
+        doc = self.collection().find_one_and_update(
+            {"_id": host, "next": {"$lte": self.range_end}},
+            {"$inc": {"next": 1}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if doc:
+            return doc["next"]
+
+    def _seed(self, host):
+        if self.collection().find_one({"_id": host}, {"_id": 1}):
+            return False
+        # hosts that already run instances from before the allocator existed
+        # start right after the highest port in use, this scan happens only
+        # once per host.
+        port = self.range_start
+        instances = mongodb_database().instances.find(
+            {"endpoints.host": host}, {"endpoints": 1})
+        for instance in instances:
+            for endpoint in instance["endpoints"]:
+                if endpoint["host"] == host:
+                    port = max(port, int(endpoint["port"]) + 1)
+        try:
+            self.collection().insert_one({"_id": host, "next": port})
+        except DuplicateKeyError:
+            pass
+        return True
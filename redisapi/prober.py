@@ -0,0 +1,100 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import logging
+import os
+import time
+
+from redisapi import mongodb_database
+from redisapi.connections import disconnect
+from redisapi.managers import manager_by_instance
+from redisapi.storage import MongoStorage
+from redisapi.utils import parallel_map, per_process
+
+logger = logging.getLogger(__name__)
+
+
+class StatusCache(object):
+    """Health of each instance as last checked. Results are written to the
+    ``status`` collection, shared by every process, and kept in memory for
+    ``ttl`` seconds; results older than ``max_age`` seconds are ignored.
+    """
+
+    def __init__(self, ttl=5, max_age=60):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.local = {}
+
+    def collection(self):
+        return mongodb_database()["status"]
+
+    def get(self, name):
+        now = time.time()
+        entry = self.local.get(name)
+        if entry and now - entry[2] < self.ttl:
+            return entry[0], entry[1]
+        doc = self.collection().find_one({"_id": name})
+        if doc and now - doc["checked_at"] < self.max_age:
+            self.local[name] = (doc["ok"], doc["msg"], now)
+            return doc["ok"], doc["msg"]
+
+    def set(self, name, ok, msg):
+        now = time.time()
+        self.local[name] = (ok, msg, now)
+        self.collection().update_one(
+            {"_id": name},
+            {"$set": {"ok": ok, "msg": msg, "checked_at": now}},
+            upsert=True,
+        )
+
+    def remove(self, name):
+        self.local.pop(name, None)
+        self.collection().delete_one({"_id": name})
+
+
+@per_process
+def status_cache():
+    return StatusCache(
+        ttl=float(os.environ.get("STATUS_CACHE_TTL", "5")),
+        max_age=float(os.environ.get("STATUS_MAX_AGE", "60")),
+    )
+
+
+def check(instance):
+    try:
+        ok, msg = manager_by_instance(instance).is_ok(instance)
+    except Exception as e:
+        ok, msg = False, str(e)
+    status_cache().set(instance.name, ok, msg)
+    return ok, msg
+
+
+def probe_all(workers=16):
+    instances = list(MongoStorage().find_instances(fields=("name", "plan", "endpoints")))
+    try:
+        results = parallel_map(check, instances, workers=workers)
+    finally:
+        # a round opens a connection to every instance, they would sit idle
+        # until the next one.
+        disconnect()
+    failing = len([ok for ok, _ in results if not ok])
+    logger.info("probed %d instances, %d failing", len(results), failing)
+    return results
+
+
+def main():
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    interval = float(os.environ.get("PROBE_INTERVAL", "30"))
+    workers = int(os.environ.get("PROBE_CONCURRENCY", "16"))
+    while True:
+        start = time.time()
+        try:
+            probe_all(workers)
+        except Exception:
+            logger.exception("failed to probe instances")
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
+if __name__ == "__main__":
+    main()
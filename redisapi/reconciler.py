@@ -0,0 +1,263 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import argparse
+import logging
+import os
+import re
+import time
+
+from redisapi import mongodb_database
+from redisapi import sentinels
+from redisapi.storage import MongoStorage
+from redisapi.utils import parallel_map
+
+logger = logging.getLogger(__name__)
+
+# names of the instances created through tsuru, other masters monitored by
+# the same sentinels are never orphans.
+instance_name = re.compile(r"^[a-z][a-z0-9-]*$")
+
+
+def image_name(image):
+    # docker lists images with their tag, or by id when the tag moved to a
+    # newer image.
+    return image.rsplit(":", 1)[0] if "/" not in image.rsplit(":", 1)[-1] else image
+
+
+def saga_endpoints(doc):
+    for step in doc["steps"]:
+        result = step.get("result")
+        for endpoint in result if isinstance(result, list) else [result]:
+            if isinstance(endpoint, dict) and "container_id" in endpoint:
+                yield endpoint
+
+
+class Report(object):
+    """What differs between MongoDB and the docker hosts, the sentinels and
+    the Zabbix items. Orphans are resources nothing in MongoDB refers to
+    and can be cleaned; missing and unmonitored instances are only
+    reported, recreating them could lose data.
+    """
+
+    fields = ("containers", "masters", "healthchecks", "sagas", "missing",
+              "unmonitored", "unreachable")
+
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, [])
+        # host and port of every endpoint in use, whose ports must not be
+        # released.
+        self.addresses = set()
+
+    def orphans(self):
+        return len(self.containers) + len(self.masters) + len(self.healthchecks) + \
+            len(self.sagas)
+
+
+class Reconciler(object):
+    """Compares the instances in MongoDB with the containers running on the
+    docker hosts of manager, the masters monitored by its sentinels and the
+    Zabbix items. Containers created less than ``grace`` seconds ago and
+    the steps of adds and removes updated since are still being
+    provisioned, and are left alone.
+    """
+
+    def __init__(self, manager, grace=600):
+        self.manager = manager
+        self.grace = grace
+
+    def db(self):
+        return mongodb_database()
+
+    def list_containers(self, url):
+        try:
+            return url, self.manager.client(url).containers(all=True), None
+        except Exception as e:
+            return url, None, e
+
+    def list_masters(self, url):
+        try:
+            return url, sentinels.connection(url).sentinel_masters(), None
+        except Exception as e:
+            return url, None, e
+
+    def owned(self, name, master):
+        """Tells whether the sentinel master could have been created by this
+        service: it is named like an instance and runs on one of the docker
+        hosts.
+        """
+        hosts = set(self.manager.extract_hostname(url) for url in self.manager.docker_hosts)
+        return bool(instance_name.match(name)) and master.get("ip") in hosts
+
+    def in_use(self, name):
+        # checked again right before removing a master, an add may have
+        # started since the report was collected.
+        return self.db().instances.find_one({"name": name}, {"_id": 1}) is not None or \
+            self.db().sagas.find_one({"name": name}, {"_id": 1}) is not None
+
+    def known(self, report, now):
+        names, containers, addresses = set(), set(), set()
+        instances = list(MongoStorage().find_instances(fields=("name", "plan", "endpoints")))
+        for instance in instances:
+            names.add(instance.name)
+            for endpoint in instance.endpoints:
+                addresses.add((endpoint["host"], int(endpoint["port"])))
+                if endpoint.get("container_id"):
+                    containers.add(endpoint["container_id"])
+        for doc in self.db().warm_containers.find({}, {"host": 1, "port": 1}):
+            containers.add(doc["_id"])
+            addresses.add((doc["host"], int(doc["port"])))
+        instance_names = set(names)
+        for doc in self.db().sagas.find():
+            # the masters of failed adds and removes are left until their
+            # saga is cleaned.
+            names.add(doc["name"])
+            if doc["status"] != "running" or now - doc["updated_at"] > self.grace:
+                # the next remove of an instance skips the containers its
+                # failed remove already removed, so that record is kept.
+                if doc["action"] == "add" or doc["name"] not in instance_names:
+                    report.sagas.append(doc["_id"])
+                continue
+            for endpoint in saga_endpoints(doc):
+                containers.add(endpoint["container_id"])
+                addresses.add((endpoint["host"], int(endpoint["port"])))
+        return instances, names, containers, addresses
+
+    def collect(self):
+        now = time.time()
+        report = Report()
+        hosts = parallel_map(self.list_containers, self.manager.docker_hosts)
+        masters = parallel_map(self.list_masters, self.manager.sentinel_hosts)
+        instances, names, known_containers, report.addresses = self.known(report, now)
+
+        image = image_name(self.manager.image_name)
+        running = {}
+        for url, containers, error in hosts:
+            host = self.manager.extract_hostname(url)
+            if error:
+                report.unreachable.append({"docker": url, "error": str(error)})
+                continue
+            running[host] = set()
+            for container in containers:
+                if image_name(container.get("Image", "")) != image:
+                    continue
+                running[host].add(container["Id"])
+                if container["Id"] in known_containers or \
+                        now - container.get("Created", 0) < self.grace:
+                    continue
+                ports = [p["PublicPort"] for p in container.get("Ports") or []
+                         if p.get("PublicPort")]
+                report.containers.append({"url": url, "host": host,
+                                          "container_id": container["Id"],
+                                          "port": ports[0] if ports else None})
+
+        docker_instances = [i for i in instances
+                            if any(e.get("container_id") for e in i.endpoints)]
+        for instance in docker_instances:
+            for endpoint in instance.endpoints:
+                ids = running.get(endpoint["host"])
+                if ids is not None and endpoint["container_id"] not in ids:
+                    report.missing.append({"name": instance.name, "host": endpoint["host"],
+                                           "port": endpoint["port"],
+                                           "container_id": endpoint["container_id"]})
+
+        monitored = [i.name for i in docker_instances]
+        for url, sentinel_masters, error in masters:
+            if error:
+                report.unreachable.append({"sentinel": url, "error": str(error)})
+                continue
+            for name in sorted(set(sentinel_masters) - names):
+                if self.owned(name, sentinel_masters[name]):
+                    report.masters.append({"sentinel": url, "name": name})
+            for name in sorted(set(monitored) - set(sentinel_masters)):
+                report.unmonitored.append({"sentinel": url, "name": name})
+
+        for doc in self.db().zabbix.find({}, {"host": 1, "port": 1}):
+            address = (doc["host"], int(doc["port"]))
+            if address not in report.addresses:
+                report.healthchecks.append({"host": doc["host"], "port": doc["port"]})
+        return report
+
+    def clean(self, report):
+        """Removes the orphans of report, returns how many could not be
+        removed.
+        """
+        failures = 0
+
+        def remove_container(container):
+            client = self.manager.client(container["url"])
+            client.stop(container["container_id"])
+            client.remove_container(container["container_id"])
+            address = (container["host"], container["port"])
+            if container["port"] and address not in report.addresses:
+                self.manager.port_allocator.release(*address)
+
+        def remove_master(master):
+            if self.in_use(master["name"]):
+                logger.info("%s is in use again, keeping it in sentinel %s",
+                            master["name"], master["sentinel"])
+                return
+            sentinels.connection(master["sentinel"]).sentinel_remove(master["name"])
+
+        for container, error in zip(report.containers,
+                                    parallel_map(self.attempt(remove_container),
+                                                 report.containers)):
+            if error:
+                failures += 1
+                logger.error("failed to remove container %s from %s: %s",
+                             container["container_id"], container["host"], error)
+        for master in report.masters:
+            error = self.attempt(remove_master)(master)
+            if error:
+                failures += 1
+                logger.error("failed to remove %s from sentinel %s: %s",
+                             master["name"], master["sentinel"], error)
+        if report.healthchecks:
+            error = self.attempt(self.manager.health_checker().remove_many)(
+                [(h["host"], h["port"]) for h in report.healthchecks])
+            if error:
+                failures += len(report.healthchecks)
+                logger.error("failed to remove health checks: %s", error)
+        if report.sagas:
+            self.db().sagas.delete_many({"_id": {"$in": report.sagas}})
+        return failures
+
+    def attempt(self, func):
+        def run(*args):
+            try:
+                func(*args)
+            except Exception as e:
+                return e
+        return run
+
+
+def main(args=None):
+    from redisapi.managers import manager_by_plan_name
+    parser = argparse.ArgumentParser(
+        description="Reports resources out of sync with MongoDB.")
+    parser.add_argument("--clean", action="store_true",
+                        help="remove orphan containers, sentinel masters, "
+                             "health checks and stale sagas")
+    args = parser.parse_args(args)
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    grace = float(os.environ.get("RECONCILE_GRACE", "600"))
+    reconciler = Reconciler(manager_by_plan_name("basic"), grace)
+    start = time.time()
+    report = reconciler.collect()
+    for field in Report.fields:
+        for entry in getattr(report, field):
+            logger.info("%s: %s", field, entry)
+    logger.info("%d orphans, %d missing containers, %d unmonitored masters found in %.1fs",
+                report.orphans(), len(report.missing), len(report.unmonitored),
+                time.time() - start)
+    if args.clean and report.orphans():
+        failures = reconciler.clean(report)
+        logger.info("%d orphans removed, %d failed", report.orphans() - failures, failures)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
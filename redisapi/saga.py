@@ -0,0 +1,108 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import logging
+import time
+from collections import OrderedDict
+
+from redisapi import mongodb_database
+
+logger = logging.getLogger(__name__)
+
+
+class Saga(object):
+    """Steps of adding or removing an instance, recorded in the ``sagas``
+    collection as they complete, so running the same action again for the
+    same instance skips the steps already done:
+
+        with Saga("add", name) as saga:
+            endpoints = saga.step("containers", create, undo=remove)
+            saga.step("sentinels", monitor)
+
+    When a step raises, the completed steps that have an undo function are
+    undone, newest first. Steps without one can not be undone and stay
+    recorded, as do steps whose undo failed, for the next run to skip,
+    unless they were done after a step that was undone: they built on it,
+    so they run again. The record is deleted once every step is done.
+    """
+
+    def __init__(self, action, name):
+        self.action = action
+        self.name = name
+        self.id = "{}:{}".format(action, name)
+        self.completed = OrderedDict()
+        self.undos = {}
+
+    def collection(self):
+        return mongodb_database()["sagas"]
+
+    def __enter__(self):
+        doc = self.collection().find_one({"_id": self.id})
+        if doc:
+            for step in doc["steps"]:
+                self.completed[step["name"]] = step["result"]
+            logger.info("resuming %s of %s after %s", self.action, self.name,
+                        ", ".join(self.completed) or "no step")
+            self.collection().update_one(
+                {"_id": self.id}, {"$set": {"status": "running", "updated_at": time.time()}})
+        else:
+            self.collection().insert_one({
+                "_id": self.id,
+                "action": self.action,
+                "name": self.name,
+                "status": "running",
+                "steps": [],
+                "updated_at": time.time(),
+            })
+        return self
+
+    def step(self, name, do, undo=None):
+        """Runs do, unless the step was completed before, and returns its
+        result, which must be storable in MongoDB. undo is called with that
+        result to revert the step.
+        """
+        if undo is not None:
+            self.undos[name] = undo
+        if name in self.completed:
+            return self.completed[name]
+        result = do()
+        self.collection().update_one(
+            {"_id": self.id},
+            {"$push": {"steps": {"name": name, "result": result}},
+             "$set": {"updated_at": time.time()}})
+        self.completed[name] = result
+        return result
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.collection().delete_one({"_id": self.id})
+            return
+        logger.error("%s of %s failed: %s", self.action, self.name, exc_value)
+        self.rollback(exc_value)
+
+    def rollback(self, error):
+        names = list(self.completed)
+        undone = None
+        for name in reversed(names):
+            undo = self.undos.get(name)
+            if undo is None:
+                continue
+            try:
+                undo(self.completed[name])
+            except Exception:
+                logger.exception("failed to undo %s of %s %s", name, self.action, self.name)
+                continue
+            undone = name
+        if undone is not None:
+            forgotten = names[names.index(undone):]
+            for name in forgotten:
+                del self.completed[name]
+            self.collection().update_one(
+                {"_id": self.id}, {"$pull": {"steps": {"name": {"$in": forgotten}}}})
+        if self.completed:
+            self.collection().update_one(
+                {"_id": self.id},
+                {"$set": {"status": "failed", "error": str(error), "updated_at": time.time()}})
+        else:
+            self.collection().delete_one({"_id": self.id})
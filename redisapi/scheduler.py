@@ -0,0 +1,193 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import abc
+import json
+import os
+import random
+import time
+
+from urlparse import urlparse
+
+from redisapi import mongodb_database
+from redisapi.plans import profile
+from redisapi.utils import per_process
+
+MB = 1024 ** 2
+
+
+class NoHostAvailable(Exception):
+    pass
+
+
+def hostname(url):
+    return urlparse(url).hostname
+
+
+def container_memory(plan):
+    """Memory, in megabytes, docker gives each container of plan."""
+    return profile(plan).get("mem_limit", 0) // MB
+
+
+class HostLoads(object):
+    """Number of redis containers per docker hostname, and the memory docker
+    gives them according to the profile of their plan, computed from the
+    instances and warm containers collections at most once every ``ttl``
+    seconds. Placements made by this process in between are added to the
+    cached values.
+    """
+
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self.counts = {}
+        self.memory = {}
+        self.loaded_at = 0
+
+    def refresh(self):
+        db = mongodb_database()
+        groups = list(db.instances.aggregate([
+            {"$unwind": "$endpoints"},
+            {"$group": {"_id": {"host": "$endpoints.host", "plan": "$plan"},
+                        "count": {"$sum": 1}}},
+        ]))
+        groups.extend(db.warm_containers.aggregate([
+            {"$group": {"_id": {"host": "$host", "plan": "$plan"}, "count": {"$sum": 1}}},
+        ]))
+        counts, memory, charges = {}, {}, {}
+        for item in groups:
+            host, plan = item["_id"]["host"], item["_id"].get("plan")
+            if plan not in charges:
+                charges[plan] = container_memory(plan)
+            counts[host] = counts.get(host, 0) + item["count"]
+            memory[host] = memory.get(host, 0) + item["count"] * charges[plan]
+        self.counts, self.memory = counts, memory
+        self.loaded_at = time.time()
+
+    def expire(self):
+        if time.time() - self.loaded_at >= self.ttl:
+            self.refresh()
+
+    def get(self, host):
+        self.expire()
+        return self.counts.get(host, 0)
+
+    def used_memory(self, host):
+        self.expire()
+        return self.memory.get(host, 0)
+
+    def add(self, host, count=1, memory=0):
+        self.counts[host] = self.counts.get(host, 0) + count
+        self.memory[host] = self.memory.get(host, 0) + memory
+
+
+@per_process
+def host_loads():
+    return HostLoads(int(os.environ.get("SCHEDULER_CACHE_TTL", "10")))
+
+
+class Scheduler(object):
+    """Chooses the docker hosts of new containers. Subclasses rank the
+    candidates, choose() then takes distinct hosts from the ranking,
+    preferring hosts from zones that were not picked yet.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, zones=None):
+        self.zones = zones or {}
+
+    @abc.abstractmethod
+    def rank(self, hosts):
+        """Returns the hosts that can receive a container, best first."""
+
+    def choose(self, hosts, count=1):
+        ranked = self.rank(hosts)
+        if len(ranked) < count:
+            raise NoHostAvailable("{} docker hosts needed, only {} available".format(
+                count, len(ranked)))
+        chosen = []
+        zones = set()
+        for host in ranked:
+            zone = self.zones.get(host)
+            if zone is None or zone not in zones:
+                chosen.append(host)
+                zones.add(zone)
+            if len(chosen) == count:
+                break
+        for host in ranked:
+            if len(chosen) == count:
+                break
+            if host not in chosen:
+                chosen.append(host)
+        self.placed(chosen)
+        return chosen
+
+    def placed(self, hosts):
+        pass
+
+
+class RandomScheduler(Scheduler):
+
+    def rank(self, hosts):
+        hosts = hosts[:]
+        random.shuffle(hosts)
+        return hosts
+
+
+class LeastLoadedScheduler(Scheduler):
+    """Spreads containers, hosts running fewer containers come first."""
+
+    def __init__(self, zones=None, loads=None):
+        super(LeastLoadedScheduler, self).__init__(zones)
+        self.loads = loads or host_loads()
+
+    def rank(self, hosts):
+        hosts = RandomScheduler().rank(hosts)
+        return sorted(hosts, key=lambda host: self.loads.get(hostname(host)))
+
+    def placed(self, hosts):
+        for host in hosts:
+            self.loads.add(hostname(host))
+
+
+class MemoryScheduler(LeastLoadedScheduler):
+    """Packs containers, the host with the least free memory that still fits
+    one more container comes first and hosts without room are left out.
+    ``memory`` maps each docker host to its memory in megabytes, hosts
+    missing from it are never considered full. ``container_memory`` is the
+    memory of the containers placed by this scheduler.
+    """
+
+    def __init__(self, zones=None, loads=None, memory=None, container_memory=1024):
+        super(MemoryScheduler, self).__init__(zones, loads)
+        self.memory = memory or {}
+        self.container_memory = container_memory
+
+    def free_memory(self, host):
+        if host not in self.memory:
+            return float("inf")
+        return self.memory[host] - self.loads.used_memory(hostname(host))
+
+    def rank(self, hosts):
+        hosts = RandomScheduler().rank(hosts)
+        fits = [h for h in hosts if self.free_memory(h) >= self.container_memory]
+        return sorted(fits, key=self.free_memory)
+
+    def placed(self, hosts):
+        for host in hosts:
+            self.loads.add(hostname(host), memory=self.container_memory)
+
+
+def scheduler_from_env(plan=None):
+    name = os.environ.get("SCHEDULER", "random")
+    zones = json.loads(os.environ.get("DOCKER_HOSTS_ZONES", "{}"))
+    if name == "least-loaded":
+        return LeastLoadedScheduler(zones)
+    if name == "memory":
+        return MemoryScheduler(
+            zones,
+            memory=json.loads(os.environ.get("DOCKER_HOSTS_MEMORY", "{}")),
+            container_memory=container_memory(plan),
+        )
+    return RandomScheduler(zones)
@@ -0,0 +1,114 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import logging
+import os
+import time
+
+import redis
+
+from connections import redis_connection
+from utils import parallel_map
+
+logger = logging.getLogger(__name__)
+
+
+class SentinelQuorumError(Exception):
+    pass
+
+
+# errors meaning the sentinel is already in the state the command asks for,
+# as when a failed add or remove is retried.
+already_done = {
+    "monitor": "Duplicated master name",
+    "remove": "No such master",
+}
+
+
+def check_results(commands, results):
+    for command, result in zip(commands, results):
+        if isinstance(result, redis.ResponseError):
+            expected = already_done.get(command[0].lower())
+            if not expected or expected not in str(result):
+                raise result
+
+
+def stale_masters(conn, commands, results):
+    """Names of the masters a monitor command was refused for because the
+    sentinel already monitors them, at another address than the one asked.
+    """
+    stale = []
+    for command, result in zip(commands, results):
+        if command[0].lower() != "monitor" or not isinstance(result, redis.ResponseError):
+            continue
+        name, host, port = command[1:4]
+        address = conn.sentinel_get_master_addr_by_name(name)
+        if not address or (str(address[0]), int(address[1])) != (str(host), int(port)):
+            stale.append(name)
+    return stale
+
+
+def send(conn, commands):
+    pipe = conn.pipeline(transaction=False)
+    for command in commands:
+        pipe.execute_command("SENTINEL", *command)
+    results = pipe.execute(raise_on_error=False)
+    check_results(commands, results)
+    return results
+
+
+def sentinel_address(url):
+    host, port = url.replace("http://", "").split(":")
+    return str(host), str(port)
+
+
+def connection(url):
+    host, port = sentinel_address(url)
+    timeout = float(os.environ.get("SENTINEL_TIMEOUT", "5"))
+    return redis_connection(host, port, timeout=timeout)
+
+
+def quorum(sentinel_hosts):
+    if "SENTINEL_QUORUM" in os.environ:
+        return int(os.environ["SENTINEL_QUORUM"])
+    return len(sentinel_hosts) / 2 + 1
+
+
+def execute(sentinel_hosts, commands):
+    """Sends ``commands`` to every sentinel at once, pipelined in a single
+    round trip per sentinel. Raises SentinelQuorumError unless at least
+    quorum(sentinel_hosts) sentinels succeeded; returns the per sentinel
+    results as (url, error, elapsed seconds) tuples otherwise.
+    """
+    def run(url):
+        start = time.time()
+        error = None
+        try:
+            conn = connection(url)
+            stale = stale_masters(conn, commands, send(conn, commands))
+            if stale:
+                # left by an add that failed, its containers are gone. The
+                # master is monitored again with the settings asked for.
+                send(conn, [["remove", name] for name in stale] +
+                     [command for command in commands if command[1] in stale])
+        except redis.RedisError as e:
+            error = e
+        elapsed = time.time() - start
+        if error:
+            logger.warning("sentinel %s failed after %.1fms: %s", url, elapsed * 1000, error)
+        else:
+            logger.info("sentinel %s answered in %.1fms", url, elapsed * 1000)
+        return url, error, elapsed
+
+    results = parallel_map(run, sentinel_hosts)
+    if not sentinel_hosts:
+        return results
+    succeeded = len([r for r in results if r[1] is None])
+    if succeeded < quorum(sentinel_hosts):
+        errors = ", ".join("{}: {}".format(url, error)
+                           for url, error, _ in results if error)
+        raise SentinelQuorumError(
+            "only {} of {} sentinels succeeded ({})".format(
+                succeeded, len(sentinel_hosts), errors))
+    return results
@@ -2,22 +2,244 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
 from redisapi import mongodb_database
+from redisapi.metrics import timed
+from redisapi.utils import per_process
+
+logger = logging.getLogger(__name__)
+
+lookups = Counter("redisapi_instance_cache_lookups_total",
+                  "Instances looked up in the instance cache, by whether they were found.",
+                  ["result"])
+
+indexes = [
+    ("instances", "name", {"unique": True}),
+    ("instances", "endpoints.host", {}),
+    ("zabbix", [("host", ASCENDING), ("port", ASCENDING)], {}),
+    ("free_ports", "host", {}),
+    ("acl_units", "instance", {}),
+    ("warm_containers", [("plan", ASCENDING), ("host", ASCENDING), ("created_at", ASCENDING)],
+     {}),
+    ("sagas", [("status", ASCENDING), ("updated_at", ASCENDING)], {}),
+    ("jobs", [("status", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("jobs", [("name", ASCENDING), ("created_at", DESCENDING)], {}),
+]
+
+
+def ensure_indexes(db=None):
+    """Creates the indexes of every collection. An index that can not be
+    created, such as the unique index on names when existing instances
+    share a name, is logged and skipped, so the API keeps serving; returns
+    how many failed.
+    """
+    if db is None:
+        db = mongodb_database()
+    failures = 0
+    for collection, keys, options in indexes:
+        try:
+            db[collection].create_index(keys, **options)
+        except OperationFailure:
+            logger.exception("failed to create the index %s on %s", keys, collection)
+            failures += 1
+    return failures
+
+
+class Endpoint(object):
+    """A redis server of an instance. Endpoints are read like the dicts they
+    are stored as, ``endpoint["host"]``, so code and documents written before
+    the class existed keep working.
+    """
+
+    __slots__ = ("host", "port", "container_id")
+
+    def __init__(self, host, port, container_id=None):
+        if not host:
+            raise ValueError("endpoint host is required")
+        if port is None or port == "":
+            raise ValueError("endpoint port is required")
+        self.host = host
+        self.port = port
+        self.container_id = container_id
+
+    @classmethod
+    def from_document(cls, document):
+        if isinstance(document, cls):
+            return document
+        return cls(document.get("host"), document.get("port"), document.get("container_id"))
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __eq__(self, other):
+        if isinstance(other, Endpoint):
+            other = other.to_json()
+        if isinstance(other, dict):
+            return self.to_json() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Endpoint({!r})".format(self.to_json())
+
+    def to_json(self):
+        document = {"host": self.host, "port": self.port}
+        if self.container_id is not None:
+            document["container_id"] = self.container_id
+        return document
 
 
 class Instance(object):
+    """A redis instance. ``status`` is None once the instance works, and
+    ``pending``, ``removing`` or ``failed`` while a job of the asynchronous
+    provisioning adds or removes it.
+    """
+
+    __slots__ = ("name", "plan", "endpoints", "status")
 
-    def __init__(self, name, plan, endpoints):
+    def __init__(self, name, plan, endpoints, status=None):
         self.name = name
         self.plan = plan
+        if endpoints is not None:
+            endpoints = [Endpoint.from_document(endpoint) for endpoint in endpoints]
         self.endpoints = endpoints
+        self.status = status
+
+    @classmethod
+    def from_document(cls, document):
+        """Builds an instance from a document of the ``instances`` collection.
+        Fields left out by a projection are None.
+        """
+        if document is None:
+            return None
+        return cls(document.get("name"), document.get("plan"), document.get("endpoints"),
+                   document.get("status"))
 
     def to_json(self):
-        return {
-            'endpoints': self.endpoints,
+        endpoints = self.endpoints
+        if endpoints is not None:
+            endpoints = [endpoint.to_json() for endpoint in endpoints]
+        document = {
+            'endpoints': endpoints,
             'name': self.name,
             'plan': self.plan,
         }
+        if self.status is not None:
+            document['status'] = self.status
+        return document
+
+
+def projection(fields):
+    if fields is None:
+        return None
+    return dict((field, 1) for field in fields)
+
+
+class InstanceCache(object):
+    """Least recently used instances looked up by name, kept for ``ttl``
+    seconds. Adding or removing an instance bumps a generation counter in the
+    ``generations`` collection; each process reads it at most once every
+    ``check_interval`` seconds and drops its entries when it has changed.
+    """
+
+    def __init__(self, size, ttl=60, check_interval=1):
+        self.size = size
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.checked_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    def collection(self):
+        return mongodb_database()["generations"]
+
+    def get(self, name):
+        self.sync()
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry and entry[0] > now:
+                self.entries[name] = entry
+                self.hits += 1
+                lookups.labels("hit").inc()
+                return entry[1]
+            self.misses += 1
+        lookups.labels("miss").inc()
+
+    def set(self, name, instance):
+        with self.lock:
+            self.entries.pop(name, None)
+            self.entries[name] = (time.time() + self.ttl, instance)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+        self.collection().update_one({"_id": "instances"}, {"$inc": {"value": 1}}, upsert=True)
+
+    def sync(self):
+        now = time.time()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        doc = self.collection().find_one({"_id": "instances"})
+        generation = doc and doc["value"]
+        if generation != self.generation:
+            with self.lock:
+                self.entries.clear()
+            self.generation = generation
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+def instance_cache():
+    size = int(os.environ.get("INSTANCE_CACHE_SIZE", "0"))
+    if size <= 0:
+        return None
+    return _instance_cache(size)
+
+
+@per_process
+def _instance_cache(size):
+    return InstanceCache(
+        size,
+        ttl=float(os.environ.get("INSTANCE_CACHE_TTL", "60")),
+        check_interval=float(os.environ.get("INSTANCE_CACHE_CHECK_INTERVAL", "1")),
+    )
 
 
 class MongoStorage(object):
@@ -25,26 +247,82 @@ class MongoStorage(object):
     def db(self):
         return mongodb_database()
 
+    @timed("mongodb_add_instance")
     def add_instance(self, instance):
         self.db().instances.insert(instance.to_json())
+        cache = instance_cache()
+        if cache:
+            cache.invalidate(instance.name)
+
+    @timed("mongodb_save_instance")
+    def save_instance(self, instance):
+        """Replaces the document of the instance with the same name, such as
+        the pending instance recorded before its job ran, or adds it.
+        """
+        self.db().instances.replace_one({"name": instance.name}, instance.to_json(),
+                                        upsert=True)
+        cache = instance_cache()
+        if cache:
+            cache.invalidate(instance.name)
+
+    @timed("mongodb_set_instance_status")
+    def set_status(self, name, status):
+        if status is None:
+            update = {"$unset": {"status": ""}}
+        else:
+            update = {"$set": {"status": status}}
+        self.db().instances.update_one({"name": name}, update)
+        cache = instance_cache()
+        if cache:
+            cache.invalidate(name)
+
+    @timed("mongodb_find_instance_by_name")
+    def find_instance_by_name(self, name, fields=None):
+        cache = fields is None and instance_cache()
+        if cache:
+            instance = cache.get(name)
+            if instance:
+                return instance
+        result = self.db().instances.find_one({"name": name}, projection(fields))
+        instance = Instance.from_document(result)
+        if cache:
+            cache.set(name, instance)
+        return instance
+
+    @timed("mongodb_find_instances_by_host")
+    def find_instances_by_host(self, host, fields=None):
+        return list(self.find_instances({"endpoints.host": host}, fields))
+
+    @timed("mongodb_find_instances")
+    def find_instances(self, query=None, fields=None):
+        """Yields the instances matching query, loading only the given fields
+        when fields is not None.
+        """
+        for document in self.db().instances.find(query or {}, projection(fields)):
+            yield Instance.from_document(document)
 
-    def find_instance_by_name(self, name):
-        result = self.db().instances.find_one({"name": name})
-        return Instance(
-            name=result['name'],
-            plan=result['plan'],
-            endpoints=result['endpoints'],
-        )
-
-    def find_instances_by_host(self, host):
-        result = self.db().instances.find({"endpoints.host": host})
-        instances = []
-        for item in result:
-            instance = Instance(name=item['name'],
-                                plan=item['plan'],
-                                endpoints=item['endpoints'])
-            instances.append(instance)
-        return instances
+    @timed("mongodb_list_instances")
+    def list_instances(self, plan=None, host=None, after=None, limit=0, fields=None):
+        """Yields instances ordered by name, starting after the name given in
+        after, so a listing can be resumed from the last instance received.
+        """
+        query = {}
+        if plan:
+            query["plan"] = plan
+        if host:
+            query["endpoints.host"] = host
+        if after:
+            query["name"] = {"$gt": after}
+        cursor = self.db().instances.find(query, projection(fields))
+        cursor = cursor.sort("name", ASCENDING).limit(limit).batch_size(1000)
+        for document in cursor:
+            yield Instance.from_document(document)
 
+    @timed("mongodb_remove_instance")
     def remove_instance(self, instance):
-        return self.db().instances.remove({"name": instance.name})
+        self.db().acl_units.delete_many({"instance": instance.name})
+        result = self.db().instances.remove({"name": instance.name})
+        cache = instance_cache()
+        if cache:
+            cache.invalidate(instance.name)
+        return result
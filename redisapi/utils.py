@@ -2,7 +2,10 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import functools
 import os
+import sys
+import time
 
 
 def get_value(key):
@@ -13,3 +16,77 @@ def get_value(key):
               "environment variable.".format(key)
         raise Exception(msg)
     return value
+
+
+def per_process(factory):
+    """Decorates factory so its result is built once per process and
+    arguments, then reused. A gunicorn worker forked after the first call
+    builds its own instead of sharing the sockets and locks of its parent.
+    ``reset()`` forgets the results built so far.
+    """
+    state = {"pid": None, "results": {}}
+
+    @functools.wraps(factory)
+    def get(*args):
+        pid = os.getpid()
+        if state["pid"] != pid:
+            state["pid"], state["results"] = pid, {}
+        if args not in state["results"]:
+            state["results"][args] = factory(*args)
+        return state["results"][args]
+
+    def reset():
+        state["pid"], state["results"] = None, {}
+
+    get.reset = reset
+    return get
+
+
+def gevent_patched():
+    if "gevent" not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched("threading")
+
+
+def parallel_map(func, items, workers=None):
+    items = list(items)
+    if len(items) < 2 or workers == 1:
+        return [func(item) for item in items]
+    if gevent_patched():
+        # inside gevent workers, greenlets are cheaper than a thread pool.
+        from gevent.pool import Pool
+        return Pool(min(len(items), workers or len(items))).map(func, items)
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(len(items), workers or len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+def wait_for(check, timeout, errors=(), interval=0.01, max_interval=0.5):
+    """Calls check until it returns a true value, and returns that value.
+    Between calls it sleeps interval seconds, doubled after each call up to
+    max_interval. Exceptions in errors are retried like false values. Raises
+    WaitTimeout, with the last of these errors, once timeout seconds passed.
+    """
+    deadline = time.time() + timeout
+    error = None
+    while True:
+        try:
+            result = check()
+            if result:
+                return result
+        except errors as e:
+            error = e
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            message = "not ready after {}s".format(timeout)
+            raise WaitTimeout("{}: {}".format(message, error) if error else message)
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
@@ -0,0 +1,158 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import logging
+import os
+import time
+
+from prometheus_client import Counter
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import ASCENDING
+
+from redisapi import mongodb_database
+from redisapi.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+claims = Counter("redisapi_warm_pool_claims_total",
+                 "Containers asked to the warm pool, by whether one was available.",
+                 ["result"])
+
+
+def pool_size():
+    return int(os.environ.get("WARM_POOL_SIZE", "0"))
+
+
+class WarmPool(object):
+    """Redis containers created and started ahead of time, ``size`` per
+    docker host and plan, as the containers of each plan have their own
+    profile. The ``warm_containers`` collection keeps one document per
+    container, claiming one deletes its document, so a container is never
+    given to two instances.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    def collection(self):
+        return mongodb_database()["warm_containers"]
+
+    def add(self, endpoint, plan):
+        self.collection().insert_one({
+            "_id": endpoint["container_id"],
+            "plan": plan,
+            "host": endpoint["host"],
+            "port": endpoint["port"],
+            "created_at": time.time(),
+        })
+
+    def claim(self, host, plan):
+        endpoint = self.take(host, plan)
+        claims.labels("hit" if endpoint else "miss").inc()
+        return endpoint
+
+    def take(self, host, plan):
+        doc = self.collection().find_one_and_delete(
+            {"plan": plan, "host": host}, sort=[("created_at", ASCENDING)])
+        if doc:
+            return {"host": doc["host"], "port": doc["port"], "container_id": doc["_id"]}
+
+    def counts(self, plan):
+        result = self.collection().aggregate([
+            {"$match": {"plan": plan}},
+            {"$group": {"_id": "$host", "count": {"$sum": 1}}},
+        ])
+        return dict((doc["_id"], doc["count"]) for doc in result)
+
+    def totals(self):
+        result = self.collection().aggregate([
+            {"$group": {"_id": {"plan": "$plan", "host": "$host"}, "count": {"$sum": 1}}},
+        ])
+        return dict(((doc["_id"].get("plan"), doc["_id"]["host"]), doc["count"])
+                    for doc in result)
+
+    def replenish(self, manager):
+        """Creates the containers of the plan of manager missing on each of
+        its reachable docker hosts, and removes the ones above size.
+        """
+        counts = self.counts(manager.plan)
+        created = removed = 0
+        for url in manager.available_hosts():
+            host = manager.extract_hostname(url)
+            missing = self.size - counts.get(host, 0)
+            for _ in range(missing):
+                try:
+                    self.add(manager.create_redis_container(url), manager.plan)
+                except Exception:
+                    logger.exception("failed to create a warm container on %s", host)
+                    break
+                created += 1
+            for _ in range(-missing):
+                endpoint = self.take(host, manager.plan)
+                if endpoint:
+                    manager.remove_container(endpoint)
+                    removed += 1
+        return created, removed
+
+    def prune(self, manager, plans):
+        """Removes the containers of the plans not in plans, such as plans
+        no longer active, with manager.
+        """
+        removed = 0
+        while True:
+            doc = self.collection().find_one_and_delete({"plan": {"$nin": plans}})
+            if not doc:
+                return removed
+            manager.remove_container(
+                {"host": doc["host"], "port": doc["port"], "container_id": doc["_id"]})
+            removed += 1
+
+
+class WarmPoolCollector(object):
+
+    def metric(self):
+        return GaugeMetricFamily("redisapi_warm_pool_containers",
+                                 "Containers waiting in the warm pool of each docker host.",
+                                 labels=["plan", "host"])
+
+    def describe(self):
+        return [self.metric()]
+
+    def collect(self):
+        metric = self.metric()
+        if pool_size() > 0:
+            for (plan, host), count in sorted(WarmPool(pool_size()).totals().items()):
+                metric.add_metric([plan or "", host], count)
+        return [metric]
+
+
+register_collector(WarmPoolCollector())
+
+
+def main():
+    from redisapi.managers import manager_by_plan_name
+    from redisapi.plans import active
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    interval = float(os.environ.get("WARM_POOL_INTERVAL", "10"))
+    pool = WarmPool(pool_size())
+    plans = [plan["name"] for plan in active() if "profile" in plan]
+    managers = [manager_by_plan_name(plan) for plan in plans]
+    while True:
+        start = time.time()
+        try:
+            removed = pool.prune(managers[0], plans) if managers else 0
+            if removed:
+                logger.info("warm pool: %d containers of inactive plans removed", removed)
+            for manager in managers:
+                created, removed = pool.replenish(manager)
+                if created or removed:
+                    logger.info("warm pool: %d %s containers created, %d removed",
+                                created, manager.plan, removed)
+        except Exception:
+            logger.exception("failed to replenish the warm pool")
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
+if __name__ == "__main__":
+    main()
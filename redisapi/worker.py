@@ -0,0 +1,95 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import logging
+import os
+import threading
+import time
+
+from redisapi.jobs import JobQueue
+from redisapi.managers import manager_by_instance, manager_by_plan_name
+from redisapi.prober import status_cache
+from redisapi.storage import MongoStorage
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat(object):
+    """Refreshes the running job every interval seconds, so other workers
+    do not take it over while it is alive, however long it takes.
+    """
+
+    def __init__(self, queue, job, interval):
+        self.queue = queue
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.job)
+            except Exception:
+                logger.exception("failed to refresh the %s job for %s",
+                                 self.job["action"], self.job["name"])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stopped.set()
+        self.thread.join()
+
+
+def process(job):
+    if job["action"] not in ("add", "remove"):
+        raise ValueError("unknown job action: {}".format(job["action"]))
+    storage = MongoStorage()
+    try:
+        if job["action"] == "add":
+            instance = manager_by_plan_name(job["plan"]).add_instance(job["name"])
+            # replaces the pending instance recorded by the API.
+            storage.save_instance(instance)
+        else:
+            instance = storage.find_instance_by_name(job["name"])
+            manager_by_instance(instance).remove_instance(instance)
+            storage.remove_instance(instance)
+            status_cache().remove(job["name"])
+    except Exception:
+        storage.set_status(job["name"], "failed")
+        raise
+
+
+def run_once(queue):
+    job = queue.claim()
+    if not job:
+        return False
+    start = time.time()
+    try:
+        with Heartbeat(queue, job, queue.timeout / 4.0):
+            process(job)
+    except Exception as e:
+        logger.exception("%s job for %s failed", job["action"], job["name"])
+        queue.finish(job, error=e)
+    else:
+        logger.info("%s job for %s done in %.1fs", job["action"], job["name"],
+                    time.time() - start)
+        queue.finish(job)
+    return True
+
+
+def main():
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    interval = float(os.environ.get("JOBS_POLL_INTERVAL", "1"))
+    queue = JobQueue()
+    while True:
+        if not run_once(queue):
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
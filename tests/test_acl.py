@@ -9,7 +9,7 @@ import mock
 
 from aclapiclient import l4_options
 
-from redisapi import acl, storage
+from redisapi import acl, mongodb_database, storage
 
 
 class GloboACLManagerTest(unittest.TestCase):
@@ -22,6 +22,8 @@ class GloboACLManagerTest(unittest.TestCase):
     def tearDown(self):
         for env in ("ACL_API_ENDPOINT", "ACL_API_USERNAME", "ACL_API_PASSWORD"):
             del os.environ[env]
+        os.environ.pop("ACL_COMMIT_WINDOW", None)
+        mongodb_database().acl_units.remove({})
 
     @mock.patch("aclapiclient.aclapiclient.Client")
     def test_new_manager(self, Client):
@@ -82,6 +84,216 @@ class GloboACLManagerTest(unittest.TestCase):
                                                           target="dest"))
         client.commit.assert_called_once()
 
+    def instance(self):
+        endpoints = [{"host": "10.0.0.1", "port": 4532},
+                     {"host": "10.0.0.2", "port": 4536}]
+        return storage.Instance(name="myredis", endpoints=endpoints, plan="plus")
+
+    def test_grant_access_many_deduplicates_subnet(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access_many(self.instance(), ["192.168.1.13", "192.168.1.14",
+                                                    "192.168.2.10"])
+        calls = client.add_tcp_permit_access.call_args_list
+        self.assertEqual(4, len(calls))
+        sources = [call[1]["source"] for call in calls]
+        self.assertEqual(["192.168.1.0/24", "192.168.1.0/24",
+                          "192.168.2.0/24", "192.168.2.0/24"], sources)
+        client.commit.assert_called_once_with()
+        self.assertEqual([], client.jobs)
+
+    def test_grant_access_subnet_already_bound(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "192.168.1.13")
+        manager.grant_access(self.instance(), "192.168.1.20")
+        manager.grant_access(self.instance(), "192.168.1.13")
+        self.assertEqual(2, client.add_tcp_permit_access.call_count)
+        client.commit.assert_called_once_with()
+
+    def test_grant_access_state_is_shared(self):
+        first = acl.GloboACLAPIManager()
+        first.client = mock.Mock()
+        second = acl.GloboACLAPIManager()
+        second.client = client = mock.Mock()
+        first.grant_access(self.instance(), "192.168.1.13")
+        second.grant_access(self.instance(), "192.168.1.20")
+        self.assertFalse(client.add_tcp_permit_access.called)
+
+    def test_revoke_access_keeps_subnet_with_units(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "192.168.1.13")
+        manager.grant_access(self.instance(), "192.168.1.20")
+        manager.revoke_access(self.instance(), "192.168.1.13")
+        self.assertFalse(client.remove_tcp_permit_access.called)
+        manager.revoke_access(self.instance(), "192.168.1.20")
+        self.assertEqual(2, client.remove_tcp_permit_access.call_count)
+        self.assertEqual(2, client.commit.call_count)
+        self.assertEqual(0, mongodb_database().acl_units.count())
+
+    def test_revoke_access_unknown_unit_of_bound_subnet(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "192.168.1.13")
+        manager.revoke_access(self.instance(), "192.168.1.99")
+        self.assertFalse(client.remove_tcp_permit_access.called)
+
+    def test_revoke_access_many_last_units(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access_many(self.instance(), ["192.168.1.13", "192.168.1.20"])
+        manager.revoke_access_many(self.instance(), ["192.168.1.13", "192.168.1.20"])
+        self.assertEqual(2, client.remove_tcp_permit_access.call_count)
+        self.assertEqual(2, client.commit.call_count)
+
+    def test_failed_grant_is_retried(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        client.add_tcp_permit_access.side_effect = ValueError("failed")
+        manager.grant_access(self.instance(), "192.168.1.13")
+        self.assertFalse(client.commit.called)
+        client.add_tcp_permit_access.side_effect = None
+        manager.grant_access(self.instance(), "192.168.1.20")
+        self.assertEqual(4, client.add_tcp_permit_access.call_count)
+        client.commit.assert_called_once_with()
+
+    @mock.patch("redisapi.acl.logger")
+    def test_grant_access_many_outcomes(self, logger):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        client.add_tcp_permit_access.side_effect = [None, None, IOError("timed out"), None]
+        outcomes = manager.grant_access_many(self.instance(), ["192.168.1.13", "192.168.1.20",
+                                                               "192.168.2.10"])
+        self.assertEqual({"192.168.1.13": "ok", "192.168.1.20": "ok",
+                          "192.168.2.10": "timed out"}, outcomes)
+        client.commit.assert_called_once_with()
+        self.assertEqual({"myredis": ["192.168.1.13", "192.168.1.20"]},
+                         manager.state.units("myredis"))
+
+    @mock.patch("threading.Timer")
+    def test_grant_access_many_queued(self, Timer):
+        os.environ["ACL_COMMIT_WINDOW"] = "0.5"
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        outcomes = manager.grant_access_many(self.instance(), ["192.168.1.13"])
+        self.assertEqual({"192.168.1.13": "queued"}, outcomes)
+        self.assertFalse(client.commit.called)
+
+    @mock.patch("redisapi.acl.logger")
+    def test_failed_grant_any_error(self, logger):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        client.add_tcp_permit_access.side_effect = [None, IOError("timed out")]
+        manager.grant_access(self.instance(), "192.168.1.13")
+        self.assertTrue(logger.exception.called)
+        self.assertEqual(0, mongodb_database().acl_units.count())
+
+    @mock.patch("redisapi.acl.logger")
+    def test_failed_revoke_keeps_unit(self, logger):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "192.168.1.13")
+        client.remove_tcp_permit_access.side_effect = IOError("timed out")
+        manager.revoke_access(self.instance(), "192.168.1.13")
+        self.assertEqual(["192.168.1.13"], manager.state.units("myredis")["myredis"])
+        client.remove_tcp_permit_access.side_effect = None
+        manager.revoke_access(self.instance(), "192.168.1.13")
+        self.assertEqual(0, mongodb_database().acl_units.count())
+
+    @mock.patch("threading.Timer")
+    def test_commit_window(self, Timer):
+        os.environ["ACL_COMMIT_WINDOW"] = "0.5"
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "192.168.1.13")
+        manager.grant_access(self.instance(), "192.168.2.13")
+        manager.revoke_access(self.instance(), "192.168.2.13")
+        Timer.assert_called_once_with(0.5, manager.flush_pending)
+        Timer.return_value.start.assert_called_once_with()
+        self.assertFalse(client.add_tcp_permit_access.called)
+        manager.flush()
+        self.assertEqual(2, client.add_tcp_permit_access.call_count)
+        self.assertFalse(client.remove_tcp_permit_access.called)
+        client.commit.assert_called_once_with()
+        self.assertIsNone(manager.timer)
+
+    @mock.patch("threading.Timer")
+    def test_commit_window_grant_then_revoke(self, Timer):
+        os.environ["ACL_COMMIT_WINDOW"] = "0.5"
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "10.2.2.5")
+        manager.revoke_access(self.instance(), "10.2.2.5")
+        manager.flush()
+        self.assertFalse(client.add_tcp_permit_access.called)
+        self.assertFalse(client.remove_tcp_permit_access.called)
+        self.assertFalse(client.commit.called)
+        manager.grant_access(self.instance(), "10.2.2.6")
+        manager.flush()
+        self.assertEqual(2, client.add_tcp_permit_access.call_count)
+        self.assertEqual({"myredis": ["10.2.2.6"]}, manager.state.units("myredis"))
+
+    @mock.patch("threading.Timer")
+    def test_commit_window_revoke_then_grant(self, Timer):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "10.2.2.5")
+        manager.commit_window = 0.5
+        manager.revoke_access(self.instance(), "10.2.2.5")
+        manager.grant_access(self.instance(), "10.2.2.5")
+        manager.flush()
+        self.assertEqual(2, client.add_tcp_permit_access.call_count)
+        self.assertFalse(client.remove_tcp_permit_access.called)
+        client.commit.assert_called_once_with()
+        self.assertEqual({"myredis": ["10.2.2.5"]}, manager.state.units("myredis"))
+
+    @mock.patch("redisapi.acl.logger")
+    @mock.patch("threading.Timer")
+    def test_commit_window_failure(self, Timer, logger):
+        os.environ["ACL_COMMIT_WINDOW"] = "0.5"
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        client.commit.side_effect = Exception("acl api is down")
+        manager.grant_access(self.instance(), "192.168.1.13")
+        manager.flush_pending()
+        self.assertTrue(logger.exception.called)
+        self.assertEqual([], client.jobs)
+        self.assertEqual(2, len(manager.pending))
+        self.assertEqual(2, Timer.return_value.start.call_count)
+        client.commit.side_effect = None
+        manager.flush_pending()
+        self.assertEqual(4, client.add_tcp_permit_access.call_count)
+        self.assertEqual({}, manager.pending)
+        self.assertEqual(1, mongodb_database().acl_units.count())
+
+    def test_commit_failure(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        client.commit.side_effect = Exception("acl api is down")
+        with self.assertRaises(Exception):
+            manager.grant_access(self.instance(), "192.168.1.13")
+        self.assertEqual([], client.jobs)
+        self.assertEqual({}, manager.pending)
+        self.assertEqual(0, mongodb_database().acl_units.count())
+
+    def test_revoke_commit_failure_keeps_unit(self):
+        manager = acl.GloboACLAPIManager()
+        manager.client = client = mock.Mock()
+        manager.grant_access(self.instance(), "192.168.1.13")
+        client.commit.side_effect = Exception("acl api is down")
+        with self.assertRaises(Exception):
+            manager.revoke_access(self.instance(), "192.168.1.13")
+        self.assertEqual(["192.168.1.13"], manager.state.units("myredis")["myredis"])
+
+    @mock.patch("atexit.register")
+    def test_commit_window_flushed_at_exit(self, register):
+        acl.GloboACLAPIManager()
+        self.assertFalse(register.called)
+        os.environ["ACL_COMMIT_WINDOW"] = "0.5"
+        manager = acl.GloboACLAPIManager()
+        register.assert_called_once_with(manager.flush_pending)
+
     def assert_permit_call(self, call, desc, source, dest, l4_opts):
         kw = call[1]
         self.assertEqual(desc, kw["desc"])
@@ -93,8 +305,58 @@ class GloboACLManagerTest(unittest.TestCase):
         self.assertEqual(l4_opts.target, provided_opts.target)
 
 
+class ValidUnitHostTest(unittest.TestCase):
+
+    def test_valid_unit_host(self):
+        self.assertTrue(acl.valid_unit_host("10.0.0.1"))
+        for unit_host in ("10.1", "10.0.0.256", "a.b.c.d", "10.0.0.1/24", "", None):
+            self.assertFalse(acl.valid_unit_host(unit_host), unit_host)
+
+
+class AccessStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = acl.AccessState()
+
+    def tearDown(self):
+        self.state.collection().remove({})
+
+    def test_add(self):
+        self.assertTrue(self.state.add("myredis", "10.0.0.1"))
+        self.assertFalse(self.state.add("myredis", "10.0.0.2"))
+        self.assertFalse(self.state.add("myredis", "10.0.0.1"))
+        self.assertTrue(self.state.add("myredis", "10.0.1.1"))
+        self.assertTrue(self.state.add("other", "10.0.0.1"))
+        doc = self.state.collection().find_one({"_id": "myredis:10.0.0.0/24"})
+        self.assertEqual(["10.0.0.1", "10.0.0.2"], doc["units"])
+        self.assertEqual("myredis", doc["instance"])
+        self.assertEqual("10.0.0.0/24", doc["subnet"])
+
+    def test_remove(self):
+        self.state.add("myredis", "10.0.0.1")
+        self.state.add("myredis", "10.0.0.2")
+        self.assertFalse(self.state.remove("myredis", "10.0.0.1"))
+        self.assertFalse(self.state.remove("myredis", "10.0.0.1"))
+        self.assertTrue(self.state.remove("myredis", "10.0.0.2"))
+        self.assertIsNone(self.state.collection().find_one({"_id": "myredis:10.0.0.0/24"}))
+
+    def test_remove_untracked_subnet(self):
+        self.assertTrue(self.state.remove("myredis", "10.0.0.1"))
+
+    def test_units(self):
+        self.state.add("myredis", "10.0.1.1")
+        self.state.add("myredis", "10.0.0.1")
+        self.state.add("other", "10.0.0.2")
+        self.assertEqual(["10.0.0.1", "10.0.1.1"], self.state.units("myredis")["myredis"])
+        self.assertEqual({"myredis": ["10.0.0.1", "10.0.1.1"], "other": ["10.0.0.2"]},
+                         self.state.units())
+
+
 class DumbManagerTest(unittest.TestCase):
 
+    def tearDown(self):
+        mongodb_database().acl_units.remove({})
+
     def test_grant_access(self):
         instance = storage.Instance(name="myredis", endpoints=None, plan="plus")
         manager = acl.DumbAccessManager()
@@ -111,3 +373,8 @@ class DumbManagerTest(unittest.TestCase):
         self.assertEqual(["10.0.0.2"], manager.permits["myredis"])
         manager.revoke_access(instance, "10.0.0.2")
         self.assertEqual([], manager.permits["myredis"])
+
+    def test_permits_are_shared(self):
+        instance = storage.Instance(name="myredis", endpoints=None, plan="plus")
+        acl.DumbAccessManager().grant_access(instance, "10.0.0.1")
+        self.assertEqual(["10.0.0.1"], acl.DumbAccessManager().permits["myredis"])
@@ -9,8 +9,10 @@ import mock
 
 from redisapi import plans
 from redisapi.api import manager_by_plan_name, manager_by_instance
+from redisapi.jobs import JobQueue
+from redisapi.prober import status_cache
 from redisapi.storage import Instance, MongoStorage
-from redisapi.managers import SharedManager, DockerManager, DockerHaManager
+from redisapi.managers import SharedManager, DockerManager, DockerHaManager, reload_managers
 
 
 class RedisAPITestCase(unittest.TestCase):
@@ -22,9 +24,25 @@ class RedisAPITestCase(unittest.TestCase):
     def setUp(self):
         os.environ["REDIS_SERVER_HOST"] = "localhost"
         self.addCleanup(self.remove_env, "REDIS_SERVER_HOST")
+        reload_managers()
+        self.addCleanup(reload_managers)
+        self.addCleanup(status_cache().collection().remove)
+        self.addCleanup(status_cache().local.clear)
         from redisapi import api
         self.app = api.app.test_client()
 
+    def create_instance(self, name="myinstance"):
+        storage = MongoStorage()
+        instance = Instance(
+            name=name,
+            plan='development',
+            endpoints=[{"host": "host", "port": "port",
+                        "container_id": "id"}],
+        )
+        storage.add_instance(instance)
+        self.addCleanup(storage.remove_instance, instance)
+        return instance
+
     def test_manager_by_plan_name_development(self):
         manager = manager_by_plan_name("development")
         self.assertIsInstance(manager, SharedManager)
@@ -57,6 +75,7 @@ class RedisAPITestCase(unittest.TestCase):
     @mock.patch("redisapi.storage.MongoStorage")
     def test_add_instance(self, mongo_mock, manager):
         storage_mock = mongo_mock.return_value
+        storage_mock.find_instance_by_name.return_value = None
         fake_mock = mock.Mock()
         fake_instance = mock.Mock()
         fake_mock.add_instance.return_value = fake_instance
@@ -70,12 +89,50 @@ class RedisAPITestCase(unittest.TestCase):
         manager.assert_called_with('basic')
         storage_mock.add_instance.assert_called_with(fake_instance)
 
+    @mock.patch("redisapi.api.manager_by_plan_name")
+    def test_add_instance_conflict(self, manager):
+        MongoStorage().add_instance(Instance(name="name", plan="basic", endpoints=[]))
+        self.addCleanup(MongoStorage().db().instances.remove, {"name": "name"})
+
+        response = self.app.post("/resources",
+                                 data={"name": "name", "plan": "basic"})
+
+        self.assertEqual(409, response.status_code)
+        self.assertFalse(manager.called)
+
+    def latency_count(self, method, route, status):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value("redisapi_request_duration_seconds_count", {
+            "method": method, "route": route, "status": status}) or 0
+
+    def test_request_latency(self):
+        before = self.latency_count("POST", "/resources", "400")
+        self.app.post("/resources", data={"name": "name"})
+        self.assertEqual(before + 1, self.latency_count("POST", "/resources", "400"))
+
+    @mock.patch("redisapi.api.app.log_exception")
+    @mock.patch("redisapi.api.manager_by_plan_name")
+    def test_request_latency_of_failed_request(self, manager, log_exception):
+        manager.return_value.add_instance.side_effect = Exception("docker is down")
+        before = self.latency_count("POST", "/resources", "500")
+        response = self.app.post("/resources", data={"name": "name", "plan": "basic"})
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(before + 1, self.latency_count("POST", "/resources", "500"))
+
     def test_add_instance_with_no_plan(self):
         response = self.app.post("/resources",
                                  data={"name": "name"})
         self.assertEqual(400, response.status_code)
         self.assertEqual("plan is required", response.data)
 
+    def test_add_instance_async_invalid_plan(self):
+        queue = self.async_queue()
+        response = self.app.post("/resources", data={"name": "name", "plan": "huge"})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("invalid plan huge", response.data)
+        self.assertIsNone(MongoStorage().find_instance_by_name("name"))
+        self.assertIsNone(queue.last_job("name"))
+
     def test_add_instance_with_empty_plan(self):
         response = self.app.post("/resources",
                                  data={"name": "name", "plan": ""})
@@ -95,15 +152,115 @@ class RedisAPITestCase(unittest.TestCase):
         self.assertEqual("", response.data)
         storage_mock.remove_instance.assert_called_with(instance_mock)
 
+    def async_queue(self):
+        os.environ["PROVISIONING_MODE"] = "async"
+        self.addCleanup(self.remove_env, "PROVISIONING_MODE")
+        queue = JobQueue()
+        self.addCleanup(queue.collection().remove)
+        self.addCleanup(queue.locks().remove)
+        self.addCleanup(MongoStorage().db().instances.remove)
+        return queue
+
+    @mock.patch("redisapi.api.manager_by_plan_name")
+    def test_add_instance_async(self, manager):
+        queue = self.async_queue()
+
+        response = self.app.post("/resources",
+                                 data={"name": "name", "plan": "basic"})
+
+        self.assertEqual(201, response.status_code)
+        self.assertFalse(manager.called)
+        job = queue.last_job("name")
+        self.assertEqual("add", job["action"])
+        self.assertEqual("basic", job["plan"])
+        self.assertEqual("pending", job["status"])
+        instance = MongoStorage().find_instance_by_name("name")
+        self.assertEqual("pending", instance.status)
+        self.assertEqual("basic", instance.plan)
+
+    def test_add_instance_async_conflict(self):
+        self.async_queue()
+        self.app.post("/resources", data={"name": "name", "plan": "basic"})
+
+        response = self.app.post("/resources",
+                                 data={"name": "name", "plan": "basic"})
+
+        self.assertEqual(409, response.status_code)
+
+    def test_add_instance_async_after_failure(self):
+        queue = self.async_queue()
+        self.app.post("/resources", data={"name": "name", "plan": "basic"})
+        queue.finish(queue.claim(), error=Exception("docker is down"))
+        MongoStorage().set_status("name", "failed")
+
+        response = self.app.post("/resources",
+                                 data={"name": "name", "plan": "basic"})
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual("pending", MongoStorage().find_instance_by_name("name").status)
+
+    @mock.patch("redisapi.api.manager_by_instance")
+    def test_remove_instance_async(self, manager):
+        queue = self.async_queue()
+        self.create_instance()
+
+        response = self.app.delete("/resources/myinstance")
+
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(manager.called)
+        self.assertEqual("remove", queue.last_job("myinstance")["action"])
+        self.assertEqual("removing", MongoStorage().find_instance_by_name("myinstance").status)
+
+    def test_remove_instance_async_while_adding(self):
+        self.async_queue()
+        self.app.post("/resources", data={"name": "myinstance", "plan": "basic"})
+
+        response = self.app.delete("/resources/myinstance")
+
+        self.assertEqual(409, response.status_code)
+        self.assertEqual("add of myinstance is pending", response.data)
+
+    def test_status_async_pending(self):
+        self.async_queue()
+        self.app.post("/resources", data={"name": "myinstance", "plan": "basic"})
+
+        response = self.app.get("/resources/myinstance/status")
+
+        self.assertEqual(202, response.status_code)
+        self.assertEqual("add is pending", response.data)
+
+    def test_status_async_failed(self):
+        queue = self.async_queue()
+        self.app.post("/resources", data={"name": "myinstance", "plan": "basic"})
+        queue.finish(queue.claim(), error=Exception("docker is down"))
+        MongoStorage().set_status("myinstance", "failed")
+
+        response = self.app.get("/resources/myinstance/status")
+
+        self.assertEqual(500, response.status_code)
+        self.assertEqual("docker is down", response.data)
+
+    def test_bind_app_async_pending(self):
+        self.async_queue()
+        self.app.post("/resources", data={"name": "myinstance", "plan": "basic"})
+
+        response = self.app.post("/resources/myinstance/bind-app",
+                                 data={"hostname": "something.tsuru.io"})
+
+        self.assertEqual(412, response.status_code)
+        self.assertEqual("instance is pending", response.data)
+
+    def test_bind_units_async_pending(self):
+        self.async_queue()
+        self.app.post("/resources", data={"name": "myinstance", "plan": "basic"})
+
+        response = self.app.post("/resources/myinstance/bind-units",
+                                 data={"unit-host": "10.0.0.1"})
+
+        self.assertEqual(412, response.status_code)
+
     def test_bind_app(self):
-        storage = MongoStorage()
-        instance = Instance(
-            name='myinstance',
-            plan='development',
-            endpoints=[{"host": "host", "port": "port",
-                        "container_id": "id"}],
-        )
-        storage.add_instance(instance)
+        instance = self.create_instance()
         response = self.app.post(
             "/resources/myinstance/bind-app",
             data={"hostname": "something.tsuru.io"}
@@ -120,6 +277,7 @@ class RedisAPITestCase(unittest.TestCase):
         self.assertEqual("", response.data)
 
     def test_bind_unit(self):
+        self.create_instance()
         response = self.app.post("/resources/myinstance/bind",
                                  data={"unit-host": "10.0.0.1"})
         self.assertEqual(201, response.status_code)
@@ -131,6 +289,7 @@ class RedisAPITestCase(unittest.TestCase):
         self.assertEqual("unit-host is required", response.data)
 
     def test_unbind_unit(self):
+        self.create_instance()
         response = self.app.delete("/resources/myinstance/bind",
                                    data={"unit-host": "10.0.0.1"},
                                    headers={"Content-Type": "application/x-www-form-urlencoded"})
@@ -142,15 +301,163 @@ class RedisAPITestCase(unittest.TestCase):
         self.assertEqual(400, response.status_code)
         self.assertEqual("unit-host is required", response.data)
 
+    def list_instances(self, query=""):
+        os.environ["ADMIN_TOKEN"] = "secret"
+        self.addCleanup(self.remove_env, "ADMIN_TOKEN")
+        response = self.app.get("/resources" + query,
+                                headers={"Authorization": "Bearer secret"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/x-ndjson", response.mimetype)
+        return [json.loads(line) for line in response.data.splitlines()]
+
+    def create_instances(self):
+        storage = MongoStorage()
+        for name, plan, host in (("c", "plus", "10.0.0.1"), ("a", "basic", "10.0.0.2"),
+                                 ("b", "basic", "10.0.0.1")):
+            instance = Instance(name=name, plan=plan,
+                                endpoints=[{"host": host, "port": 49153, "container_id": name}])
+            storage.add_instance(instance)
+            self.addCleanup(storage.remove_instance, instance)
+
+    def test_list_instances(self):
+        self.create_instances()
+        instances = self.list_instances()
+        self.assertEqual(["a", "b", "c"], [i["name"] for i in instances])
+        self.assertEqual({"name": "a", "plan": "basic",
+                          "endpoints": [{"host": "10.0.0.2", "port": 49153, "container_id": "a"}]},
+                         instances[0])
+
+    def test_list_instances_filters(self):
+        self.create_instances()
+        self.assertEqual(["a", "b"], [i["name"] for i in self.list_instances("?plan=basic")])
+        self.assertEqual(["b", "c"], [i["name"] for i in self.list_instances("?host=10.0.0.1")])
+        self.assertEqual(["b"],
+                         [i["name"] for i in self.list_instances("?host=10.0.0.1&plan=basic")])
+
+    def test_list_instances_pagination(self):
+        self.create_instances()
+        self.assertEqual(["a", "b"], [i["name"] for i in self.list_instances("?limit=2")])
+        self.assertEqual(["c"], [i["name"] for i in self.list_instances("?limit=2&after=b")])
+        self.assertEqual([], self.list_instances("?after=c"))
+
+    def test_list_instances_invalid_limit(self):
+        os.environ["ADMIN_TOKEN"] = "secret"
+        self.addCleanup(self.remove_env, "ADMIN_TOKEN")
+        response = self.app.get("/resources?limit=ten",
+                                headers={"Authorization": "Bearer secret"})
+        self.assertEqual(400, response.status_code)
+
+    def test_list_instances_admin_token(self):
+        os.environ["ADMIN_TOKEN"] = "secret"
+        self.addCleanup(self.remove_env, "ADMIN_TOKEN")
+        self.create_instances()
+        response = self.app.get("/resources")
+        self.assertEqual(401, response.status_code)
+        response = self.app.get("/resources", headers={"Authorization": "Bearer wrong"})
+        self.assertEqual(401, response.status_code)
+        response = self.app.get("/resources", headers={"Authorization": u"Bearer s\xe9cret"})
+        self.assertEqual(401, response.status_code)
+        self.assertEqual(3, len(self.list_instances()))
+
+    def test_list_instances_without_admin_token(self):
+        self.create_instances()
+        response = self.app.get("/resources", headers={"Authorization": "Bearer "})
+        self.assertEqual(403, response.status_code)
+
+    def test_bind_units(self):
+        self.create_instance()
+        response = self.app.post("/resources/myinstance/bind-units",
+                                 data={"unit-host": ["10.0.0.1", "10.0.0.2"]})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({"10.0.0.1": "ok", "10.0.0.2": "ok"}, json.loads(response.data))
+
+    @mock.patch("redisapi.api.manager_by_instance")
+    def test_bind_units_grants_once(self, manager_mock):
+        manager_mock.return_value = manager = mock.Mock()
+        manager.grant_many.return_value = {"10.0.0.1": "ok", "10.0.0.2": "ok"}
+        self.create_instance()
+        response = self.app.post("/resources/myinstance/bind-units",
+                                 data={"unit-host": ["10.0.0.1", "invalid", "10.0.0.2",
+                                                     "10.0.0.1"]})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({"10.0.0.1": "ok", "10.0.0.2": "ok", "invalid": "invalid unit host"},
+                         json.loads(response.data))
+        manager_mock.assert_called_once_with(mock.ANY)
+        manager.grant_many.assert_called_once_with(mock.ANY, ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual("myinstance", manager.grant_many.call_args[0][0].name)
+
+    @mock.patch("redisapi.api.manager_by_instance")
+    def test_bind_units_outcomes(self, manager_mock):
+        manager_mock.return_value = manager = mock.Mock()
+        manager.grant_many.return_value = {"10.0.0.1": "queued", "10.0.1.1": "timed out"}
+        self.create_instance()
+        response = self.app.post("/resources/myinstance/bind-units",
+                                 data={"unit-host": ["10.0.0.1", "10.0.1.1", "10.0.0.256",
+                                                     "10.1", "a.b.c.d"]})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({"10.0.0.1": "queued", "10.0.1.1": "timed out",
+                          "10.0.0.256": "invalid unit host", "10.1": "invalid unit host",
+                          "a.b.c.d": "invalid unit host"}, json.loads(response.data))
+
+    @mock.patch("redisapi.api.manager_by_instance")
+    def test_bind_units_failure(self, manager_mock):
+        manager_mock.return_value = manager = mock.Mock()
+        manager.grant_many.side_effect = ValueError("acl api is down")
+        self.create_instance()
+        response = self.app.post("/resources/myinstance/bind-units",
+                                 data={"unit-host": ["10.0.0.1", "10.0.0.2"]})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({"10.0.0.1": "acl api is down", "10.0.0.2": "acl api is down"},
+                         json.loads(response.data))
+
+    def test_bind_units_no_unit_host(self):
+        response = self.app.post("/resources/myinstance/bind-units")
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("unit-host is required", response.data)
+
     @mock.patch("redisapi.api.manager_by_instance")
+    def test_unbind_units(self, manager_mock):
+        manager_mock.return_value = manager = mock.Mock()
+        manager.revoke_many.return_value = {"10.0.0.1": "ok", "10.0.0.2": "ok"}
+        self.create_instance()
+        response = self.app.delete("/resources/myinstance/bind-units",
+                                   data={"unit-host": ["10.0.0.1", "10.0.0.2"]},
+                                   headers={"Content-Type": "application/x-www-form-urlencoded"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"10.0.0.1": "ok", "10.0.0.2": "ok"}, json.loads(response.data))
+        manager.revoke_many.assert_called_once_with(mock.ANY, ["10.0.0.1", "10.0.0.2"])
+
+    def test_unbind_units_no_unit_host(self):
+        response = self.app.delete("/resources/myinstance/bind-units")
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("unit-host is required", response.data)
+
+    @mock.patch("redisapi.prober.manager_by_instance")
     def test_status(self, manager_mock):
         fake_manager = mock.Mock()
         fake_manager.is_ok.return_value = False, "error"
         manager_mock.return_value = fake_manager
+        self.create_instance()
         from redisapi import api
         content, code = api.status("myinstance")
         self.assertEqual(500, code)
         self.assertEqual("error", content)
+        self.assertEqual("myinstance", fake_manager.is_ok.call_args[0][0].name)
+
+    @mock.patch("redisapi.prober.manager_by_instance")
+    def test_status_from_cache(self, manager_mock):
+        status_cache().set("myinstance", True, "")
+        response = self.app.get("/resources/myinstance/status")
+        self.assertEqual(204, response.status_code)
+        self.assertFalse(manager_mock.called)
+
+    @mock.patch("redisapi.api.manager_by_instance")
+    def test_remove_instance_clears_status(self, manager_mock):
+        self.create_instance()
+        status_cache().set("myinstance", True, "")
+        response = self.app.delete("/resources/myinstance")
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(status_cache().get("myinstance"))
 
     def test_plans(self):
         os.environ["REDIS_API_PLANS"] = '["development", "basic", "plus"]'
@@ -0,0 +1,58 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import unittest
+
+import mock
+
+from redisapi import connections
+
+
+class RedisConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        connections._pools.reset()
+        self.addCleanup(connections._pools.reset)
+
+    def test_redis_connection(self):
+        conn = connections.redis_connection("localhost", "6379", password="pw", timeout=2)
+        kwargs = conn.connection_pool.connection_kwargs
+        self.assertEqual("localhost", kwargs["host"])
+        self.assertEqual(6379, kwargs["port"])
+        self.assertEqual("pw", kwargs["password"])
+        self.assertEqual(2, kwargs["socket_timeout"])
+        self.assertEqual(2, kwargs["socket_connect_timeout"])
+
+    def test_redis_connection_reuses_pool(self):
+        conn = connections.redis_connection("localhost", 6379)
+        self.assertIs(conn.connection_pool,
+                      connections.redis_connection("localhost", "6379").connection_pool)
+        self.assertIsNot(conn.connection_pool,
+                         connections.redis_connection("localhost", 6380).connection_pool)
+
+    def test_redis_connection_keeps_recent_pools(self):
+        os.environ["REDIS_MAX_POOLS"] = "2"
+        self.addCleanup(os.environ.pop, "REDIS_MAX_POOLS")
+        first = connections.redis_connection("localhost", 6379).connection_pool
+        connections.redis_connection("localhost", 6380)
+        connections.redis_connection("localhost", 6379)
+        connections.redis_connection("localhost", 6381)
+        self.assertEqual([("localhost", 6379), ("localhost", 6381)],
+                         [key[:2] for key in connections._pools()[0]])
+        self.assertIs(first, connections.redis_connection("localhost", 6379).connection_pool)
+
+    def test_disconnect(self):
+        pools = [connections.redis_connection("localhost", port).connection_pool
+                 for port in (6379, 6380)]
+        with mock.patch.object(pools[0], "disconnect") as disconnect:
+            connections.disconnect("localhost", "6379")
+        disconnect.assert_called_once_with()
+        self.assertEqual([("localhost", 6380)], [key[:2] for key in connections._pools()[0]])
+
+    def test_disconnect_all(self):
+        connections.redis_connection("localhost", 6379)
+        connections.redis_connection("localhost", 6380)
+        connections.disconnect()
+        self.assertEqual({}, connections._pools()[0])
@@ -37,6 +37,8 @@ class DockerManagerTest(unittest.TestCase):
 
     def tearDown(self):
         self.storage.db().instances.remove()
+        self.storage.db().ports.remove()
+        self.storage.db().free_ports.remove()
 
     def test_client(self):
         os.environ["DOCKER_HOSTS"] = '["http://host1.com:4243", \
@@ -48,6 +50,33 @@ class DockerManagerTest(unittest.TestCase):
         hosts = ["http://host1.com:4243", "http://localhost:4243"]
         self.assertIn(client.base_url, hosts)
 
+    def test_client_skips_unavailable_host(self):
+        from redisapi.docker_pool import client_pool
+        from redisapi.managers import DockerManager
+        self.addCleanup(client_pool().down.clear)
+        client_pool().mark_down("http://host1.com:4243")
+        manager = DockerManager()
+        for _ in range(10):
+            self.assertEqual("http://localhost:4243", manager.client().base_url)
+
+    def test_client_least_loaded_host(self):
+        os.environ["SCHEDULER"] = "least-loaded"
+        self.addCleanup(self.remove_env, "SCHEDULER")
+        from redisapi import scheduler
+        self.addCleanup(scheduler.host_loads.reset)
+        self.storage.add_instance(Instance("redis1", "basic", [
+            {"host": "host1.com", "port": 49153, "container_id": "1"}]))
+        from redisapi.managers import DockerManager
+        manager = DockerManager()
+        self.assertEqual("http://localhost:4243", manager.client().base_url)
+        self.assertEqual(1, scheduler.host_loads().get("localhost"))
+
+    def test_client_is_reused(self):
+        from redisapi.managers import DockerManager
+        manager = DockerManager()
+        self.assertIs(manager.client("http://myhost.com"),
+                      manager.client("http://myhost.com"))
+
     def test_extract_hostname(self):
         from redisapi.managers import DockerManager
         manager = DockerManager()
@@ -72,6 +101,7 @@ class DockerManagerTest(unittest.TestCase):
         from redisapi.managers import DockerManager
         manager = DockerManager()
         self.assertIsInstance(manager.health_checker(), FakeHealthCheck)
+        self.assertIs(manager.health_checker(), manager.health_checker())
 
     def test_docker_hosts(self):
         hosts = ["http://host1.com:4243", "http://localhost:4243"]
@@ -79,6 +109,8 @@ class DockerManagerTest(unittest.TestCase):
 
     @mock.patch("pyzabbix.ZabbixAPI")
     def test_hc_zabbix(self, zabix_mock):
+        from redisapi import hc
+        self.addCleanup(hc.zabbix_api.reset)
         os.environ["ZABBIX_URL"] = "url"
         os.environ["ZABBIX_USER"] = "url"
         os.environ["ZABBIX_PASSWORD"] = "url"
@@ -108,8 +140,17 @@ class DockerManagerTest(unittest.TestCase):
         self.manager.client().create_container.assert_called_with(
             self.manager.image_name,
             command="",
-            environment={'REDIS_PORT': 49153},
-            ports=[49153]
+            environment={
+                'REDIS_PORT': 49153,
+                'REDIS_MAXMEMORY': 1073741824,
+                'REDIS_MAXMEMORY_POLICY': 'volatile-lru',
+                'REDIS_SAVE': '900 1 300 10 60 10000',
+                'REDIS_APPENDONLY': 'no',
+                'REDIS_APPENDFSYNC': 'everysec',
+            },
+            ports=[49153],
+            mem_limit=1610612736,
+            cpu_shares=1024,
         )
         self.manager.client().start.assert_called_with(
             "12",
@@ -126,19 +167,76 @@ class DockerManagerTest(unittest.TestCase):
         self.manager.config_sentinels.assert_called_with(
             "name", endpoint)
 
-    def test_remove_instance(self):
+    def test_add_instance_removes_partial_monitor(self):
+        self.manager.config_sentinels = mock.Mock(side_effect=Exception("sentinel is down"))
+        self.manager.remove_from_sentinel = mock.Mock(side_effect=Exception("still down"))
+        self.manager.client.return_value = mock.Mock(base_url="http://localhost:4243")
+        self.manager.client().create_container.return_value = {"Id": "12"}
+        with self.assertRaises(Exception) as cm:
+            self.manager.add_instance("name")
+        self.assertEqual(("sentinel is down",), cm.exception.args)
+        self.manager.remove_from_sentinel.assert_called_once_with("name")
+        self.assertEqual(1, self.manager.client().remove_container.call_count)
+
+    def test_create_redis_container_fails(self):
+        self.manager.client.return_value = mock.Mock(base_url="http://localhost:4243")
+        self.manager.client().create_container.side_effect = Exception("docker is down")
+        with self.assertRaises(Exception):
+            self.manager.create_redis_container("http://localhost:4243")
+        self.assertFalse(self.manager.client().remove_container.called)
+        self.assertEqual(49153, self.manager.get_port_by_host("localhost"))
+
+    def test_start_redis_container_fails(self):
+        self.manager.client.return_value = mock.Mock(base_url="http://localhost:4243")
+        self.manager.client().create_container.return_value = {"Id": "12"}
+        self.manager.client().start.side_effect = Exception("port is taken")
+        self.manager.client().remove_container.side_effect = Exception("docker is down")
+        with self.assertRaises(Exception) as cm:
+            self.manager.create_redis_container("http://localhost:4243")
+        self.assertEqual(("port is taken",), cm.exception.args)
+        self.manager.client().remove_container.assert_called_once_with("12")
+        self.assertEqual(49153, self.manager.get_port_by_host("localhost"))
+
+    def test_add_instance_from_warm_pool(self):
+        from redisapi.warm_pool import WarmPool
+        self.manager.warm_pool = WarmPool(1)
+        self.addCleanup(self.manager.warm_pool.collection().remove)
+        self.manager.warm_pool.add({"host": "localhost", "port": 49160, "container_id": "warm"},
+                                   "basic")
+        self.manager.config_sentinels = mock.Mock()
+        self.manager.client.return_value = mock.Mock(base_url="http://localhost:4243")
+        instance = self.manager.add_instance("name")
+        self.assertFalse(self.manager.client().create_container.called)
+        self.assertEqual({"host": "localhost", "port": 49160, "container_id": "warm"},
+                         instance.endpoints[0])
+        self.manager.health_checker().add.assert_called_with("localhost", 49160)
+        self.manager.config_sentinels.assert_called_with("name", instance.endpoints[0])
+
+    def test_add_instance_empty_warm_pool(self):
+        from redisapi.warm_pool import WarmPool
+        self.manager.warm_pool = WarmPool(1)
+        self.manager.config_sentinels = mock.Mock()
+        self.manager.client.return_value = mock.Mock(base_url="http://localhost:4243")
+        self.manager.client().create_container.return_value = {"Id": "12"}
+        instance = self.manager.add_instance("name")
+        self.assertEqual("12", instance.endpoints[0]["container_id"])
+
+    @mock.patch("redisapi.managers.disconnect")
+    def test_remove_instance(self, disconnect):
         remove_mock = mock.Mock()
         self.manager.remove_from_sentinel = mock.Mock()
         self.manager.health_checker.return_value = remove_mock
         instance = Instance(
             name="name",
             plan="basic",
-            endpoints=[{"host": "host", "port": 123, "container_id": "12"}],
+            endpoints=[{"host": "host", "port": 49153, "container_id": "12"}],
         )
         self.storage.add_instance(instance)
 
+        self.manager.get_port_by_host("host")
+
         self.manager.remove_instance(instance)
-        remove_mock.remove.assert_called_with("host", 123)
+        remove_mock.remove.assert_called_with("host", 49153)
         self.manager.client.assert_called_with("http://host:4243")
         self.manager.client().stop.assert_called_with(
             instance.endpoints[0]["container_id"])
@@ -147,6 +245,24 @@ class DockerManagerTest(unittest.TestCase):
         self.storage.remove_instance(instance)
         self.manager.remove_from_sentinel.assert_called_with(
             instance.name)
+        disconnect.assert_called_once_with("host", 49153)
+        self.assertEqual(49153, self.manager.get_port_by_host("host"))
+
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok(self, redis_connection):
+        instance = Instance("name", "basic", [
+            {"host": "localhost", "port": 4242, "container_id": "12"}])
+        self.assertEqual((True, ""), self.manager.is_ok(instance))
+        redis_connection.assert_called_with("localhost", 4242, timeout=2.0)
+        redis_connection.return_value.ping.assert_called_with()
+
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok_unavailable(self, redis_connection):
+        import redis
+        redis_connection.return_value.ping.side_effect = redis.ConnectionError("refused")
+        instance = Instance("name", "basic", [
+            {"host": "localhost", "port": 4242, "container_id": "12"}])
+        self.assertEqual((False, "localhost:4242: refused"), self.manager.is_ok(instance))
 
     def test_bind(self):
         instance = Instance(
@@ -181,58 +297,58 @@ class DockerManagerTest(unittest.TestCase):
             exc.args,
         )
 
-    @mock.patch("redis.StrictRedis")
-    def test_config_sentinels(self, redis_mock):
+    @mock.patch("redisapi.sentinels.connection")
+    def test_config_sentinels(self, connection):
+        sentinels = ["http://host1.com:4243", "http://localhost:4243",
+                     "http://host2.com:4243"]
+        conns = dict((s, mock.Mock()) for s in sentinels)
+        for conn in conns.values():
+            conn.pipeline.return_value.execute.return_value = []
+        connection.side_effect = lambda url: conns[url]
         master = {"host": "localhost", "port": "3333"}
         self.manager.config_sentinels("master_name", master)
 
-        calls = []
-        sentinels = [
-            {"host": u"host1.com", "port": u"4243"},
-            {"host": u"localhost", "port": u"4243"},
-            {"host": u"host2.com", "port": u"4243"},
+        calls = [
+            mock.call('SENTINEL', 'monitor', 'master_name', 'localhost', '3333', '1'),
+            mock.call('SENTINEL', 'set', 'master_name', 'down-after-milliseconds', '5000'),
+            mock.call('SENTINEL', 'set', 'master_name', 'failover-timeout', '60000'),
+            mock.call('SENTINEL', 'set', 'master_name', 'parallel-syncs', '1'),
         ]
-        for sentinel in sentinels:
-            host, port = sentinel["host"], sentinel["port"]
-            sentinel_calls = [
-                mock.call(host=host, port=port),
-                mock.call().sentinel(
-                    'monitor', 'master_name', 'localhost', '3333', '1'),
-                mock.call().sentinel(
-                    'set', 'master_name', 'down-after-milliseconds', '5000'),
-                mock.call().sentinel(
-                    'set', 'master_name', 'failover-timeout', '60000'),
-                mock.call().sentinel(
-                    'set', 'master_name', 'parallel-syncs', '1'),
-            ]
-            calls.extend(sentinel_calls)
-
-        redis_mock.assert_has_calls(calls)
-
-    @mock.patch("redis.StrictRedis")
-    def test_remove_from_sentinel(self, redis_mock):
+        for conn in conns.values():
+            conn.pipeline.assert_called_with(transaction=False)
+            pipe = conn.pipeline.return_value
+            self.assertEqual(calls, pipe.execute_command.call_args_list)
+            pipe.execute.assert_called_once_with(raise_on_error=False)
+
+    @mock.patch("redisapi.sentinels.connection")
+    def test_remove_from_sentinel(self, connection):
+        sentinels = ["http://host1.com:4243", "http://localhost:4243",
+                     "http://host2.com:4243"]
+        conns = dict((s, mock.Mock()) for s in sentinels)
+        for conn in conns.values():
+            conn.pipeline.return_value.execute.return_value = []
+        connection.side_effect = lambda url: conns[url]
         self.manager.remove_from_sentinel("master_name")
 
-        calls = []
-        sentinels = [
-            {"host": u"host1.com", "port": u"4243"},
-            {"host": u"localhost", "port": u"4243"},
-            {"host": u"host2.com", "port": u"4243"},
-        ]
-        for sentinel in sentinels:
-            host, port = sentinel["host"], sentinel["port"]
-            sentinel_calls = [
-                mock.call(host=host, port=port),
-                mock.call().sentinel(
-                    'remove', 'master_name'),
-            ]
-            calls.extend(sentinel_calls)
-
-        redis_mock.assert_has_calls(calls)
+        for conn in conns.values():
+            pipe = conn.pipeline.return_value
+            pipe.execute_command.assert_called_once_with('SENTINEL', 'remove', 'master_name')
+            pipe.execute.assert_called_once_with(raise_on_error=False)
 
     def test_port_range_start(self):
         self.assertEqual(49153, self.manager.port_range_start)
 
+    def test_port_range_environ(self):
+        os.environ["PORT_RANGE_START"] = "50000"
+        self.addCleanup(self.remove_env, "PORT_RANGE_START")
+        os.environ["PORT_RANGE_END"] = "50010"
+        self.addCleanup(self.remove_env, "PORT_RANGE_END")
+        from redisapi.managers import DockerManager
+        manager = DockerManager()
+        self.assertEqual(50000, manager.port_allocator.range_start)
+        self.assertEqual(50010, manager.port_allocator.range_end)
+        self.assertEqual(50000, manager.get_port_by_host("newhost"))
+
     def test_get_port_new_host(self):
         self.assertEqual(49153, self.manager.get_port_by_host("newhost"))
 
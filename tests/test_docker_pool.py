@@ -0,0 +1,68 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import unittest
+
+import mock
+import requests
+
+from redisapi import docker_pool
+
+
+class DockerClientPoolTest(unittest.TestCase):
+
+    def remove_env(self, env):
+        if env in os.environ:
+            del os.environ[env]
+
+    def setUp(self):
+        self.pool = docker_pool.DockerClientPool(timeout=10, retry_interval=30)
+        self.url = "http://host1.com:4243"
+
+    def test_get(self):
+        client = self.pool.get(self.url)
+        self.assertIsInstance(client, docker_pool.TrackedClient)
+        self.assertEqual(self.url, client.base_url)
+        self.assertEqual(10, client._timeout)
+        self.assertIs(client, self.pool.get(self.url))
+        self.assertIsNot(client, self.pool.get("http://host2.com:4243"))
+
+    @mock.patch("requests.Session.request")
+    def test_connection_error_marks_host_down(self, request):
+        request.side_effect = requests.ConnectionError()
+        client = self.pool.get(self.url)
+        with self.assertRaises(requests.ConnectionError):
+            client.containers()
+        self.assertFalse(self.pool.is_healthy(self.url))
+        with self.assertRaises(docker_pool.HostUnavailable):
+            self.pool.get(self.url)
+
+    @mock.patch("requests.Session.request")
+    def test_success_marks_host_up(self, request):
+        request.return_value = mock.Mock(status_code=200)
+        request.return_value.json.return_value = []
+        self.pool.mark_down(self.url)
+        self.pool.down[self.url] -= 31
+        self.assertTrue(self.pool.is_healthy(self.url))
+        self.pool.get(self.url).containers()
+        self.assertNotIn(self.url, self.pool.down)
+
+    def test_healthy_hosts(self):
+        self.pool.mark_down(self.url)
+        hosts = [self.url, "http://host2.com:4243"]
+        self.assertEqual(["http://host2.com:4243"], self.pool.healthy_hosts(hosts))
+
+    @mock.patch("os.getpid")
+    def test_client_pool(self, getpid):
+        os.environ["DOCKER_TIMEOUT"] = "5"
+        self.addCleanup(self.remove_env, "DOCKER_TIMEOUT")
+        self.addCleanup(docker_pool.client_pool.reset)
+        getpid.return_value = 100
+        pool = docker_pool.client_pool()
+        self.assertEqual(5, pool.timeout)
+        self.assertEqual(30, pool.retry_interval)
+        self.assertIs(pool, docker_pool.client_pool())
+        getpid.return_value = 101
+        self.assertIsNot(pool, docker_pool.client_pool())
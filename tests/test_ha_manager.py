@@ -4,11 +4,12 @@
 
 import mock
 import os
+import redis
 import unittest
 import json
 
 from redisapi.hc import FakeHealthCheck
-from redisapi.managers import DockerHaManager
+from redisapi.managers import DockerHaManager, ReplicaNotReady
 from redisapi.storage import Instance, MongoStorage
 
 
@@ -30,6 +31,13 @@ class DockerHaManagerTest(unittest.TestCase):
         self.manager = DockerHaManager()
         self.storage = MongoStorage()
 
+    def tearDown(self):
+        self.storage.db().instances.remove()
+        self.storage.db().ports.remove()
+        self.storage.db().free_ports.remove()
+        self.storage.db().acl_units.remove()
+        self.storage.db().sagas.remove()
+
     def test_hc(self):
         self.assertIsInstance(self.manager.health_checker(), FakeHealthCheck)
 
@@ -48,45 +56,69 @@ class DockerHaManagerTest(unittest.TestCase):
         client = manager.client(host="myhost")
         self.assertIn(client.base_url, "myhost")
 
-    @mock.patch("redis.StrictRedis")
-    def test_config_sentinels(self, redis_mock):
+    @mock.patch("redisapi.sentinels.connection")
+    def test_config_sentinels(self, connection):
+        sentinels = ["http://host1.com:4243", "http://localhost:4243",
+                     "http://host2.com:4243"]
+        conns = dict((s, mock.Mock()) for s in sentinels)
+        for conn in conns.values():
+            conn.pipeline.return_value.execute.return_value = []
+        connection.side_effect = lambda url: conns[url]
         master = {"host": "localhost", "port": "3333"}
         self.manager.config_sentinels("master_name", master)
 
-        calls = []
-        sentinels = [
-            {"host": u"host1.com", "port": u"4243"},
-            {"host": u"localhost", "port": u"4243"},
-            {"host": u"host2.com", "port": u"4243"},
+        calls = [
+            mock.call('SENTINEL', 'monitor', 'master_name', 'localhost', '3333', '1'),
+            mock.call('SENTINEL', 'set', 'master_name', 'down-after-milliseconds', '5000'),
+            mock.call('SENTINEL', 'set', 'master_name', 'failover-timeout', '60000'),
+            mock.call('SENTINEL', 'set', 'master_name', 'parallel-syncs', '1'),
         ]
-        for sentinel in sentinels:
-            host, port = sentinel["host"], sentinel["port"]
-            sentinel_calls = [
-                mock.call(host=host, port=port),
-                mock.call().sentinel(
-                    'monitor', 'master_name', 'localhost', '3333', '1'),
-                mock.call().sentinel(
-                    'set', 'master_name', 'down-after-milliseconds', '5000'),
-                mock.call().sentinel(
-                    'set', 'master_name', 'failover-timeout', '60000'),
-                mock.call().sentinel(
-                    'set', 'master_name', 'parallel-syncs', '1'),
-            ]
-            calls.extend(sentinel_calls)
-
-        redis_mock.assert_has_calls(calls)
-
-    @mock.patch("redis.StrictRedis")
-    def test_slave_of(self, redis_mock):
-        redis_instance_mock = mock.Mock()
-        redis_mock.return_value = redis_instance_mock
+        for conn in conns.values():
+            conn.pipeline.assert_called_with(transaction=False)
+            pipe = conn.pipeline.return_value
+            self.assertEqual(calls, pipe.execute_command.call_args_list)
+            pipe.execute.assert_called_once_with(raise_on_error=False)
+
+    def test_slave_of(self):
+        conn = mock.Mock()
+        conn.info.return_value = {"role": "slave", "master_link_status": "up"}
+        self.manager.redis_connection = mock.Mock(return_value=conn)
         master = {"host": "localhost", "port": "3333"}
         slave = {"host": "myhost", "port": "9999"}
         self.manager.slave_of(master, slave)
-        redis_mock.assert_called_with(
-            host=str(slave["host"]), port=str(slave["port"]))
-        redis_instance_mock.slaveof.assert_called_with(
-            master["host"], master["port"])
+        self.manager.redis_connection.assert_called_once_with(slave)
+        conn.slaveof.assert_called_once_with(master["host"], master["port"])
+        conn.info.assert_called_once_with("replication")
+
+    @mock.patch("time.sleep")
+    def test_slave_of_waits_for_replication(self, sleep):
+        conn = mock.Mock()
+        conn.slaveof.side_effect = [redis.ConnectionError("refused"), True]
+        conn.info.side_effect = [
+            {"role": "slave", "master_link_status": "down"},
+            redis.BusyLoadingError("loading"),
+            {"role": "slave", "master_link_status": "up"},
+        ]
+        self.manager.redis_connection = mock.Mock(return_value=conn)
+        master = {"host": "localhost", "port": "3333"}
+        self.manager.slave_of(master, {"host": "myhost", "port": "9999"})
+        self.assertEqual(2, conn.slaveof.call_count)
+        self.assertEqual(3, conn.info.call_count)
+        self.assertEqual([0.01, 0.02, 0.04], [c[0][0] for c in sleep.call_args_list])
+
+    def test_slave_of_timeout(self):
+        os.environ["REPLICATION_TIMEOUT"] = "0.05"
+        self.addCleanup(self.remove_env, "REPLICATION_TIMEOUT")
+        manager = DockerHaManager()
+        conn = mock.Mock()
+        conn.info.return_value = {"role": "slave", "master_link_status": "down"}
+        manager.redis_connection = mock.Mock(return_value=conn)
+        with self.assertRaises(ReplicaNotReady) as cm:
+            manager.slave_of({"host": "localhost", "port": "3333"},
+                             {"host": "myhost", "port": "9999"})
+        self.assertEqual("replica myhost:9999 of localhost:3333 not ready after 0.05s: "
+                         "replication link is down", str(cm.exception))
+        conn.slaveof.assert_called_once_with("localhost", "3333")
 
     def test_add_instance(self):
         add_mock = mock.Mock()
@@ -112,14 +144,24 @@ class DockerHaManagerTest(unittest.TestCase):
         self.manager.client().create_container.assert_called_with(
             self.manager.image_name,
             command="",
-            environment={'REDIS_PORT': 49153},
-            ports=[49153]
+            environment={
+                'REDIS_PORT': 49153,
+                'REDIS_MAXMEMORY': 1073741824,
+                'REDIS_MAXMEMORY_POLICY': 'volatile-lru',
+                'REDIS_SAVE': '900 1 300 10 60 10000',
+                'REDIS_APPENDONLY': 'no',
+                'REDIS_APPENDFSYNC': 'everysec',
+            },
+            ports=[49153],
+            mem_limit=1610612736,
+            cpu_shares=1024,
         )
         self.manager.client().start.assert_called_with(
             "12",
             port_bindings={49153: ('0.0.0.0', 49153)}
         )
-        add_mock.add.assert_called_with("localhost", 49153)
+        add_mock.add_many.assert_called_once_with([("localhost", 49153),
+                                                   ("localhost", 49153)])
         expected_endpoints = [
             {"container_id": "12", "host": "localhost", "port": 49153},
             {"container_id": "12", "host": "localhost", "port": 49153},
@@ -132,6 +174,148 @@ class DockerHaManagerTest(unittest.TestCase):
         self.manager.config_sentinels.assert_called_with(
             "name", expected_endpoints[0])
 
+    def test_add_instance_with_replicas(self):
+        os.environ["REDIS_REPLICAS"] = "2"
+        self.addCleanup(self.remove_env, "REDIS_REPLICAS")
+        manager = DockerHaManager()
+        manager.health_checker = mock.Mock()
+        manager.slave_of = mock.Mock()
+        manager.config_sentinels = mock.Mock()
+        clients = {}
+        for i, host in enumerate(manager.docker_hosts):
+            client = mock.Mock(base_url=host)
+            client.create_container.return_value = {"Id": str(i)}
+            clients[host] = client
+        manager.client = lambda host: clients[host]
+
+        instance = manager.add_instance("name")
+
+        self.assertEqual(3, len(instance.endpoints))
+        hosts = set(e["host"] for e in instance.endpoints)
+        self.assertEqual(set(["host1.com", "localhost", "host2.com"]), hosts)
+        master = instance.endpoints[0]
+        self.assertItemsEqual([mock.call(master, slave) for slave in instance.endpoints[1:]],
+                              manager.slave_of.call_args_list)
+        manager.config_sentinels.assert_called_once_with("name", master)
+        for client in clients.values():
+            self.assertEqual(1, client.start.call_count)
+
+    def ha_mocks(self, manager):
+        manager.health_checker = mock.Mock()
+        manager.slave_of = mock.Mock()
+        manager.config_sentinels = mock.Mock()
+        manager.remove_from_sentinel = mock.Mock()
+        clients = {}
+        for i, host in enumerate(manager.docker_hosts):
+            client = mock.Mock(base_url=host)
+            client.create_container.return_value = {"Id": str(i)}
+            clients[host] = client
+            clients[manager.docker_url_from_hostname(manager.extract_hostname(host))] = client
+        manager.client = lambda host: clients[host]
+        return clients
+
+    def test_add_instance_rolls_back(self):
+        clients = self.ha_mocks(self.manager)
+        self.manager.slave_of.side_effect = Exception("replica is down")
+        with self.assertRaises(Exception):
+            self.manager.add_instance("name")
+        created = [c for c in clients.values() if c.create_container.called]
+        self.assertEqual(2, len(set(created)))
+        for client in created:
+            self.assertEqual(1, client.stop.call_count)
+            self.assertEqual(1, client.remove_container.call_count)
+        self.assertEqual(1, self.manager.health_checker().remove_many.call_count)
+        self.assertFalse(self.manager.config_sentinels.called)
+        self.assertFalse(self.manager.remove_from_sentinel.called)
+        self.assertIsNone(self.storage.db().sagas.find_one({"_id": "add:name"}))
+        self.assertEqual(2, self.storage.db().free_ports.count())
+
+    def test_add_instance_after_rollback_replicates_again(self):
+        self.ha_mocks(self.manager)
+        self.manager.config_sentinels.side_effect = Exception("sentinel is down")
+        with self.assertRaises(Exception):
+            self.manager.add_instance("name")
+        self.assertEqual(1, self.manager.slave_of.call_count)
+        self.assertIsNone(self.storage.db().sagas.find_one({"_id": "add:name"}))
+
+        self.manager.config_sentinels.side_effect = None
+        instance = self.manager.add_instance("name")
+        self.assertEqual(2, self.manager.slave_of.call_count)
+        self.manager.slave_of.assert_called_with(instance.endpoints[0], instance.endpoints[1])
+        self.assertIsNone(self.storage.db().sagas.find_one({"_id": "add:name"}))
+
+    def test_add_instance_removes_partial_monitor(self):
+        self.ha_mocks(self.manager)
+        self.manager.config_sentinels.side_effect = Exception("sentinel is down")
+        with self.assertRaises(Exception):
+            self.manager.add_instance("name")
+        self.manager.remove_from_sentinel.assert_called_once_with("name")
+
+    def test_add_instance_removes_containers_of_failed_host(self):
+        clients = self.ha_mocks(self.manager)
+        self.manager.scheduler = mock.Mock()
+        self.manager.scheduler.choose.return_value = ["http://host1.com:4243",
+                                                      "http://host2.com:4243"]
+        clients["http://host2.com:4243"].create_container.side_effect = Exception("host down")
+        with self.assertRaises(Exception):
+            self.manager.add_instance("name")
+        self.assertEqual(1, clients["http://host1.com:4243"].remove_container.call_count)
+        self.assertFalse(self.manager.health_checker().add_many.called)
+
+    def test_add_instance_resumes(self):
+        self.ha_mocks(self.manager)
+        endpoints = [{"host": "host1.com", "port": 49153, "container_id": "a"},
+                     {"host": "localhost", "port": 49153, "container_id": "b"}]
+        self.storage.db().sagas.insert_one({
+            "_id": "add:name", "action": "add", "name": "name", "status": "running",
+            "steps": [{"name": "containers", "result": endpoints},
+                      {"name": "healthcheck", "result": None}]})
+        self.manager.create_containers = mock.Mock()
+        instance = self.manager.add_instance("name")
+        self.assertFalse(self.manager.create_containers.called)
+        self.assertFalse(self.manager.health_checker().add_many.called)
+        self.manager.slave_of.assert_called_once_with(endpoints[0], endpoints[1])
+        self.manager.config_sentinels.assert_called_once_with("name", endpoints[0])
+        self.assertEqual(endpoints, instance.endpoints)
+        self.assertIsNone(self.storage.db().sagas.find_one({"_id": "add:name"}))
+
+    def test_remove_instance_resumes(self):
+        clients = self.ha_mocks(self.manager)
+        instance = Instance(name="name", plan="plus", endpoints=[
+            {"host": "host1.com", "port": 49153, "container_id": "a"},
+            {"host": "localhost", "port": 49153, "container_id": "b"}])
+        clients["http://localhost:4243"].stop.side_effect = Exception("host down")
+        with self.assertRaises(Exception):
+            self.manager.remove_instance(instance)
+        clients["http://localhost:4243"].stop.side_effect = None
+        self.manager.remove_instance(instance)
+        self.assertEqual(1, clients["http://host1.com:4243"].stop.call_count)
+        self.assertEqual(2, clients["http://localhost:4243"].stop.call_count)
+        self.assertEqual(1, self.manager.health_checker().remove_many.call_count)
+        self.manager.remove_from_sentinel.assert_called_once_with("name")
+        self.assertIsNone(self.storage.db().sagas.find_one({"_id": "remove:name"}))
+
+    def test_add_instance_without_enough_hosts(self):
+        os.environ["REDIS_REPLICAS"] = "3"
+        self.addCleanup(self.remove_env, "REDIS_REPLICAS")
+        manager = DockerHaManager()
+        manager.client = mock.Mock()
+        with self.assertRaises(Exception) as cm:
+            manager.add_instance("name")
+        self.assertEqual(("plus instances need 4 docker hosts, only 3 available",),
+                         cm.exception.args)
+        self.assertFalse(manager.client.called)
+
+    def test_add_instance_with_unavailable_hosts(self):
+        from redisapi.docker_pool import HostUnavailable, client_pool
+        self.addCleanup(client_pool().down.clear)
+        client_pool().mark_down("http://host1.com:4243")
+        client_pool().mark_down("http://host2.com:4243")
+        self.manager.client = mock.Mock()
+        with self.assertRaises(HostUnavailable):
+            self.manager.add_instance("name")
+        self.assertFalse(self.manager.client.called)
+
     def test_remove_instance(self):
         remove_mock = mock.Mock()
         self.manager.remove_from_sentinel = mock.Mock()
@@ -152,7 +336,7 @@ class DockerHaManagerTest(unittest.TestCase):
 
         self.manager.remove_instance(instance)
 
-        remove_mock.remove.assert_called_with("host", 123)
+        remove_mock.remove_many.assert_called_once_with([("host", 123)] * 3)
         self.manager.client.assert_called_with("http://host:4243")
         self.manager.client().stop.assert_called_with(
             instance.endpoints[0]["container_id"])
@@ -162,26 +346,67 @@ class DockerHaManagerTest(unittest.TestCase):
         self.manager.remove_from_sentinel.assert_called_with(
             instance.name)
 
-    @mock.patch("redis.StrictRedis")
-    def test_remove_from_sentinel(self, redis_mock):
+    @mock.patch("redisapi.sentinels.connection")
+    def test_remove_from_sentinel(self, connection):
+        sentinels = ["http://host1.com:4243", "http://localhost:4243",
+                     "http://host2.com:4243"]
+        conns = dict((s, mock.Mock()) for s in sentinels)
+        for conn in conns.values():
+            conn.pipeline.return_value.execute.return_value = []
+        connection.side_effect = lambda url: conns[url]
         self.manager.remove_from_sentinel("master_name")
 
-        calls = []
-        sentinels = [
-            {"host": u"host1.com", "port": u"4243"},
-            {"host": u"localhost", "port": u"4243"},
-            {"host": u"host2.com", "port": u"4243"},
-        ]
-        for sentinel in sentinels:
-            host, port = sentinel["host"], sentinel["port"]
-            sentinel_calls = [
-                mock.call(host=host, port=port),
-                mock.call().sentinel(
-                    'remove', 'master_name'),
-            ]
-            calls.extend(sentinel_calls)
+        for conn in conns.values():
+            pipe = conn.pipeline.return_value
+            pipe.execute_command.assert_called_once_with('SENTINEL', 'remove', 'master_name')
+            pipe.execute.assert_called_once_with(raise_on_error=False)
+
+    def replication_infos(self, redis_connection, infos):
+        conns = {}
+        for port, info in infos.items():
+            conn = mock.Mock()
+            if isinstance(info, Exception):
+                conn.info.side_effect = info
+            else:
+                conn.info.return_value = info
+            conns[port] = conn
+        redis_connection.side_effect = lambda host, port, timeout: conns[port]
+        return Instance("name", "plus", [
+            {"host": "localhost", "port": port, "container_id": "12"}
+            for port in sorted(infos)])
+
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok(self, redis_connection):
+        instance = self.replication_infos(redis_connection, {
+            4242: {"role": "master"},
+            4243: {"role": "slave", "master_link_status": "up"},
+        })
+        self.assertEqual((True, ""), self.manager.is_ok(instance))
+
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok_broken_replica(self, redis_connection):
+        import redis
+        instance = self.replication_infos(redis_connection, {
+            4242: {"role": "master"},
+            4243: {"role": "slave", "master_link_status": "down"},
+            4244: redis.ConnectionError("refused"),
+        })
+        ok, msg = self.manager.is_ok(instance)
+        self.assertTrue(ok)
+        self.assertEqual("localhost:4243: replication link is down; "
+                         "localhost:4244: refused", msg)
 
-        redis_mock.assert_has_calls(calls)
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok_without_master(self, redis_connection):
+        import redis
+        instance = self.replication_infos(redis_connection, {
+            4242: redis.ConnectionError("refused"),
+            4243: {"role": "slave", "master_link_status": "down"},
+        })
+        ok, msg = self.manager.is_ok(instance)
+        self.assertFalse(ok)
+        self.assertEqual("no master available; localhost:4242: refused; "
+                         "localhost:4243: replication link is down", msg)
 
     def test_bind(self):
         instance = Instance(
@@ -232,6 +457,22 @@ class DockerHaManagerTest(unittest.TestCase):
         self.manager.revoke(instance, "10.0.0.1")
         self.assertEqual(["10.0.0.2"], access_mngr.permits[instance.name])
 
+    def test_grant_many_and_revoke_many(self):
+        instance = Instance(
+            name="name",
+            plan='basic',
+            endpoints=[
+                {"host": "localhost", "port": "4242", "container_id": "12"},
+            ],
+        )
+        self.assertEqual({"10.0.0.1": "ok", "10.0.0.2": "ok", "10.0.1.1": "ok"},
+                         self.manager.grant_many(instance, ["10.0.0.1", "10.0.0.2", "10.0.1.1"]))
+        access_mngr = self.manager.access_manager
+        self.assertEqual(["10.0.0.1", "10.0.0.2", "10.0.1.1"],
+                         access_mngr.permits[instance.name])
+        self.manager.revoke_many(instance, ["10.0.0.1", "10.0.1.1"])
+        self.assertEqual(["10.0.0.2"], access_mngr.permits[instance.name])
+
     def test_port_range_start(self):
         self.assertEqual(49153, self.manager.port_range_start)
 
@@ -6,6 +6,8 @@ import unittest
 import mock
 import os
 
+import redisapi
+
 from redisapi import hc
 
 
@@ -25,6 +27,14 @@ class FakeHCTest(unittest.TestCase):
         self.hc.remove(host="localhost", port=8080)
         self.assertTrue(self.hc.removed)
 
+    def test_add_many(self):
+        self.hc.add_many([("localhost", 8080), ("localhost", 8081)])
+        self.assertTrue(self.hc.added)
+
+    def test_remove_many(self):
+        self.hc.remove_many([("localhost", 8080), ("localhost", 8081)])
+        self.assertTrue(self.hc.removed)
+
 
 class ZabbixHCTest(unittest.TestCase):
 
@@ -43,6 +53,8 @@ class ZabbixHCTest(unittest.TestCase):
         os.environ["ZABBIX_HOST"] = "1"
         os.environ["ZABBIX_INTERFACE"] = "1"
         self.addCleanup(self.remove_env, "REDIS_SERVER_HOST")
+        hc.zabbix_api.reset()
+        self.addCleanup(hc.zabbix_api.reset)
         zapi_mock = mock.Mock()
         zabbix_mock.return_value = zapi_mock
         from redisapi.hc import ZabbixHealthCheck
@@ -60,20 +72,20 @@ class ZabbixHCTest(unittest.TestCase):
         self.hc.add(host="localhost", port=8080)
 
         item_key = "net.tcp.service[tcp,localhost,8080]"
-        self.hc.zapi.item.create.assert_called_with(
-            name="redis healthcheck for localhost:8080",
-            key_=item_key,
-            delay=60,
-            hostid="1",
-            interfaceid="1",
-            type=3,
-            value_type=3,
-        )
-        self.hc.zapi.trigger.create.assert_called_with(
-            description="trigger hc for redis localhost:8080",
-            expression="{{Zabbix Server:{}.last()}}=0".format(item_key),
-            priority=5,
-        )
+        self.hc.zapi.item.create.assert_called_with({
+            "name": "redis healthcheck for localhost:8080",
+            "key_": item_key,
+            "delay": 60,
+            "hostid": "1",
+            "interfaceid": "1",
+            "type": 3,
+            "value_type": 3,
+        })
+        self.hc.zapi.trigger.create.assert_called_with({
+            "description": "trigger hc for redis localhost:8080",
+            "expression": "{{Zabbix Server:{}.last()}}=0".format(item_key),
+            "priority": 5,
+        })
 
         item = self.hc.items.find_one({"host": "localhost", "port": 8080})
         self.assertEqual(item["host"], "localhost")
@@ -99,17 +111,78 @@ class ZabbixHCTest(unittest.TestCase):
             "port": 8080}).count()
         self.assertEqual(lenght, 0)
 
+    def test_add_many(self):
+        self.hc.zapi.item.create.return_value = {"itemids": ["i1", "i2"]}
+        self.hc.zapi.trigger.create.return_value = {"triggerids": ["t1", "t2"]}
+
+        self.hc.add_many([("10.0.0.1", 8080), ("10.0.0.2", 8081)])
+
+        items = self.hc.zapi.item.create.call_args[0]
+        self.assertEqual(["net.tcp.service[tcp,10.0.0.1,8080]",
+                          "net.tcp.service[tcp,10.0.0.2,8081]"],
+                         [item["key_"] for item in items])
+        self.assertEqual(1, self.hc.zapi.item.create.call_count)
+        self.assertEqual(2, len(self.hc.zapi.trigger.create.call_args[0]))
+        self.assertEqual(1, self.hc.zapi.trigger.create.call_count)
+        item = self.hc.items.find_one({"host": "10.0.0.2", "port": 8081})
+        self.assertEqual("i2", item["item"])
+        self.assertEqual("t2", item["trigger"])
+
+    def test_remove_many(self):
+        self.hc.items.insert({"host": "10.0.0.1", "port": 8080, "trigger": 1, "item": 2})
+        self.hc.items.insert({"host": "10.0.0.2", "port": 8081, "trigger": 3, "item": 4})
+        self.hc.items.insert({"host": "10.0.0.3", "port": 8082, "trigger": 5, "item": 6})
+
+        self.hc.remove_many([("10.0.0.1", 8080), ("10.0.0.2", 8081)])
+
+        self.hc.zapi.trigger.delete.assert_called_once_with(1, 3)
+        self.hc.zapi.item.delete.assert_called_once_with(2, 4)
+        self.assertEqual(1, self.hc.items.find().count())
+
+    def test_remove_unknown(self):
+        self.hc.remove(host="localhost", port=8080)
+        self.assertFalse(self.hc.zapi.trigger.delete.called)
+        self.assertFalse(self.hc.zapi.item.delete.called)
+
+    def test_session_is_shared(self):
+        from redisapi.hc import ZabbixHealthCheck
+        self.assertIs(self.hc.zapi, ZabbixHealthCheck().zapi)
+        self.assertEqual(1, self.hc.zapi.login.call_count)
+
+    def test_relogin_on_expired_session(self):
+        from pyzabbix import ZabbixAPIException
+        self.hc.zapi.item.create.side_effect = [
+            ZabbixAPIException("Error -32602: Session terminated, re-login, please."),
+            {"itemids": ["xpto"]},
+        ]
+        self.hc.zapi.trigger.create.return_value = {"triggerids": ["apto"]}
+
+        self.hc.add(host="localhost", port=8080)
+
+        self.assertEqual(2, self.hc.zapi.login.call_count)
+        self.hc.zapi.login.assert_called_with("user", "pass")
+        self.assertEqual(2, self.hc.zapi.item.create.call_count)
+
+    def test_other_errors_are_raised(self):
+        from pyzabbix import ZabbixAPIException
+        self.hc.zapi.item.create.side_effect = ZabbixAPIException("Error -32602: exists")
+        with self.assertRaises(ZabbixAPIException):
+            self.hc.add(host="localhost", port=8080)
+        self.assertEqual(1, self.hc.zapi.login.call_count)
+
     @mock.patch("pymongo.MongoClient")
     @mock.patch("pyzabbix.ZabbixAPI")
     def test_mongodb_uri_environ(self, zapi, mongo_mock):
+        redisapi.reset_mongodb()
+        self.addCleanup(redisapi.reset_mongodb)
         from redisapi.hc import ZabbixHealthCheck
         ZabbixHealthCheck()
-        mongo_mock.assert_called_with("mongodb://localhost:27017/")
+        self.assertEqual(("mongodb://localhost:27017/",), mongo_mock.call_args[0])
 
         os.environ["MONGODB_URI"] = "0.0.0.0"
         self.addCleanup(self.remove_env, "MONGODB_URI")
         ZabbixHealthCheck()
-        mongo_mock.assert_called_with("0.0.0.0")
+        self.assertEqual(("0.0.0.0",), mongo_mock.call_args[0])
 
     def test_running_without_the_ZABBIX_URL_variable(self):
         del os.environ["ZABBIX_URL"]
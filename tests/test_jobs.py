@@ -0,0 +1,96 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import os
+import unittest
+
+from redisapi import jobs
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def remove_env(self, env):
+        if env in os.environ:
+            del os.environ[env]
+
+    def setUp(self):
+        self.queue = jobs.JobQueue()
+
+    def tearDown(self):
+        self.queue.collection().remove()
+        self.queue.locks().remove()
+
+    def test_async_provisioning(self):
+        self.assertFalse(jobs.async_provisioning())
+        os.environ["PROVISIONING_MODE"] = "async"
+        self.addCleanup(self.remove_env, "PROVISIONING_MODE")
+        self.assertTrue(jobs.async_provisioning())
+
+    def test_enqueue(self):
+        self.queue.enqueue("add", "myredis", plan="basic")
+        job = self.queue.collection().find_one({"name": "myredis"})
+        self.assertEqual("add", job["action"])
+        self.assertEqual("basic", job["plan"])
+        self.assertEqual("pending", job["status"])
+
+    def test_claim_oldest_first(self):
+        self.queue.enqueue("add", "first", plan="basic")
+        self.queue.enqueue("add", "second", plan="basic")
+        job = self.queue.claim()
+        self.assertEqual("first", job["name"])
+        self.assertEqual("running", job["status"])
+        self.assertEqual("second", self.queue.claim()["name"])
+        self.assertIsNone(self.queue.claim())
+
+    def test_claim_abandoned_job(self):
+        self.queue.enqueue("add", "myredis", plan="basic")
+        self.queue.claim()
+        self.assertIsNone(self.queue.claim())
+        updated_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=601)
+        self.queue.collection().update_one({"name": "myredis"},
+                                           {"$set": {"updated_at": updated_at}})
+        self.assertEqual("myredis", self.queue.claim()["name"])
+
+    def test_heartbeat_keeps_the_job(self):
+        self.queue.enqueue("add", "myredis", plan="basic")
+        job = self.queue.claim()
+        started_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=601)
+        self.queue.collection().update_one({"name": "myredis"},
+                                           {"$set": {"started_at": started_at,
+                                                     "updated_at": started_at}})
+        self.queue.heartbeat(job)
+        self.assertIsNone(self.queue.claim())
+
+    def test_enqueue_conflict(self):
+        self.queue.enqueue("add", "myredis", plan="basic")
+        with self.assertRaises(jobs.JobConflict):
+            self.queue.enqueue("add", "myredis", plan="basic")
+        job = self.queue.claim()
+        with self.assertRaises(jobs.JobConflict):
+            self.queue.enqueue("remove", "myredis")
+        self.queue.finish(job, error=Exception("docker is down"))
+        self.queue.enqueue("add", "myredis", plan="basic")
+        self.queue.enqueue("add", "other", plan="basic")
+
+    def test_finish(self):
+        self.queue.enqueue("add", "myredis", plan="basic")
+        job = self.queue.claim()
+        self.queue.finish(job)
+        self.assertEqual("done", self.queue.last_job("myredis")["status"])
+
+    def test_finish_with_error(self):
+        self.queue.enqueue("add", "myredis", plan="basic")
+        job = self.queue.claim()
+        self.queue.finish(job, error=Exception("docker is down"))
+        job = self.queue.last_job("myredis")
+        self.assertEqual("failed", job["status"])
+        self.assertEqual("docker is down", job["error"])
+
+    def test_last_job(self):
+        self.assertIsNone(self.queue.last_job("myredis"))
+        self.queue.enqueue("add", "myredis", plan="basic")
+        self.queue.finish(self.queue.claim())
+        self.queue.enqueue("remove", "myredis")
+        self.assertEqual("remove", self.queue.last_job("myredis")["action"])
@@ -2,9 +2,13 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import os
 import unittest
 
+import mock
+
 from redisapi import managers
+from redisapi.storage import Instance
 
 
 class ManagersTest(unittest.TestCase):
@@ -17,3 +21,44 @@ class ManagersTest(unittest.TestCase):
 
     def test_shared(self):
         self.assertEqual(managers.managers['shared'], managers.SharedManager)
+
+
+class ManagerRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        os.environ["REDIS_SERVER_HOST"] = "localhost"
+        managers.reload_managers()
+        self.addCleanup(managers.reload_managers)
+
+    def tearDown(self):
+        del os.environ["REDIS_SERVER_HOST"]
+
+    def test_plan_managers(self):
+        self.assertEqual(managers.SharedManager, managers.plan_managers['development'])
+        self.assertEqual(managers.DockerManager, managers.plan_managers['basic'])
+        self.assertEqual(managers.DockerHaManager, managers.plan_managers['plus'])
+
+    def test_manager_by_plan_name_is_cached(self):
+        manager = managers.manager_by_plan_name("development")
+        self.assertIsInstance(manager, managers.SharedManager)
+        self.assertIs(manager, managers.manager_by_plan_name("development"))
+
+    def test_manager_by_instance(self):
+        instance = Instance(name="myredis", plan="development", endpoints=[])
+        self.assertIs(managers.manager_by_plan_name("development"),
+                      managers.manager_by_instance(instance))
+
+    def test_reload_managers(self):
+        manager = managers.manager_by_plan_name("development")
+        os.environ["REDIS_SERVER_HOST"] = "otherhost"
+        managers.reload_managers()
+        reloaded = managers.manager_by_plan_name("development")
+        self.assertIsNot(manager, reloaded)
+        self.assertEqual("otherhost", reloaded.server)
+
+    @mock.patch("os.getpid")
+    def test_manager_per_process(self, getpid):
+        getpid.return_value = 100
+        manager = managers.manager_by_plan_name("development")
+        getpid.return_value = 101
+        self.assertIsNot(manager, managers.manager_by_plan_name("development"))
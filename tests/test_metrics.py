@@ -0,0 +1,99 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from prometheus_client import REGISTRY
+
+from redisapi import metrics
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TimedTest(unittest.TestCase):
+
+    def test_context_manager(self):
+        before = sample("redisapi_step_duration_seconds_count", step="test_step")
+        with metrics.timed("test_step"):
+            pass
+        self.assertEqual(before + 1,
+                         sample("redisapi_step_duration_seconds_count", step="test_step"))
+
+    def test_decorator(self):
+        @metrics.timed("test_decorated")
+        def step(value):
+            return value * 2
+
+        before = sample("redisapi_step_duration_seconds_count", step="test_decorated")
+        self.assertEqual(4, step(2))
+        self.assertEqual(before + 1,
+                         sample("redisapi_step_duration_seconds_count", step="test_decorated"))
+
+    def test_generator(self):
+        @metrics.timed("test_generator")
+        def items():
+            yield 1
+            yield 2
+
+        before = sample("redisapi_step_duration_seconds_count", step="test_generator")
+        generator = items()
+        self.assertEqual(before, sample("redisapi_step_duration_seconds_count",
+                                        step="test_generator"))
+        self.assertEqual([1, 2], list(generator))
+        self.assertEqual(before + 1,
+                         sample("redisapi_step_duration_seconds_count", step="test_generator"))
+        generator = items()
+        next(generator)
+        generator.close()
+        self.assertEqual(before + 2,
+                         sample("redisapi_step_duration_seconds_count", step="test_generator"))
+        self.assertEqual(0, sample("redisapi_step_failures_total", step="test_generator"))
+
+    def test_failures(self):
+        before = sample("redisapi_step_failures_total", step="test_failing")
+        with self.assertRaises(ValueError):
+            with metrics.timed("test_failing"):
+                raise ValueError()
+        self.assertEqual(before + 1, sample("redisapi_step_failures_total", step="test_failing"))
+        self.assertEqual(1, sample("redisapi_step_duration_seconds_count", step="test_failing"))
+
+
+class ExpositionTest(unittest.TestCase):
+
+    def test_single_process(self):
+        with metrics.timed("test_exposition"):
+            pass
+        data, content_type = metrics.exposition()
+        self.assertIn('redisapi_step_duration_seconds_count{step="test_exposition"}', data)
+        self.assertTrue(content_type.startswith("text/plain"))
+
+    def test_multiprocess(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.dict(os.environ, {"prometheus_multiproc_dir": directory}):
+            with mock.patch("prometheus_client.multiprocess.MultiProcessCollector") as collector:
+                metrics.exposition()
+        self.assertEqual(1, collector.call_count)
+        self.assertIsNot(REGISTRY, collector.call_args[0][0])
+
+
+class MetricsRouteTest(unittest.TestCase):
+
+    def setUp(self):
+        from redisapi import api
+        self.app = api.app.test_client()
+
+    def test_metrics(self):
+        self.app.get("/resources/plans")
+        response = self.app.get("/metrics")
+        self.assertEqual(200, response.status_code)
+        self.assertIn('redisapi_request_duration_seconds_count{method="GET",'
+                      'route="/resources/plans",status="200"}', response.data)
@@ -5,19 +5,32 @@
 import unittest
 import os
 
+import mock
+
 from redisapi import plans
 
 
 class PlansTest(unittest.TestCase):
 
     def test_plans(self):
+        profile = {
+            "maxmemory": 1073741824,
+            "maxmemory_policy": "volatile-lru",
+            "save": "900 1 300 10 60 10000",
+            "appendonly": "no",
+            "appendfsync": "everysec",
+            "mem_limit": 1610612736,
+            "cpu_shares": 1024,
+        }
         expected = [
             {"name": "development", "description": "Is a shared instance."},
             {"name": "basic",
-             "description": "1 dedicated instance. With 1GB of memory."},
+             "description": "1 dedicated instance. With 1GB of memory.",
+             "profile": profile},
             {"name": "plus",
              "description": ("2 dedicated instances. With 1GB of memory, "
-                             "HA and failover support via redis-sentinel.")},
+                             "HA and failover support via redis-sentinel."),
+             "profile": profile},
         ]
         self.assertListEqual(expected, plans.plans)
 
@@ -26,3 +39,29 @@ class PlansTest(unittest.TestCase):
         result = [p["name"] for p in plans.active()]
         expected = ["development", "plus"]
         self.assertListEqual(expected, result)
+
+    def test_profile(self):
+        self.assertEqual(plans.default_profile, plans.profile("basic"))
+        self.assertEqual({}, plans.profile("development"))
+        self.assertEqual({}, plans.profile(None))
+
+    @mock.patch.dict(os.environ, {"PLAN_PROFILES": '{"plus": {"appendonly": "yes"}}'})
+    def test_profile_overrides(self):
+        self.assertEqual("yes", plans.profile("plus")["appendonly"])
+        self.assertEqual(1073741824, plans.profile("plus")["maxmemory"])
+        self.assertEqual("no", plans.profile("basic")["appendonly"])
+        self.assertEqual("no", plans.default_profile["appendonly"])
+
+    @mock.patch.dict(os.environ, {"PLAN_PROFILES": '{"basic": {"memory": 1}}'})
+    def test_profile_unknown_settings(self):
+        with self.assertRaises(Exception) as cm:
+            plans.profile("basic")
+        self.assertIn("memory", str(cm.exception))
+
+    @mock.patch.dict(os.environ, {"REDIS_API_PLANS": '["development", "basic"]',
+                                  "PLAN_PROFILES": '{"basic": {"cpu_shares": 512}}'})
+    def test_active_plans_profiles(self):
+        development, basic = plans.active()
+        self.assertNotIn("profile", development)
+        self.assertEqual(512, basic["profile"]["cpu_shares"])
+        self.assertEqual(1024, plans.plans[1]["profile"]["cpu_shares"])
@@ -0,0 +1,66 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import unittest
+
+from redisapi.ports import NoPortAvailable, PortAllocator
+from redisapi.storage import Instance, MongoStorage
+
+
+class PortAllocatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.allocator = PortAllocator(49153, 49155)
+        self.storage = MongoStorage()
+
+    def tearDown(self):
+        self.allocator.collection().remove()
+        self.allocator.free_ports().remove()
+        self.storage.db().instances.remove()
+
+    def test_allocate_new_host(self):
+        self.assertEqual(49153, self.allocator.allocate("newhost"))
+        self.assertEqual(49154, self.allocator.allocate("newhost"))
+
+    def test_allocate_is_per_host(self):
+        self.assertEqual(49153, self.allocator.allocate("host1"))
+        self.assertEqual(49153, self.allocator.allocate("host2"))
+
+    def test_allocate_host_with_instances(self):
+        instance = Instance(
+            name="name",
+            plan="basic",
+            endpoints=[{"host": "newhost", "port": 49153, "container_id": "12"},
+                       {"host": "otherhost", "port": 49155, "container_id": "13"}],
+        )
+        self.storage.add_instance(instance)
+        self.assertEqual(49154, self.allocator.allocate("newhost"))
+
+    def test_release_reuses_port(self):
+        self.allocator.allocate("newhost")
+        port = self.allocator.allocate("newhost")
+        self.allocator.release("newhost", port)
+        self.assertEqual(port, self.allocator.allocate("newhost"))
+        self.assertEqual(49155, self.allocator.allocate("newhost"))
+
+    def test_release_twice(self):
+        port = self.allocator.allocate("newhost")
+        self.allocator.release("newhost", port)
+        self.allocator.release("newhost", str(port))
+        self.assertEqual(port, self.allocator.allocate("newhost"))
+        self.assertEqual(49154, self.allocator.allocate("newhost"))
+
+    def test_release_port_never_allocated(self):
+        self.allocator.release("newhost", 49153)
+        self.allocator.allocate("newhost")
+        self.allocator.release("newhost", 49154)
+        self.allocator.release("newhost", 49000)
+        self.assertEqual(0, self.allocator.free_ports().count())
+        self.assertEqual(49154, self.allocator.allocate("newhost"))
+
+    def test_allocate_out_of_range(self):
+        for _ in range(3):
+            self.allocator.allocate("newhost")
+        with self.assertRaises(NoPortAvailable):
+            self.allocator.allocate("newhost")
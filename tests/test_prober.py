@@ -0,0 +1,112 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import time
+import unittest
+
+import mock
+
+from redisapi import prober
+from redisapi.storage import Instance, MongoStorage
+
+
+class StatusCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = prober.StatusCache(ttl=5, max_age=60)
+
+    def tearDown(self):
+        self.cache.collection().remove()
+
+    def test_get_unknown(self):
+        self.assertIsNone(self.cache.get("myredis"))
+
+    def test_set(self):
+        self.cache.set("myredis", False, "down")
+        self.assertEqual((False, "down"), self.cache.get("myredis"))
+        doc = self.cache.collection().find_one({"_id": "myredis"})
+        self.assertFalse(doc["ok"])
+        self.assertEqual("down", doc["msg"])
+
+    def test_get_from_other_process(self):
+        prober.StatusCache().set("myredis", True, "")
+        self.assertEqual((True, ""), self.cache.get("myredis"))
+
+    def test_get_local_entry_is_served_within_ttl(self):
+        self.cache.set("myredis", True, "")
+        self.cache.collection().remove()
+        self.assertEqual((True, ""), self.cache.get("myredis"))
+        self.cache.local["myredis"] = (True, "", time.time() - 6)
+        self.assertIsNone(self.cache.get("myredis"))
+
+    def test_get_ignores_old_results(self):
+        self.cache.set("myredis", True, "")
+        self.cache.local.clear()
+        self.cache.collection().update_one({"_id": "myredis"},
+                                           {"$set": {"checked_at": time.time() - 61}})
+        self.assertIsNone(self.cache.get("myredis"))
+
+    def test_remove(self):
+        self.cache.set("myredis", True, "")
+        self.cache.remove("myredis")
+        self.assertIsNone(self.cache.get("myredis"))
+
+    @mock.patch("os.getpid")
+    def test_status_cache(self, getpid):
+        os.environ["STATUS_CACHE_TTL"] = "1"
+        self.addCleanup(os.environ.pop, "STATUS_CACHE_TTL")
+        self.addCleanup(prober.status_cache.reset)
+        getpid.return_value = 100
+        cache = prober.status_cache()
+        self.assertEqual(1, cache.ttl)
+        self.assertIs(cache, prober.status_cache())
+        getpid.return_value = 101
+        self.assertIsNot(cache, prober.status_cache())
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MongoStorage()
+        self.addCleanup(prober.status_cache.reset)
+
+    def tearDown(self):
+        self.storage.db().instances.remove()
+        prober.status_cache().collection().remove()
+
+    @mock.patch("redisapi.prober.manager_by_instance")
+    def test_check(self, manager_by_instance):
+        manager_by_instance.return_value.is_ok.return_value = True, ""
+        instance = Instance("myredis", "basic", [])
+        self.assertEqual((True, ""), prober.check(instance))
+        manager_by_instance.return_value.is_ok.assert_called_with(instance)
+        self.assertEqual((True, ""), prober.status_cache().get("myredis"))
+
+    @mock.patch("redisapi.prober.manager_by_instance")
+    def test_check_failure(self, manager_by_instance):
+        manager_by_instance.return_value.is_ok.side_effect = Exception("boom")
+        instance = Instance("myredis", "basic", [])
+        self.assertEqual((False, "boom"), prober.check(instance))
+
+    @mock.patch("redisapi.prober.manager_by_instance")
+    def test_probe_all(self, manager_by_instance):
+        manager = manager_by_instance.return_value
+        manager.is_ok.side_effect = lambda instance: (instance.name == "redis1", "")
+        for name in ("redis1", "redis2"):
+            self.storage.add_instance(Instance(name, "basic", [
+                {"host": "host1.com", "port": 49153, "container_id": "1"}]))
+        results = prober.probe_all(workers=2)
+        self.assertItemsEqual([(True, ""), (False, "")], results)
+        self.assertEqual((True, ""), prober.status_cache().get("redis1"))
+        self.assertEqual((False, ""), prober.status_cache().get("redis2"))
+
+    @mock.patch("redisapi.prober.disconnect")
+    @mock.patch("redisapi.prober.manager_by_instance")
+    def test_probe_all_disconnects(self, manager_by_instance, disconnect):
+        manager_by_instance.return_value.is_ok.return_value = (True, "")
+        self.storage.add_instance(Instance("redis1", "basic", [
+            {"host": "host1.com", "port": 49153, "container_id": "1"}]))
+        prober.probe_all(workers=1)
+        disconnect.assert_called_once_with()
@@ -0,0 +1,167 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import time
+import unittest
+
+import mock
+import redis
+
+from redisapi import mongodb_database
+from redisapi.reconciler import Reconciler, image_name, main
+from redisapi.storage import Instance, MongoStorage
+
+
+class ReconcilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongodb_database()
+        for collection in ("instances", "warm_containers", "sagas", "zabbix", "free_ports"):
+            self.addCleanup(self.db[collection].remove)
+        self.old = time.time() - 3600
+        self.containers = {
+            "http://host1:4243": [
+                self.container("a", 49153),
+                self.container("orphan", 49154),
+                self.container("warm", 49155),
+                self.container("recent", 49156, created=time.time()),
+                self.container("other", 80, image="nginx:latest"),
+            ],
+            "http://host2:4243": [
+                self.container("b", 49153),
+                self.container("saga", 49154),
+            ],
+        }
+        self.clients = dict((url, mock.Mock()) for url in self.containers)
+        for url, client in self.clients.items():
+            client.containers.return_value = self.containers[url]
+        self.manager = mock.Mock(image_name="redisapi/redis",
+                                 docker_hosts=sorted(self.containers),
+                                 sentinel_hosts=["http://sentinel1:26379",
+                                                 "http://sentinel2:26379"])
+        self.manager.client.side_effect = lambda url: self.clients[url]
+        self.manager.extract_hostname.side_effect = lambda url: url[7:12]
+        self.masters = {
+            "http://sentinel1:26379": {"plus": {"ip": "host1"}, "adding": {"ip": "host2"},
+                                       "gone": {"ip": "host1"}, "old": {"ip": "host2"},
+                                       "other-service": {"ip": "10.0.0.1"},
+                                       "Other_Naming": {"ip": "host1"}},
+            "http://sentinel2:26379": {"plus": {"ip": "host1"}},
+        }
+        self.sentinels = dict((url, mock.Mock()) for url in self.masters)
+        for url, conn in self.sentinels.items():
+            conn.sentinel_masters.return_value = self.masters[url]
+        patch = mock.patch("redisapi.sentinels.connection",
+                           side_effect=lambda url: self.sentinels[url])
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        storage = MongoStorage()
+        storage.add_instance(Instance(name="plus", plan="plus", endpoints=[
+            {"host": "host1", "port": 49153, "container_id": "a"},
+            {"host": "host2", "port": 49153, "container_id": "b"}]))
+        storage.add_instance(Instance(name="shared", plan="development",
+                                      endpoints=[{"host": "redis", "port": "6379"}]))
+        self.db.warm_containers.insert_one({"_id": "warm", "host": "host1", "port": 49155,
+                                            "created_at": self.old})
+        self.db.sagas.insert_one({"_id": "add:adding", "action": "add", "name": "adding",
+                                  "status": "running", "updated_at": time.time(),
+                                  "steps": [{"name": "containers", "result": [
+                                      {"host": "host2", "port": 49154,
+                                       "container_id": "saga"}]}]})
+        self.db.sagas.insert_one({"_id": "remove:old", "action": "remove", "name": "old",
+                                  "status": "failed", "updated_at": self.old, "steps": []})
+        self.db.zabbix.insert_many([
+            {"host": "host1", "port": 49153, "item": "1", "trigger": "2"},
+            {"host": "host1", "port": 49154, "item": "3", "trigger": "4"}])
+
+    def container(self, id, port, image="redisapi/redis:latest", created=None):
+        return {"Id": id, "Image": image, "Created": created or self.old,
+                "Ports": [{"PrivatePort": port, "PublicPort": port, "Type": "tcp"}]}
+
+    def test_image_name(self):
+        self.assertEqual("redisapi/redis", image_name("redisapi/redis:latest"))
+        self.assertEqual("redisapi/redis", image_name("redisapi/redis"))
+        self.assertEqual("localhost:5000/redis", image_name("localhost:5000/redis"))
+        self.assertEqual("localhost:5000/redis", image_name("localhost:5000/redis:2.8"))
+
+    def test_collect(self):
+        report = Reconciler(self.manager).collect()
+        self.assertEqual([{"url": "http://host1:4243", "host": "host1",
+                           "container_id": "orphan", "port": 49154}], report.containers)
+        self.assertEqual([{"sentinel": "http://sentinel1:26379", "name": "gone"}],
+                         report.masters)
+        self.assertEqual([{"host": "host1", "port": 49154}], report.healthchecks)
+        self.assertEqual(["remove:old"], report.sagas)
+        self.assertEqual([], report.missing)
+        self.assertEqual([], report.unmonitored)
+        self.assertEqual([], report.unreachable)
+        self.assertEqual(4, report.orphans())
+
+    def test_collect_keeps_failed_removes_of_existing_instances(self):
+        self.db.sagas.insert_one({"_id": "remove:plus", "action": "remove", "name": "plus",
+                                  "status": "failed", "updated_at": self.old,
+                                  "steps": [{"name": "container:0", "result": None}]})
+        report = Reconciler(self.manager).collect()
+        self.assertEqual(["remove:old"], report.sagas)
+
+    def test_collect_missing_and_unmonitored(self):
+        self.containers["http://host2:4243"].pop(0)
+        self.masters["http://sentinel2:26379"].pop("plus")
+        report = Reconciler(self.manager).collect()
+        self.assertEqual([{"name": "plus", "host": "host2", "port": 49153,
+                           "container_id": "b"}], report.missing)
+        self.assertEqual([{"sentinel": "http://sentinel2:26379", "name": "plus"}],
+                         report.unmonitored)
+
+    def test_collect_with_unreachable_hosts(self):
+        self.clients["http://host2:4243"].containers.side_effect = Exception("down")
+        self.sentinels["http://sentinel2:26379"].sentinel_masters.side_effect = \
+            redis.ConnectionError("down")
+        report = Reconciler(self.manager).collect()
+        self.assertEqual(["http://host2:4243", "http://sentinel2:26379"],
+                         [u.get("docker") or u.get("sentinel") for u in report.unreachable])
+        self.assertEqual([], report.missing)
+
+    def test_clean(self):
+        reconciler = Reconciler(self.manager)
+        report = reconciler.collect()
+        self.assertEqual(0, reconciler.clean(report))
+        client = self.clients["http://host1:4243"]
+        client.stop.assert_called_once_with("orphan")
+        client.remove_container.assert_called_once_with("orphan")
+        self.manager.port_allocator.release.assert_called_once_with("host1", 49154)
+        self.sentinels["http://sentinel1:26379"].sentinel_remove.assert_called_once_with("gone")
+        self.manager.health_checker().remove_many.assert_called_once_with([("host1", 49154)])
+        self.assertEqual(["add:adding"], [doc["_id"] for doc in self.db.sagas.find()])
+
+    def test_clean_keeps_masters_in_use_again(self):
+        reconciler = Reconciler(self.manager)
+        report = reconciler.collect()
+        MongoStorage().add_instance(Instance(name="gone", plan="basic", endpoints=[]))
+        self.assertEqual(0, reconciler.clean(report))
+        self.assertFalse(self.sentinels["http://sentinel1:26379"].sentinel_remove.called)
+
+    def test_clean_keeps_ports_in_use(self):
+        self.containers["http://host1:4243"][1]["Ports"][0]["PublicPort"] = 49153
+        reconciler = Reconciler(self.manager)
+        reconciler.clean(reconciler.collect())
+        self.assertFalse(self.manager.port_allocator.release.called)
+
+    @mock.patch("redisapi.reconciler.logger")
+    def test_clean_failures(self, logger):
+        self.clients["http://host1:4243"].stop.side_effect = Exception("down")
+        reconciler = Reconciler(self.manager)
+        self.assertEqual(1, reconciler.clean(reconciler.collect()))
+        self.assertTrue(logger.error.called)
+
+    @mock.patch("logging.basicConfig")
+    @mock.patch("redisapi.reconciler.logger")
+    @mock.patch("redisapi.managers.manager_by_plan_name")
+    def test_main(self, manager_by_plan_name, logger, basic_config):
+        manager_by_plan_name.return_value = self.manager
+        self.assertEqual(0, main([]))
+        self.assertFalse(self.clients["http://host1:4243"].stop.called)
+        self.assertEqual(0, main(["--clean"]))
+        self.clients["http://host1:4243"].stop.assert_called_once_with("orphan")
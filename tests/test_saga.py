@@ -0,0 +1,93 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import unittest
+
+import mock
+
+from redisapi.saga import Saga
+
+
+class SagaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(Saga("add", "name").collection().remove)
+
+    def doc(self):
+        return Saga("add", "name").collection().find_one({"_id": "add:name"})
+
+    def test_steps(self):
+        with Saga("add", "name") as saga:
+            self.assertEqual([1, 2], saga.step("first", lambda: [1, 2]))
+            self.assertEqual([{"name": "first", "result": [1, 2]}], self.doc()["steps"])
+            self.assertEqual("running", self.doc()["status"])
+            self.assertIsNone(saga.step("second", lambda: None))
+        self.assertIsNone(self.doc())
+
+    def test_resume(self):
+        saga = Saga("add", "name")
+        saga.collection().insert_one({"_id": "add:name", "action": "add", "name": "name",
+                                      "status": "running",
+                                      "steps": [{"name": "first", "result": "done"}]})
+        first, second = mock.Mock(), mock.Mock(return_value="second")
+        with saga:
+            self.assertEqual("done", saga.step("first", first))
+            self.assertEqual("second", saga.step("second", second))
+        self.assertFalse(first.called)
+        second.assert_called_once_with()
+        self.assertIsNone(self.doc())
+
+    def test_rollback(self):
+        undo_first, undo_second = mock.Mock(), mock.Mock()
+        calls = []
+        undo_first.side_effect = lambda result: calls.append(("first", result))
+        undo_second.side_effect = lambda result: calls.append(("second", result))
+        with self.assertRaises(ValueError):
+            with Saga("add", "name") as saga:
+                saga.step("first", lambda: 1, undo=undo_first)
+                saga.step("second", lambda: 2, undo=undo_second)
+                saga.step("third", mock.Mock(side_effect=ValueError("failed")),
+                          undo=mock.Mock())
+        self.assertEqual([("second", 2), ("first", 1)], calls)
+        self.assertIsNone(self.doc())
+
+    def test_rollback_keeps_steps_that_can_not_be_undone(self):
+        undo = mock.Mock(side_effect=Exception("can not undo"))
+        with self.assertRaises(ValueError):
+            with Saga("add", "name") as saga:
+                saga.step("irreversible", lambda: 1)
+                saga.step("failing undo", lambda: 2, undo=undo)
+                saga.step("undone", lambda: 3, undo=mock.Mock())
+                raise ValueError("failed")
+        doc = self.doc()
+        self.assertEqual("failed", doc["status"])
+        self.assertEqual("failed", doc["error"])
+        self.assertEqual(["irreversible", "failing undo"], [s["name"] for s in doc["steps"]])
+
+        again = mock.Mock(return_value=4)
+        with Saga("add", "name") as saga:
+            saga.step("irreversible", mock.Mock())
+            saga.step("failing undo", mock.Mock(), undo=undo)
+            saga.step("undone", again)
+        again.assert_called_once_with()
+        self.assertIsNone(self.doc())
+
+    def test_rollback_forgets_steps_done_after_an_undone_step(self):
+        undo = mock.Mock()
+        with self.assertRaises(ValueError):
+            with Saga("add", "name") as saga:
+                saga.step("irreversible", lambda: 1)
+                saga.step("undone", lambda: 2, undo=undo)
+                saga.step("depends on undone", lambda: 3)
+                saga.step("failing undo", lambda: 4, undo=mock.Mock(side_effect=Exception()))
+                raise ValueError("failed")
+        undo.assert_called_once_with(2)
+        self.assertEqual(["irreversible"], [s["name"] for s in self.doc()["steps"]])
+
+        again = mock.Mock(return_value=3)
+        with Saga("add", "name") as saga:
+            saga.step("irreversible", mock.Mock())
+            saga.step("undone", mock.Mock(), undo=undo)
+            saga.step("depends on undone", again)
+        again.assert_called_once_with()
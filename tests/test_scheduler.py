@@ -0,0 +1,196 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import unittest
+
+import mock
+
+from redisapi import scheduler
+from redisapi.storage import Instance, MongoStorage
+
+
+class FakeLoads(object):
+
+    def __init__(self, counts, memory=None):
+        self.counts = counts
+        self.memory = memory or {}
+
+    def get(self, host):
+        return self.counts.get(host, 0)
+
+    def used_memory(self, host):
+        return self.memory.get(host, 0)
+
+    def add(self, host, count=1, memory=0):
+        self.counts[host] = self.counts.get(host, 0) + count
+        self.memory[host] = self.memory.get(host, 0) + memory
+
+
+class HostLoadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MongoStorage()
+
+    def tearDown(self):
+        self.storage.db().instances.remove()
+        self.storage.db().warm_containers.remove()
+        os.environ.pop("PLAN_PROFILES", None)
+
+    def test_get(self):
+        self.storage.add_instance(Instance("redis1", "plus", [
+            {"host": "host1.com", "port": 49153, "container_id": "1"},
+            {"host": "host2.com", "port": 49153, "container_id": "2"}]))
+        self.storage.add_instance(Instance("redis2", "basic", [
+            {"host": "host1.com", "port": 49154, "container_id": "3"}]))
+        loads = scheduler.HostLoads(ttl=10)
+        self.assertEqual(2, loads.get("host1.com"))
+        self.assertEqual(1, loads.get("host2.com"))
+        self.assertEqual(0, loads.get("host3.com"))
+
+    def test_used_memory(self):
+        os.environ["PLAN_PROFILES"] = '{"plus": {"mem_limit": 536870912}}'
+        self.storage.add_instance(Instance("redis1", "plus", [
+            {"host": "host1.com", "port": 49153, "container_id": "1"},
+            {"host": "host2.com", "port": 49153, "container_id": "2"}]))
+        self.storage.add_instance(Instance("redis2", "basic", [
+            {"host": "host1.com", "port": 49154, "container_id": "3"}]))
+        self.storage.add_instance(Instance("shared", "development", [
+            {"host": "host3.com", "port": 6379}]))
+        self.storage.db().warm_containers.insert_one(
+            {"_id": "4", "host": "host2.com", "port": 49154, "plan": "basic"})
+        loads = scheduler.HostLoads(ttl=10)
+        self.assertEqual(512 + 1536, loads.used_memory("host1.com"))
+        self.assertEqual(512 + 1536, loads.used_memory("host2.com"))
+        self.assertEqual(2, loads.get("host2.com"))
+        self.assertEqual(0, loads.used_memory("host3.com"))
+        loads.add("host3.com", memory=1024)
+        self.assertEqual(1024, loads.used_memory("host3.com"))
+        self.assertEqual(2, loads.get("host3.com"))
+
+    def test_get_is_cached(self):
+        loads = scheduler.HostLoads(ttl=10)
+        self.assertEqual(0, loads.get("host1.com"))
+        self.storage.add_instance(Instance("redis1", "basic", [
+            {"host": "host1.com", "port": 49153, "container_id": "1"}]))
+        self.assertEqual(0, loads.get("host1.com"))
+        loads.add("host1.com", 5)
+        self.assertEqual(5, loads.get("host1.com"))
+        loads.loaded_at -= 10
+        self.assertEqual(1, loads.get("host1.com"))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = ["http://host1.com:4243", "http://host2.com:4243",
+                      "http://host3.com:4243"]
+
+    def test_scheduler_is_abstract(self):
+        with self.assertRaises(TypeError):
+            scheduler.Scheduler()
+
+    def test_random(self):
+        chosen = scheduler.RandomScheduler().choose(self.hosts, 2)
+        self.assertEqual(2, len(set(chosen)))
+        for host in chosen:
+            self.assertIn(host, self.hosts)
+
+    def test_not_enough_hosts(self):
+        with self.assertRaises(scheduler.NoHostAvailable):
+            scheduler.RandomScheduler().choose(self.hosts, 4)
+
+    def test_least_loaded(self):
+        loads = FakeLoads({"host1.com": 3, "host2.com": 1, "host3.com": 2})
+        sched = scheduler.LeastLoadedScheduler(loads=loads)
+        self.assertEqual(["http://host2.com:4243", "http://host3.com:4243"],
+                         sched.choose(self.hosts, 2))
+        self.assertEqual(2, loads.get("host2.com"))
+        self.assertEqual(3, loads.get("host3.com"))
+        self.assertEqual(["http://host2.com:4243"], sched.choose(self.hosts))
+
+    def test_zones(self):
+        loads = FakeLoads({"host1.com": 0, "host2.com": 1, "host3.com": 2})
+        zones = {"http://host1.com:4243": "a", "http://host2.com:4243": "a",
+                 "http://host3.com:4243": "b"}
+        sched = scheduler.LeastLoadedScheduler(zones=zones, loads=loads)
+        self.assertEqual(["http://host1.com:4243", "http://host3.com:4243"],
+                         sched.choose(self.hosts, 2))
+
+    def test_zones_with_more_hosts_than_zones(self):
+        loads = FakeLoads({"host1.com": 0, "host2.com": 1, "host3.com": 2})
+        zones = dict((host, "a") for host in self.hosts)
+        sched = scheduler.LeastLoadedScheduler(zones=zones, loads=loads)
+        self.assertEqual(["http://host1.com:4243", "http://host2.com:4243"],
+                         sched.choose(self.hosts, 2))
+
+    def test_memory(self):
+        loads = FakeLoads({"host1.com": 3, "host2.com": 1, "host3.com": 0},
+                          {"host1.com": 3072, "host2.com": 1024})
+        memory = {"http://host1.com:4243": 4096, "http://host2.com:4243": 4096,
+                  "http://host3.com:4243": 2048}
+        sched = scheduler.MemoryScheduler(loads=loads, memory=memory,
+                                          container_memory=1024)
+        self.assertEqual(["http://host1.com:4243"], sched.choose(self.hosts))
+        self.assertEqual(["http://host3.com:4243", "http://host2.com:4243"],
+                         sched.choose(self.hosts, 2))
+
+    def test_memory_placed(self):
+        loads = FakeLoads({}, {"host1.com": 1024})
+        memory = {"http://host1.com:4243": 2048}
+        sched = scheduler.MemoryScheduler(loads=loads, memory=memory,
+                                          container_memory=512)
+        sched.choose(self.hosts[:1])
+        self.assertEqual(1536, loads.used_memory("host1.com"))
+        sched.choose(self.hosts[:1])
+        with self.assertRaises(scheduler.NoHostAvailable):
+            sched.choose(self.hosts[:1])
+
+    def test_memory_full(self):
+        loads = FakeLoads({"host1.com": 2}, {"host1.com": 2048})
+        memory = {"http://host1.com:4243": 2048}
+        sched = scheduler.MemoryScheduler(loads=loads, memory=memory,
+                                          container_memory=1024)
+        with self.assertRaises(scheduler.NoHostAvailable):
+            sched.choose(self.hosts[:1])
+
+
+class SchedulerFromEnvTest(unittest.TestCase):
+
+    def remove_env(self, env):
+        if env in os.environ:
+            del os.environ[env]
+
+    def test_default(self):
+        self.assertIsInstance(scheduler.scheduler_from_env(), scheduler.RandomScheduler)
+
+    def test_least_loaded(self):
+        os.environ["SCHEDULER"] = "least-loaded"
+        self.addCleanup(self.remove_env, "SCHEDULER")
+        os.environ["DOCKER_HOSTS_ZONES"] = '{"http://host1.com:4243": "a"}'
+        self.addCleanup(self.remove_env, "DOCKER_HOSTS_ZONES")
+        sched = scheduler.scheduler_from_env()
+        self.assertIsInstance(sched, scheduler.LeastLoadedScheduler)
+        self.assertEqual({"http://host1.com:4243": "a"}, sched.zones)
+
+    def test_memory(self):
+        os.environ["SCHEDULER"] = "memory"
+        self.addCleanup(self.remove_env, "SCHEDULER")
+        os.environ["DOCKER_HOSTS_MEMORY"] = '{"http://host1.com:4243": 8192}'
+        self.addCleanup(self.remove_env, "DOCKER_HOSTS_MEMORY")
+        os.environ["PLAN_PROFILES"] = '{"basic": {"mem_limit": 536870912}}'
+        self.addCleanup(self.remove_env, "PLAN_PROFILES")
+        sched = scheduler.scheduler_from_env("basic")
+        self.assertIsInstance(sched, scheduler.MemoryScheduler)
+        self.assertEqual({"http://host1.com:4243": 8192}, sched.memory)
+        self.assertEqual(512, sched.container_memory)
+
+    @mock.patch("os.getpid")
+    def test_host_loads_per_process(self, getpid):
+        self.addCleanup(scheduler.host_loads.reset)
+        getpid.return_value = 100
+        loads = scheduler.host_loads()
+        self.assertIs(loads, scheduler.host_loads())
+        getpid.return_value = 101
+        self.assertIsNot(loads, scheduler.host_loads())
@@ -0,0 +1,179 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import SocketServer
+import os
+import socket
+import threading
+import unittest
+
+import mock
+import redis
+
+from redisapi import connections, sentinels
+
+
+class SentinelsTest(unittest.TestCase):
+
+    def remove_env(self, env):
+        if env in os.environ:
+            del os.environ[env]
+
+    def setUp(self):
+        self.hosts = ["http://host1.com:26379", "http://host2.com:26379",
+                      "http://host3.com:26379"]
+        connections._pools.reset()
+        self.addCleanup(connections._pools.reset)
+
+    def test_sentinel_address(self):
+        self.assertEqual(("host1.com", "26379"),
+                         sentinels.sentinel_address("http://host1.com:26379"))
+
+    def test_connection_reuses_pool(self):
+        conn1 = sentinels.connection(self.hosts[0])
+        conn2 = sentinels.connection(self.hosts[0])
+        conn3 = sentinels.connection(self.hosts[1])
+        self.assertIs(conn1.connection_pool, conn2.connection_pool)
+        self.assertIsNot(conn1.connection_pool, conn3.connection_pool)
+        kwargs = conn1.connection_pool.connection_kwargs
+        self.assertEqual("host1.com", kwargs["host"])
+        self.assertEqual(26379, kwargs["port"])
+        self.assertEqual(5.0, kwargs["socket_timeout"])
+
+    def test_quorum(self):
+        self.assertEqual(2, sentinels.quorum(self.hosts))
+        self.assertEqual(1, sentinels.quorum(self.hosts[:1]))
+        os.environ["SENTINEL_QUORUM"] = "3"
+        self.addCleanup(self.remove_env, "SENTINEL_QUORUM")
+        self.assertEqual(3, sentinels.quorum(self.hosts))
+
+    @mock.patch("redisapi.sentinels.connection")
+    def test_execute(self, connection):
+        connection.return_value.pipeline.return_value.execute.return_value = []
+        results = sentinels.execute(self.hosts, [["remove", "master"]])
+        self.assertEqual(self.hosts, [r[0] for r in results])
+        self.assertEqual([None] * 3, [r[1] for r in results])
+
+    @mock.patch("redisapi.sentinels.logger")
+    @mock.patch("redisapi.sentinels.connection")
+    def test_execute_with_quorum(self, connection, logger):
+        pipe = connection.return_value.pipeline.return_value
+        pipe.execute.side_effect = [[], redis.ConnectionError("down"), []]
+        results = sentinels.execute(self.hosts, [["remove", "master"]])
+        errors = [r[1] for r in results if r[1]]
+        self.assertEqual(1, len(errors))
+
+    @mock.patch("redisapi.sentinels.logger")
+    @mock.patch("redisapi.sentinels.connection")
+    def test_execute_without_quorum(self, connection, logger):
+        pipe = connection.return_value.pipeline.return_value
+        pipe.execute.side_effect = [[], redis.ConnectionError("down"),
+                                    redis.ConnectionError("down")]
+        with self.assertRaises(sentinels.SentinelQuorumError):
+            sentinels.execute(self.hosts, [["remove", "master"]])
+
+    def test_execute_without_sentinels(self):
+        self.assertEqual([], sentinels.execute([], [["remove", "master"]]))
+
+
+class FakeSentinel(SocketServer.StreamRequestHandler):
+    """Records the commands received on the wire and keeps the monitored
+    masters, answering like a sentinel.
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                command.append(self.rfile.read(length + 2)[:-2])
+            self.server.received.append(command)
+            action, name = command[1].lower(), command[2]
+            if action == "get-master-addr-by-name":
+                if name in self.server.masters:
+                    ip, port = self.server.masters[name]
+                    self.wfile.write("*2\r\n${}\r\n{}\r\n${}\r\n{}\r\n".format(
+                        len(ip), ip, len(port), port))
+                else:
+                    self.wfile.write("*-1\r\n")
+            elif action == "monitor" and name in self.server.masters:
+                self.wfile.write("-ERR Duplicated master name\r\n")
+            elif action in ("remove", "set") and name not in self.server.masters:
+                self.wfile.write("-ERR No such master with that name\r\n")
+            else:
+                if action == "monitor":
+                    self.server.masters[name] = (command[3], command[4])
+                elif action == "remove":
+                    self.server.masters.pop(name)
+                self.wfile.write("+OK\r\n")
+
+
+class SentinelWireTest(unittest.TestCase):
+
+    def setUp(self):
+        connections._pools.reset()
+        self.addCleanup(connections._pools.reset)
+        self.servers = []
+        for _ in range(3):
+            server = SocketServer.ThreadingTCPServer(("127.0.0.1", 0), FakeSentinel)
+            server.daemon_threads = True
+            server.received = []
+            server.masters = {}
+            thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+            thread.daemon = True
+            thread.start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            self.servers.append(server)
+        self.hosts = ["http://127.0.0.1:{}".format(s.server_address[1]) for s in self.servers]
+
+    def test_commands_are_sent(self):
+        commands = [["monitor", "master", "10.0.0.1", 49153, "1"],
+                    ["set", "master", "down-after-milliseconds", "5000"]]
+        sentinels.execute(self.hosts, commands)
+        for server in self.servers:
+            self.assertEqual([["SENTINEL", "monitor", "master", "10.0.0.1", "49153", "1"],
+                              ["SENTINEL", "set", "master", "down-after-milliseconds", "5000"]],
+                             server.received)
+        sentinels.execute(self.hosts, [["remove", "master"]])
+        self.assertEqual([{}] * 3, [server.masters for server in self.servers])
+
+    def test_retries_are_accepted(self):
+        commands = [["monitor", "master", "10.0.0.1", 49153, "1"]]
+        sentinels.execute(self.hosts, commands)
+        sentinels.execute(self.hosts, commands)
+        self.assertEqual(["get-master-addr-by-name"],
+                         [c[1].lower() for c in self.servers[0].received[2:]])
+        sentinels.execute(self.hosts, [["remove", "master"]])
+        sentinels.execute(self.hosts, [["remove", "master"]])
+
+    def test_master_monitored_at_another_address(self):
+        self.servers[0].masters["master"] = ("10.0.0.9", "49160")
+        commands = [["monitor", "master", "10.0.0.1", 49153, "1"],
+                    ["set", "master", "down-after-milliseconds", "5000"]]
+        sentinels.execute(self.hosts, commands)
+        self.assertEqual([{"master": ("10.0.0.1", "49153")}] * 3,
+                         [server.masters for server in self.servers])
+        self.assertEqual(["monitor", "set", "get-master-addr-by-name", "remove", "monitor", "set"],
+                         [c[1].lower() for c in self.servers[0].received])
+
+    @mock.patch("redisapi.sentinels.logger")
+    def test_errors_are_reported(self, logger):
+        with self.assertRaises(sentinels.SentinelQuorumError):
+            sentinels.execute(self.hosts, [["set", "master", "quorum", "2"]])
+
+    @mock.patch("redisapi.sentinels.logger")
+    def test_unreachable_sentinels(self, logger):
+        ports = []
+        for _ in range(3):
+            sock = socket.socket()
+            sock.bind(("127.0.0.1", 0))
+            ports.append(sock.getsockname()[1])
+            sock.close()
+        hosts = ["http://127.0.0.1:{}".format(port) for port in ports]
+        with self.assertRaises(sentinels.SentinelQuorumError):
+            sentinels.execute(hosts, [["remove", "master"]])
@@ -10,21 +10,6 @@ from redis import exceptions
 from redisapi.storage import Instance
 
 
-class FakeConnection(object):
-    connected = False
-
-    def connect(self):
-        self.connected = True
-
-
-class FailingFakeConnection(object):
-
-    def connect(self):
-        raise exceptions.ConnectionError(
-            "Error 61 connecting localhost:6379. Connection refused.",
-        )
-
-
 class SharedManagerTest(unittest.TestCase):
 
     def remove_env(self, env):
@@ -76,34 +61,33 @@ class SharedManagerTest(unittest.TestCase):
         }
         self.assertEqual(want, envs)
 
-    @mock.patch("redis.Connection")
-    def test_is_ok(self, Connection):
-        f = FakeConnection()
-        Connection.return_value = f
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok(self, redis_connection):
         ok, msg = self.manager.is_ok()
         self.assertTrue(ok)
         self.assertEqual("", msg)
-        Connection.assert_called_with(host="localhost")
-        self.assertTrue(f.connected)
+        redis_connection.assert_called_with("localhost", "6379", password=None,
+                                            timeout=2.0)
+        redis_connection.return_value.ping.assert_called_with()
 
-    @mock.patch("redis.Connection")
-    def test_is_ok_unavailable_server(self, Connection):
-        f = FailingFakeConnection()
-        Connection.return_value = f
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok_unavailable_server(self, redis_connection):
+        redis_connection.return_value.ping.side_effect = exceptions.ConnectionError(
+            "Error 61 connecting localhost:6379. Connection refused.",
+        )
         ok, msg = self.manager.is_ok()
         self.assertFalse(ok)
         want_msg = "Error 61 connecting localhost:6379. Connection refused."
         self.assertEqual(want_msg, msg)
 
-    @mock.patch("redis.Connection")
-    def test_is_ok_with_password(self, Connection):
+    @mock.patch("redisapi.managers.redis_connection")
+    def test_is_ok_with_password(self, redis_connection):
         os.environ["REDIS_SERVER_PASSWORD"] = "s3cr3t"
         self.addCleanup(self.remove_env, "REDIS_SERVER_PASSWORD")
-        f = FakeConnection()
-        Connection.return_value = f
         ok, msg = self.manager.is_ok()
         self.assertTrue(ok)
-        Connection.assert_called_with(host="localhost", password="s3cr3t")
+        redis_connection.assert_called_with("localhost", "6379", password="s3cr3t",
+                                            timeout=2.0)
 
     def test_running_without_the_REDIS_SERVER_HOST_variable(self):
         del os.environ["REDIS_SERVER_HOST"]
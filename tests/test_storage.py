@@ -6,7 +6,45 @@ import unittest
 import mock
 import os
 
-from redisapi.storage import Instance
+import redisapi
+
+from redisapi import storage
+from redisapi.storage import Endpoint, Instance, InstanceCache
+
+
+class EndpointTest(unittest.TestCase):
+
+    def test_reads_like_a_dict(self):
+        endpoint = Endpoint("host", 49153, "id")
+        self.assertEqual("host", endpoint["host"])
+        self.assertEqual(49153, endpoint["port"])
+        self.assertEqual("id", endpoint.get("container_id"))
+        self.assertIn("container_id", endpoint)
+        self.assertRaises(KeyError, endpoint.__getitem__, "other")
+
+    def test_without_container(self):
+        endpoint = Endpoint("host", 6379)
+        self.assertRaises(KeyError, endpoint.__getitem__, "container_id")
+        self.assertIsNone(endpoint.get("container_id"))
+        self.assertNotIn("container_id", endpoint)
+        self.assertEqual({"host": "host", "port": 6379}, endpoint.to_json())
+
+    def test_equality(self):
+        endpoint = Endpoint("host", 6379, "id")
+        self.assertEqual(endpoint, {"host": "host", "port": 6379, "container_id": "id"})
+        self.assertEqual({"host": "host", "port": 6379, "container_id": "id"}, endpoint)
+        self.assertEqual(endpoint, Endpoint("host", 6379, "id"))
+        self.assertNotEqual(endpoint, Endpoint("host", 6380, "id"))
+        self.assertNotEqual(endpoint, "host")
+
+    def test_validation(self):
+        self.assertRaises(ValueError, Endpoint, "", 6379)
+        self.assertRaises(ValueError, Endpoint, "host", None)
+        self.assertRaises(ValueError, Endpoint.from_document, {"port": 6379})
+
+    def test_slots(self):
+        endpoint = Endpoint("host", 6379)
+        self.assertRaises(AttributeError, setattr, endpoint, "other", 1)
 
 
 class InstanceTest(unittest.TestCase):
@@ -45,6 +83,89 @@ class InstanceTest(unittest.TestCase):
             'endpoints': endpoints,
         }
         self.assertDictEqual(instance.to_json(), expected)
+        self.assertIsInstance(instance.to_json()["endpoints"][0], dict)
+
+    def test_endpoints_are_decoded(self):
+        instance = Instance("name", "plan", [{"host": "host", "port": 49153}])
+        self.assertIsInstance(instance.endpoints[0], Endpoint)
+        self.assertEqual("host", instance.endpoints[0].host)
+
+    def test_from_document(self):
+        instance = Instance.from_document(
+            {"_id": "id", "name": "name", "plan": "plan",
+             "endpoints": [{"host": "host", "port": 49153, "container_id": "id"}]})
+        self.assertEqual("name", instance.name)
+        self.assertEqual("plan", instance.plan)
+        self.assertEqual(Endpoint("host", 49153, "id"), instance.endpoints[0])
+
+    def test_from_document_projection(self):
+        instance = Instance.from_document({"name": "name"})
+        self.assertEqual("name", instance.name)
+        self.assertIsNone(instance.plan)
+        self.assertIsNone(instance.endpoints)
+
+
+class InstanceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = InstanceCache(2, ttl=60, check_interval=0)
+        self.addCleanup(self.cache.collection().remove)
+
+    def test_get_and_set(self):
+        instance = Instance("name", "plan", [])
+        self.assertIsNone(self.cache.get("name"))
+        self.cache.set("name", instance)
+        self.assertIs(instance, self.cache.get("name"))
+        self.assertEqual({"hits": 1, "misses": 1, "size": 1}, self.cache.stats())
+
+    def test_lookups_metric(self):
+        from prometheus_client import REGISTRY
+        hits = REGISTRY.get_sample_value("redisapi_instance_cache_lookups_total",
+                                         {"result": "hit"}) or 0
+        misses = REGISTRY.get_sample_value("redisapi_instance_cache_lookups_total",
+                                           {"result": "miss"}) or 0
+        self.cache.get("name")
+        self.cache.set("name", Instance("name", "plan", []))
+        self.cache.get("name")
+        self.cache.get("name")
+        self.assertEqual(hits + 2, REGISTRY.get_sample_value(
+            "redisapi_instance_cache_lookups_total", {"result": "hit"}))
+        self.assertEqual(misses + 1, REGISTRY.get_sample_value(
+            "redisapi_instance_cache_lookups_total", {"result": "miss"}))
+
+    def test_ttl(self):
+        self.cache.ttl = 0
+        self.cache.set("name", Instance("name", "plan", []))
+        self.assertIsNone(self.cache.get("name"))
+
+    def test_least_recently_used_are_dropped(self):
+        for name in ("a", "b"):
+            self.cache.set(name, Instance(name, "plan", []))
+        self.cache.get("a")
+        self.cache.set("c", Instance("c", "plan", []))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual("a", self.cache.get("a").name)
+        self.assertEqual("c", self.cache.get("c").name)
+
+    def test_invalidate(self):
+        self.cache.set("name", Instance("name", "plan", []))
+        self.cache.invalidate("name")
+        self.assertIsNone(self.cache.get("name"))
+
+    def test_invalidate_other_process(self):
+        other = InstanceCache(2, ttl=60, check_interval=0)
+        self.cache.set("name", Instance("name", "plan", []))
+        self.cache.set("other", Instance("other", "plan", []))
+        self.cache.get("name")
+        other.invalidate("name")
+        self.assertIsNone(self.cache.get("other"))
+
+    def test_generation_is_checked_once_per_interval(self):
+        self.cache.check_interval = 60
+        self.cache.get("name")
+        self.cache.set("name", Instance("name", "plan", []))
+        InstanceCache(2).invalidate("name")
+        self.assertEqual("name", self.cache.get("name").name)
 
 
 class MongoStorageTest(unittest.TestCase):
@@ -53,18 +174,57 @@ class MongoStorageTest(unittest.TestCase):
         if env in os.environ:
             del os.environ[env]
 
+    def setUp(self):
+        redisapi.reset_mongodb()
+        self.addCleanup(redisapi.reset_mongodb)
+
+    def assert_client_uri(self, mongo_mock, uri):
+        args, kwargs = mongo_mock.call_args
+        self.assertEqual((uri,), args)
+        self.assertEqual(redisapi.mongodb_client_options(), kwargs)
+
     @mock.patch("pymongo.MongoClient")
     def test_mongodb_uri_environ(self, mongo_mock):
         from redisapi.storage import MongoStorage
         storage = MongoStorage()
         storage.db()
-        mongo_mock.assert_called_with("mongodb://localhost:27017/")
+        self.assert_client_uri(mongo_mock, "mongodb://localhost:27017/")
 
         os.environ["MONGODB_URI"] = "0.0.0.0"
         self.addCleanup(self.remove_env, "MONGODB_URI")
         storage = MongoStorage()
         storage.db()
-        mongo_mock.assert_called_with("0.0.0.0")
+        self.assert_client_uri(mongo_mock, "0.0.0.0")
+
+    @mock.patch("pymongo.MongoClient")
+    def test_mongodb_client_is_shared(self, mongo_mock):
+        from redisapi.storage import MongoStorage
+        db = MongoStorage().db()
+        self.assertIs(db, MongoStorage().db())
+        self.assertEqual(1, mongo_mock.call_count)
+
+    @mock.patch("os.getpid")
+    @mock.patch("pymongo.MongoClient")
+    def test_mongodb_client_is_recreated_after_fork(self, mongo_mock, getpid):
+        from redisapi.storage import MongoStorage
+        getpid.return_value = 100
+        MongoStorage().db()
+        getpid.return_value = 101
+        MongoStorage().db()
+        self.assertEqual(2, mongo_mock.call_count)
+
+    @mock.patch("pymongo.MongoClient")
+    def test_mongodb_client_options_environ(self, mongo_mock):
+        os.environ["MONGODB_MAX_POOL_SIZE"] = "10"
+        self.addCleanup(self.remove_env, "MONGODB_MAX_POOL_SIZE")
+        os.environ["MONGODB_CONNECT_TIMEOUT_MS"] = "500"
+        self.addCleanup(self.remove_env, "MONGODB_CONNECT_TIMEOUT_MS")
+        from redisapi.storage import MongoStorage
+        MongoStorage().db()
+        kwargs = mongo_mock.call_args[1]
+        self.assertEqual(10, kwargs["maxPoolSize"])
+        self.assertEqual(500, kwargs["connectTimeoutMS"])
+        self.assertFalse(kwargs["connect"])
 
     @mock.patch("pymongo.MongoClient")
     def test_mongodb_dbaas_uri_environ(self, mongo_mock):
@@ -73,7 +233,7 @@ class MongoStorageTest(unittest.TestCase):
         self.addCleanup(self.remove_env, "DBAAS_MONGODB_ENDPOINT")
         storage = MongoStorage()
         storage.db()
-        mongo_mock.assert_called_with("0.0.0.1")
+        self.assert_client_uri(mongo_mock, "0.0.0.1")
 
     @mock.patch("pymongo.MongoClient")
     def test_mongodb_dbaas_database_name_environ(self, mongo_mock):
@@ -88,7 +248,7 @@ class MongoStorageTest(unittest.TestCase):
         mongo_mock.return_value.get_default_database.side_effect = error
         storage = MongoStorage()
         storage.db()
-        mongo_mock.assert_called_with("0.0.0.1")
+        self.assert_client_uri(mongo_mock, "0.0.0.1")
         mongo_mock.return_value.__getitem__.assert_called_with("xxxx")
 
     @mock.patch("pymongo.MongoClient")
@@ -98,7 +258,7 @@ class MongoStorageTest(unittest.TestCase):
         self.addCleanup(self.remove_env, "DBAAS_MONGODB_ENDPOINT")
         storage = MongoStorage()
         storage.db()
-        mongo_mock.assert_called_with("0.0.0.1")
+        self.assert_client_uri(mongo_mock, "0.0.0.1")
         mongo_mock.return_value.get_default_database.assert_called_with()
 
     def test_add_instance(self):
@@ -125,6 +285,71 @@ class MongoStorageTest(unittest.TestCase):
                          result.endpoints[0]["container_id"])
         storage.remove_instance(instance)
 
+    def test_find_instance_by_name_fields(self):
+        from redisapi.storage import MongoStorage
+        storage = MongoStorage()
+        instance = Instance("xname", "plan", [{"host": "host", "port": 49153}])
+        storage.add_instance(instance)
+        self.addCleanup(storage.remove_instance, instance)
+        result = storage.find_instance_by_name("xname", fields=("name", "plan"))
+        self.assertEqual("plan", result.plan)
+        self.assertIsNone(result.endpoints)
+
+    def enable_cache(self):
+        os.environ["INSTANCE_CACHE_SIZE"] = "10"
+        os.environ["INSTANCE_CACHE_CHECK_INTERVAL"] = "0"
+        self.addCleanup(self.remove_env, "INSTANCE_CACHE_SIZE")
+        self.addCleanup(self.remove_env, "INSTANCE_CACHE_CHECK_INTERVAL")
+        self.addCleanup(storage._instance_cache.reset)
+        self.addCleanup(storage.mongodb_database().generations.remove)
+
+    def test_instance_cache_disabled(self):
+        self.assertIsNone(storage.instance_cache())
+
+    def test_instance_cache_is_per_process(self):
+        self.enable_cache()
+        cache = storage.instance_cache()
+        self.assertEqual(10, cache.size)
+        self.assertIs(cache, storage.instance_cache())
+        with mock.patch("os.getpid", return_value=-1):
+            self.assertIsNot(cache, storage.instance_cache())
+
+    def test_find_instance_by_name_cached(self):
+        self.enable_cache()
+        from redisapi.storage import MongoStorage
+        mongo_storage = MongoStorage()
+        instance = Instance("xname", "plan", [{"host": "host", "port": 49153}])
+        mongo_storage.add_instance(instance)
+        self.addCleanup(mongo_storage.remove_instance, instance)
+        first = mongo_storage.find_instance_by_name("xname")
+        self.assertIs(first, mongo_storage.find_instance_by_name("xname"))
+        self.assertEqual(1, storage.instance_cache().hits)
+        mongo_storage.find_instance_by_name("xname", fields=("name",))
+        self.assertEqual(1, storage.instance_cache().hits)
+
+    def test_remove_instance_invalidates_cache(self):
+        self.enable_cache()
+        from redisapi.storage import MongoStorage
+        mongo_storage = MongoStorage()
+        instance = Instance("xname", "plan", [{"host": "host", "port": 49153}])
+        mongo_storage.add_instance(instance)
+        mongo_storage.find_instance_by_name("xname")
+        mongo_storage.remove_instance(instance)
+        self.assertIsNone(storage.instance_cache().get("xname"))
+        mongo_storage.add_instance(Instance("xname", "other", [{"host": "host", "port": 1}]))
+        self.addCleanup(mongo_storage.remove_instance, instance)
+        self.assertEqual("other", mongo_storage.find_instance_by_name("xname").plan)
+
+    def test_find_instances(self):
+        from redisapi.storage import MongoStorage
+        storage = MongoStorage()
+        for name, plan in (("a", "basic"), ("b", "plus"), ("c", "basic")):
+            instance = Instance(name, plan, [{"host": "host", "port": 49153}])
+            storage.add_instance(instance)
+            self.addCleanup(storage.remove_instance, instance)
+        result = storage.find_instances({"plan": "basic"}, fields=("name",))
+        self.assertEqual(["a", "c"], sorted(instance.name for instance in result))
+
     def test_find_instances_by_host(self):
         from redisapi.storage import MongoStorage
         storage = MongoStorage()
@@ -152,3 +377,45 @@ class MongoStorageTest(unittest.TestCase):
         length = storage.db()['instances'].find(
             {"name": instance.name}).count()
         self.assertEqual(length, 0)
+
+    def test_remove_instance_removes_acl_units(self):
+        from redisapi.storage import MongoStorage
+        storage = MongoStorage()
+        instance = Instance("xname", "plan", [])
+        storage.add_instance(instance)
+        storage.db().acl_units.insert_one({"_id": "xname:10.0.0.0/24", "instance": "xname",
+                                           "units": ["10.0.0.1"]})
+        storage.db().acl_units.insert_one({"_id": "other:10.0.0.0/24", "instance": "other",
+                                           "units": ["10.0.0.1"]})
+        self.addCleanup(storage.db().acl_units.remove, {})
+        storage.remove_instance(instance)
+        self.assertEqual(["other:10.0.0.0/24"],
+                         [doc["_id"] for doc in storage.db().acl_units.find()])
+
+    def test_ensure_indexes(self):
+        from redisapi.storage import MongoStorage, ensure_indexes
+        ensure_indexes()
+        db = MongoStorage().db()
+        indexes = db.instances.index_information()
+        self.assertIn([("name", 1)], [i["key"] for i in indexes.values()])
+        self.assertTrue(indexes["name_1"]["unique"])
+        self.assertIn("endpoints.host_1", indexes)
+        self.assertIn("host_1_port_1", db.zabbix.index_information())
+        self.assertIn("host_1", db.free_ports.index_information())
+        self.assertIn("instance_1", db.acl_units.index_information())
+        self.assertIn("plan_1_host_1_created_at_1", db.warm_containers.index_information())
+        self.assertIn("status_1_updated_at_1", db.sagas.index_information())
+
+    @mock.patch("redisapi.storage.logger")
+    def test_ensure_indexes_with_duplicate_names(self, logger):
+        from pymongo.errors import DuplicateKeyError
+        from redisapi.storage import ensure_indexes
+        db = mock.MagicMock()
+
+        def create_index(keys, **options):
+            if options.get("unique") and keys == "name":
+                raise DuplicateKeyError("E11000 duplicate key error")
+        db.__getitem__.return_value.create_index.side_effect = create_index
+        self.assertEqual(1, ensure_indexes(db))
+        self.assertEqual(9, db.__getitem__.return_value.create_index.call_count)
+        self.assertTrue(logger.exception.called)
@@ -0,0 +1,90 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import unittest
+
+import mock
+
+from redisapi import utils
+
+
+class GetValueTest(unittest.TestCase):
+
+    def test_get_value(self):
+        with mock.patch.dict(os.environ, {"REDISAPI_TEST_VALUE": "value"}):
+            self.assertEqual("value", utils.get_value("REDISAPI_TEST_VALUE"))
+
+    def test_get_value_undefined(self):
+        self.assertRaises(Exception, utils.get_value, "REDISAPI_UNDEFINED_VALUE")
+
+
+class ParallelMapTest(unittest.TestCase):
+
+    def test_keeps_order(self):
+        self.assertEqual([2, 4, 6], utils.parallel_map(lambda x: x * 2, [1, 2, 3]))
+
+    def test_single_item(self):
+        self.assertEqual([2], utils.parallel_map(lambda x: x * 2, [1]))
+
+    def test_gevent_not_patched(self):
+        self.assertFalse(utils.gevent_patched())
+
+    @mock.patch("redisapi.utils.gevent_patched", return_value=True)
+    @mock.patch("multiprocessing.pool.ThreadPool")
+    def test_greenlets_in_gevent_workers(self, ThreadPool, patched):
+        self.assertEqual([2, 4, 6], utils.parallel_map(lambda x: x * 2, [1, 2, 3]))
+        self.assertFalse(ThreadPool.called)
+
+
+class PerProcessTest(unittest.TestCase):
+
+    @mock.patch("os.getpid")
+    def test_per_process(self, getpid):
+        built = []
+
+        def factory(*args):
+            built.append(args)
+            return object()
+
+        get = utils.per_process(factory)
+        getpid.return_value = 100
+        value = get()
+        self.assertIs(value, get())
+        self.assertIsNot(get("other"), get())
+        self.assertIs(get("other"), get("other"))
+        getpid.return_value = 101
+        self.assertIsNot(value, get())
+        get.reset()
+        get()
+        self.assertEqual([(), ("other",), (), ()], built)
+
+
+class WaitForTest(unittest.TestCase):
+
+    @mock.patch("time.sleep")
+    def test_backoff(self, sleep):
+        check = mock.Mock(side_effect=[False, None, ValueError("not yet"), "ready"])
+        self.assertEqual("ready", utils.wait_for(check, 10, errors=(ValueError,)))
+        self.assertEqual([mock.call(0.01), mock.call(0.02), mock.call(0.04)],
+                         sleep.call_args_list)
+
+    @mock.patch("time.sleep")
+    def test_max_interval(self, sleep):
+        check = mock.Mock(side_effect=[False] * 5 + [True])
+        utils.wait_for(check, 10, interval=0.1, max_interval=0.3)
+        self.assertEqual([0.1, 0.2, 0.3, 0.3, 0.3], [c[0][0] for c in sleep.call_args_list])
+
+    def test_timeout(self):
+        check = mock.Mock(side_effect=ValueError("connection refused"))
+        with self.assertRaises(utils.WaitTimeout) as cm:
+            utils.wait_for(check, 0.05, errors=(ValueError,))
+        self.assertIn("connection refused", str(cm.exception))
+        self.assertGreater(check.call_count, 1)
+
+    def test_unexpected_errors_propagate(self):
+        check = mock.Mock(side_effect=KeyError("bug"))
+        with self.assertRaises(KeyError):
+            utils.wait_for(check, 10, errors=(ValueError,))
+        self.assertEqual(1, check.call_count)
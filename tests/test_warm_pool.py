@@ -0,0 +1,117 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import unittest
+
+import mock
+
+from redisapi import warm_pool
+from redisapi.warm_pool import WarmPool, WarmPoolCollector
+
+
+class WarmPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WarmPool(2)
+        self.addCleanup(self.pool.collection().remove)
+
+    def endpoint(self, host, port):
+        return {"host": host, "port": port, "container_id": "{}-{}".format(host, port)}
+
+    def test_claim(self):
+        self.pool.add(self.endpoint("host1", 49153), "basic")
+        self.pool.add(self.endpoint("host1", 49154), "basic")
+        self.pool.add(self.endpoint("host2", 49153), "basic")
+        self.assertEqual(self.endpoint("host1", 49153), self.pool.claim("host1", "basic"))
+        self.assertEqual(self.endpoint("host1", 49154), self.pool.claim("host1", "basic"))
+        self.assertIsNone(self.pool.claim("host1", "basic"))
+        self.assertEqual({"host2": 1}, self.pool.counts("basic"))
+
+    def test_claim_metrics(self):
+        from prometheus_client import REGISTRY
+        hits = REGISTRY.get_sample_value("redisapi_warm_pool_claims_total", {"result": "hit"})
+        misses = REGISTRY.get_sample_value("redisapi_warm_pool_claims_total", {"result": "miss"})
+        self.pool.add(self.endpoint("host1", 49153), "basic")
+        self.pool.claim("host1", "basic")
+        self.pool.claim("host1", "basic")
+        self.assertEqual((hits or 0) + 1, REGISTRY.get_sample_value(
+            "redisapi_warm_pool_claims_total", {"result": "hit"}))
+        self.assertEqual((misses or 0) + 1, REGISTRY.get_sample_value(
+            "redisapi_warm_pool_claims_total", {"result": "miss"}))
+
+    def manager(self):
+        manager = mock.Mock(plan="basic")
+        manager.available_hosts.return_value = ["http://host1:4243", "http://host2:4243"]
+        manager.extract_hostname.side_effect = lambda url: url[7:12]
+        ports = iter(range(49153, 49200))
+        manager.create_redis_container.side_effect = lambda url: self.endpoint(url[7:12],
+                                                                               next(ports))
+        return manager
+
+    def test_replenish(self):
+        manager = self.manager()
+        self.pool.add(self.endpoint("host1", 40000), "basic")
+        self.assertEqual((3, 0), self.pool.replenish(manager))
+        self.assertEqual({"host1": 2, "host2": 2}, self.pool.counts("basic"))
+        self.assertEqual([mock.call("http://host1:4243"), mock.call("http://host2:4243"),
+                          mock.call("http://host2:4243")],
+                         manager.create_redis_container.call_args_list)
+        self.assertEqual((0, 0), self.pool.replenish(manager))
+
+    def test_replenish_removes_extra_containers(self):
+        manager = self.manager()
+        for port in (40000, 40001, 40002):
+            self.pool.add(self.endpoint("host1", port), "basic")
+        self.pool.size = 1
+        self.assertEqual((1, 2), self.pool.replenish(manager))
+        manager.remove_container.assert_has_calls([
+            mock.call(self.endpoint("host1", 40000)), mock.call(self.endpoint("host1", 40001))])
+        self.assertEqual({"host1": 1, "host2": 1}, self.pool.counts("basic"))
+
+    def test_replenish_host_failure(self):
+        manager = self.manager()
+        manager.create_redis_container.side_effect = Exception("host down")
+        self.assertEqual((0, 0), self.pool.replenish(manager))
+        self.assertEqual(2, manager.create_redis_container.call_count)
+
+    def test_plans_are_kept_apart(self):
+        self.pool.add(self.endpoint("host1", 49153), "plus")
+        self.assertIsNone(self.pool.claim("host1", "basic"))
+        self.assertEqual({}, self.pool.counts("basic"))
+        self.assertEqual({"host1": 1}, self.pool.counts("plus"))
+        self.assertEqual(self.endpoint("host1", 49153), self.pool.claim("host1", "plus"))
+
+    def test_prune(self):
+        manager = self.manager()
+        self.pool.add(self.endpoint("host1", 49153), "basic")
+        self.pool.add(self.endpoint("host1", 49154), "plus")
+        self.pool.collection().insert_one({"_id": "old", "host": "host2", "port": 49155,
+                                           "created_at": 0})
+        self.assertEqual(2, self.pool.prune(manager, ["basic"]))
+        self.assertItemsEqual(
+            [mock.call(self.endpoint("host1", 49154)),
+             mock.call({"host": "host2", "port": 49155, "container_id": "old"})],
+            manager.remove_container.call_args_list)
+        self.assertEqual({("basic", "host1"): 1}, self.pool.totals())
+
+    def test_collector(self):
+        self.pool.add(self.endpoint("host1", 49153), "basic")
+        self.pool.add(self.endpoint("host1", 49154), "basic")
+        with mock.patch.dict(os.environ, {"WARM_POOL_SIZE": "2"}):
+            metric, = WarmPoolCollector().collect()
+        self.assertEqual("redisapi_warm_pool_containers", metric.name)
+        labels = {"plan": "basic", "host": "host1"}
+        self.assertEqual([("redisapi_warm_pool_containers", labels, 2)],
+                         [sample[:3] for sample in metric.samples])
+
+    def test_collector_disabled(self):
+        self.pool.add(self.endpoint("host1", 49153), "basic")
+        metric, = WarmPoolCollector().collect()
+        self.assertEqual([], metric.samples)
+
+    def test_pool_size(self):
+        self.assertEqual(0, warm_pool.pool_size())
+        with mock.patch.dict(os.environ, {"WARM_POOL_SIZE": "3"}):
+            self.assertEqual(3, warm_pool.pool_size())
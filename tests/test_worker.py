@@ -0,0 +1,81 @@
+# Copyright 2015 redisapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import unittest
+
+import mock
+
+from redisapi import worker
+from redisapi.jobs import JobQueue
+from redisapi.storage import Instance
+
+
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue()
+
+    def tearDown(self):
+        self.queue.collection().remove()
+        self.queue.locks().remove()
+
+    @mock.patch("redisapi.worker.MongoStorage")
+    @mock.patch("redisapi.worker.manager_by_plan_name")
+    def test_process_add(self, manager_by_plan_name, MongoStorage):
+        manager = manager_by_plan_name.return_value
+        worker.process({"action": "add", "name": "myredis", "plan": "basic"})
+        manager_by_plan_name.assert_called_with("basic")
+        manager.add_instance.assert_called_with("myredis")
+        MongoStorage.return_value.save_instance.assert_called_with(
+            manager.add_instance.return_value)
+
+    @mock.patch("redisapi.worker.MongoStorage")
+    @mock.patch("redisapi.worker.manager_by_plan_name")
+    def test_process_add_failure(self, manager_by_plan_name, MongoStorage):
+        manager_by_plan_name.return_value.add_instance.side_effect = Exception("down")
+        with self.assertRaises(Exception):
+            worker.process({"action": "add", "name": "myredis", "plan": "basic"})
+        MongoStorage.return_value.set_status.assert_called_with("myredis", "failed")
+        self.assertFalse(MongoStorage.return_value.save_instance.called)
+
+    @mock.patch("redisapi.worker.MongoStorage")
+    @mock.patch("redisapi.worker.manager_by_instance")
+    def test_process_remove(self, manager_by_instance, MongoStorage):
+        storage = MongoStorage.return_value
+        instance = Instance("myredis", "basic", [])
+        storage.find_instance_by_name.return_value = instance
+        worker.process({"action": "remove", "name": "myredis"})
+        storage.find_instance_by_name.assert_called_with("myredis")
+        manager_by_instance.return_value.remove_instance.assert_called_with(instance)
+        storage.remove_instance.assert_called_with(instance)
+
+    def test_process_unknown_action(self):
+        with self.assertRaises(ValueError):
+            worker.process({"action": "explode", "name": "myredis"})
+
+    def test_heartbeat(self):
+        queue = mock.Mock()
+        job = {"_id": 1}
+        with worker.Heartbeat(queue, job, 0.001) as heartbeat:
+            while not queue.heartbeat.called:
+                heartbeat.stopped.wait(0.001)
+        queue.heartbeat.assert_called_with(job)
+        self.assertFalse(heartbeat.thread.is_alive())
+
+    @mock.patch("redisapi.worker.process")
+    def test_run_once(self, process):
+        self.assertFalse(worker.run_once(self.queue))
+        self.queue.enqueue("add", "myredis", plan="basic")
+        self.assertTrue(worker.run_once(self.queue))
+        self.assertEqual("done", self.queue.last_job("myredis")["status"])
+
+    @mock.patch("redisapi.worker.logger")
+    @mock.patch("redisapi.worker.process")
+    def test_run_once_failure(self, process, logger):
+        process.side_effect = Exception("docker is down")
+        self.queue.enqueue("add", "myredis", plan="basic")
+        self.assertTrue(worker.run_once(self.queue))
+        job = self.queue.last_job("myredis")
+        self.assertEqual("failed", job["status"])
+        self.assertEqual("docker is down", job["error"])